@@ -3,13 +3,27 @@ import pandas as pd
 import jdatetime
 from datetime import datetime
 import plotly.express as px
-import plotly.graph_objects as go
 
-from database import initialize_database, update_database_schema, get_connection
+from database import (
+    connection, get_strategies, get_monthly_pnl, get_trade_links, get_portfolio_snapshot,
+    get_asset_stats, get_trade_category_counts, get_pool_stats
+)
 from portfolio import show_portfolio_page
 from trades import show_trades_page
 from backup import show_backup_page
-from utils import convert_to_jalali, convert_to_gregorian, format_number
+from charts import (
+    show_chart, create_monthly_pnl_chart, create_performance_chart, create_trade_count_chart,
+    create_category_chart
+)
+from migrations import ensure_schema
+from profiling import DEBUG_PANEL, finish_profile, start_profile
+from query_cache import get_query_cache_stats
+from slow_queries import SLOW_QUERY_LOG
+from utils import convert_to_jalali, convert_to_gregorian
+from formatting import format_numbers
+
+# Record every statement and section time of this rerun (see profiling.py)
+profile = start_profile()
 
 # Set page config
 st.set_page_config(
@@ -36,33 +50,17 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# Initialize database
-initialize_database()
-# Update database schema (add new columns if needed)
-update_database_schema()
+# Bring the database schema up to date (runs once per server process)
+with profile.section("راه‌اندازی"):
+    ensure_schema()
 
 # Set application title
 st.title("سیستم مدیریت پورتفولیو و ژورنال معاملاتی")
 
-# Create tabs for different sections of the application
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
-    "پورتفولیو", 
-    "ژورنال معاملات", 
-    "استراتژی", 
-    "گزارشات",
-    "پشتیبان‌گیری"
-])
-
-# Portfolio Tab
-with tab1:
-    show_portfolio_page()
-
-# Trading Journal Tab
-with tab2:
-    show_trades_page()
-
-# Strategy Tab
-with tab3:
+def show_strategy_page():
+    """
+    Display the strategy page: the form for a new strategy and the saved ones.
+    """
     st.header("استراتژی مدیریت پورتفولیو")
     
     # Strategy Input
@@ -73,31 +71,27 @@ with tab3:
         risk_level = st.select_slider("سطح ریسک", options=["بسیار کم", "کم", "متوسط", "زیاد", "بسیار زیاد"], key="risk_level")
         
         if st.button("ذخیره استراتژی", key="save_strategy"):
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Check if using PostgreSQL or SQLite
-            from database import USE_SQLITE
-            if USE_SQLITE:
-                cursor.execute('''
-                    INSERT INTO strategies (name, description, asset_allocation, risk_level, created_at)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (strategy_name, strategy_desc, asset_allocation, risk_level, datetime.now()))
-            else:
-                cursor.execute('''
-                    INSERT INTO strategies (name, description, asset_allocation, risk_level, created_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (strategy_name, strategy_desc, asset_allocation, risk_level, datetime.now()))
+            with connection() as conn:
+                cursor = conn.cursor()
+                
+                # Check if using PostgreSQL or SQLite
+                from database import USE_SQLITE
+                if USE_SQLITE:
+                    cursor.execute('''
+                        INSERT INTO strategies (name, description, asset_allocation, risk_level, created_at)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (strategy_name, strategy_desc, asset_allocation, risk_level, datetime.now()))
+                else:
+                    cursor.execute('''
+                        INSERT INTO strategies (name, description, asset_allocation, risk_level, created_at)
+                        VALUES (%s, %s, %s, %s, %s)
+                    ''', (strategy_name, strategy_desc, asset_allocation, risk_level, datetime.now()))
             
-            conn.commit()
-            conn.close()
             st.success("استراتژی با موفقیت ذخیره شد.")
             st.rerun()
     
     # Display defined strategies
-    conn = get_connection()
-    strategies_df = pd.read_sql('SELECT * FROM strategies ORDER BY created_at DESC', conn)
-    conn.close()
+    strategies_df = get_strategies()
     
     if not strategies_df.empty:
         for _, strategy in strategies_df.iterrows():
@@ -111,183 +105,84 @@ with tab3:
     else:
         st.info("هنوز استراتژی تعریف نشده است.")
 
-# Reports Tab
-with tab4:
+def show_reports_page():
+    """
+    Display the reports page: monthly profit/loss, asset performance and
+    reinvestment reports.
+    """
     st.header("گزارشات و تحلیل‌ها")
     
-    # Get data for reports
-    conn = get_connection()
-    trades_df = pd.read_sql('SELECT * FROM trades', conn)
-    assets_df = pd.read_sql('SELECT * FROM assets', conn)
-    conn.close()
+    # Get data for reports. The asset_stats rollup has a row for every
+    # traded asset, so it also tells whether any trade was recorded.
+    asset_stats = get_asset_stats()
+    holdings_df = get_portfolio_snapshot()['holdings']
     
-    if not trades_df.empty:
-        # Convert dates for display
-        trades_df['trade_date'] = pd.to_datetime(trades_df['trade_date'])
-        trades_df['jalali_date'] = trades_df['trade_date'].apply(lambda x: convert_to_jalali(x).strftime('%Y/%m/%d'))
-        
+    if not asset_stats.empty:
         # Monthly profit/loss report
         st.subheader("گزارش سود/زیان ماهانه")
         
-        # Extract year and month for grouping
-        trades_df['year_month'] = trades_df['trade_date'].dt.strftime('%Y-%m')
-        
-        # Calculate realized profit/loss by month
-        monthly_pnl = trades_df[trades_df['trade_type'] == 'فروش'].groupby('year_month').agg({
-            'profit_loss': 'sum'
-        }).reset_index()
+        # Realized profit/loss by Jalali month, aggregated in SQL
+        monthly_pnl = get_monthly_pnl()
         
         if not monthly_pnl.empty:
-            fig = px.bar(
-                monthly_pnl, 
-                x='year_month', 
-                y='profit_loss',
-                color='profit_loss',
-                color_continuous_scale=['#FF5757', '#FFBD59', '#4CAF50'],
-                labels={'year_month': 'ماه', 'profit_loss': 'سود/زیان (تومان)'},
-                title='سود/زیان ماهانه'
-            )
-            fig.update_layout(
-                xaxis_title="ماه", 
-                yaxis_title="سود/زیان (تومان)",
-                font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            show_chart(create_monthly_pnl_chart, monthly_pnl)
         else:
             st.info("داده‌ای برای نمایش گزارش ماهانه وجود ندارد.")
         
         # Asset performance
         st.subheader("عملکرد دارایی‌ها")
         
-        if not assets_df.empty:
-            # Calculate performance by asset
-            asset_performance = assets_df.copy()
-            asset_performance['performance_pct'] = (asset_performance['current_price'] - 
-                                                asset_performance['avg_buy_price']) / asset_performance['avg_buy_price'] * 100
+        if not holdings_df.empty:
+            # Return of every asset, as computed by the portfolio snapshot
+            show_chart(create_performance_chart, holdings_df[['asset_name', 'profit_loss_pct']])
             
-            fig = px.bar(
-                asset_performance, 
-                x='asset_name', 
-                y='performance_pct',
-                color='performance_pct',
-                color_continuous_scale=['#FF5757', '#FFBD59', '#4CAF50'],
-                labels={'asset_name': 'دارایی', 'performance_pct': 'بازدهی (%)'},
-                title='بازدهی دارایی‌ها'
-            )
-            fig.update_layout(
-                xaxis_title="دارایی", 
-                yaxis_title="بازدهی (%)",
-                font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-            )
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # Trade count by asset
-            trade_counts = trades_df.groupby('asset_name').size().reset_index(name='count')
-            fig = px.pie(
-                trade_counts, 
-                values='count', 
-                names='asset_name', 
-                title='تعداد معاملات بر اساس دارایی',
-                color_discrete_sequence=px.colors.qualitative.Pastel
-            )
-            fig.update_layout(
-                font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            # Trade count by asset, from the asset_stats rollup
+            trade_counts = pd.DataFrame({'asset_name': asset_stats['asset_name'],
+                                         'count': asset_stats['buys'] + asset_stats['sells']})
+            show_chart(create_trade_count_chart, trade_counts)
             
             # Related trades report
             st.subheader("گزارش سرمایه‌گذاری مجدد")
-            related_trades = trades_df[(pd.notna(trades_df['related_trade_id'])) & (trades_df['trade_type'] == 'خرید')]
+            # Buy→sale links resolved in SQL by the trade_links view, one row
+            # per sale funding a buy with the part of the buy it paid
+            trade_links = get_trade_links()
             
-            if not related_trades.empty:
-                # Create a dataframe for relationship visualization
-                relationship_data = []
-                for _, row in related_trades.iterrows():
-                    related_sale = trades_df[trades_df['id'] == row['related_trade_id']]
-                    if not related_sale.empty:
-                        sale_row = related_sale.iloc[0]
-                        relationship_data.append({
-                            'buy_date': row['jalali_date'],
-                            'buy_asset': row['asset_name'],
-                            'buy_amount': row['total_amount'],
-                            'sale_date': sale_row['jalali_date'],
-                            'sale_asset': sale_row['asset_name'],
-                            'sale_amount': sale_row['total_amount'],
-                            'percentage': (row['total_amount'] / sale_row['total_amount'] * 100)
-                        })
+            if not trade_links.empty:
+                relationship_df = trade_links[[
+                    'buy_jalali_date', 'buy_asset', 'buy_amount',
+                    'sale_jalali_date', 'sale_asset', 'sale_amount', 'funded_amount'
+                ]].copy()
+                relationship_df['percentage'] = relationship_df['funded_amount'] / relationship_df['sale_amount'] * 100
+                
+                # Format for display
+                relationship_df['buy_amount'] = format_numbers(relationship_df['buy_amount'])
+                relationship_df['sale_amount'] = format_numbers(relationship_df['sale_amount'])
+                relationship_df['funded_amount'] = format_numbers(relationship_df['funded_amount'])
+                relationship_df['percentage'] = relationship_df['percentage'].map('{:.1f}%'.format)
+                
+                # Rename columns
+                relationship_df.columns = [
+                    'تاریخ خرید', 'دارایی خریداری شده', 'مبلغ خرید (تومان)',
+                    'تاریخ فروش', 'دارایی فروخته شده', 'مبلغ فروش (تومان)',
+                    'مبلغ تأمین شده (تومان)', 'درصد استفاده شده'
+                ]
                 
-                if relationship_data:
-                    relationship_df = pd.DataFrame(relationship_data)
-                    
-                    # Format for display
-                    relationship_df['buy_amount'] = relationship_df['buy_amount'].apply(format_number)
-                    relationship_df['sale_amount'] = relationship_df['sale_amount'].apply(format_number)
-                    relationship_df['percentage'] = relationship_df['percentage'].apply(lambda x: f"{x:.1f}%")
-                    
-                    # Rename columns
-                    relationship_df.columns = [
-                        'تاریخ خرید', 'دارایی خریداری شده', 'مبلغ خرید (تومان)',
-                        'تاریخ فروش', 'دارایی فروخته شده', 'مبلغ فروش (تومان)',
-                        'درصد استفاده شده'
-                    ]
-                    
-                    st.dataframe(relationship_df, use_container_width=True)
-                    
-                    # Trade category distribution
-                    if 'trade_category' in trades_df.columns:
-                        buy_categories = trades_df[trades_df['trade_type'] == 'خرید']['trade_category'].value_counts().reset_index()
-                        buy_categories.columns = ['دسته‌بندی', 'تعداد']
-                        
-                        # دسته‌بندی خریدها
-                        fig = px.pie(
-                            buy_categories, 
-                            values='تعداد', 
-                            names='دسته‌بندی', 
-                            title='دسته‌بندی خریدها',
-                            color_discrete_sequence=px.colors.qualitative.Bold
-                        )
-                        fig.update_layout(
-                            font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-                            title_font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=18),
-                            legend_title_font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-                            legend_font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=12),
-                            paper_bgcolor='rgba(255,255,255,0.7)',
-                            margin=dict(l=20, r=20, t=60, b=20),
-                            hoverlabel=dict(font_size=12, font_family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif")
-                        )
-                        fig.update_traces(
-                            textfont=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-                            marker=dict(line=dict(color='#FFFFFF', width=2)),
-                            hovertemplate='<b>%{label}</b><br>تعداد: %{value}<br>درصد: %{percent}<extra></extra>'
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
-                        
-                        # دسته‌بندی فروش‌ها
-                        sell_categories = trades_df[trades_df['trade_type'] == 'فروش']['trade_category'].value_counts().reset_index()
-                        sell_categories.columns = ['دسته‌بندی', 'تعداد']
-                        
-                        fig = px.pie(
-                            sell_categories, 
-                            values='تعداد', 
-                            names='دسته‌بندی', 
-                            title='دسته‌بندی فروش‌ها',
-                            color_discrete_sequence=px.colors.qualitative.Vivid
-                        )
-                        fig.update_layout(
-                            font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-                            title_font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=18),
-                            legend_title_font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-                            legend_font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=12),
-                            paper_bgcolor='rgba(255,255,255,0.7)',
-                            margin=dict(l=20, r=20, t=60, b=20),
-                            hoverlabel=dict(font_size=12, font_family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif")
-                        )
-                        fig.update_traces(
-                            textfont=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-                            marker=dict(line=dict(color='#FFFFFF', width=2)),
-                            hovertemplate='<b>%{label}</b><br>تعداد: %{value}<br>درصد: %{percent}<extra></extra>'
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
+                st.dataframe(relationship_df, use_container_width=True)
+                
+                # Trade category distribution, counted in SQL
+                buy_categories = get_trade_category_counts('خرید')
+                buy_categories.columns = ['دسته‌بندی', 'تعداد']
+                
+                # دسته‌بندی خریدها
+                show_chart(create_category_chart, buy_categories, chart_id='buy_categories', title='دسته‌بندی خریدها',
+                           colors=px.colors.qualitative.Bold)
+                
+                # دسته‌بندی فروش‌ها
+                sell_categories = get_trade_category_counts('فروش')
+                sell_categories.columns = ['دسته‌بندی', 'تعداد']
+                
+                show_chart(create_category_chart, sell_categories, chart_id='sell_categories', title='دسته‌بندی فروش‌ها',
+                           colors=px.colors.qualitative.Vivid)
             else:
                 st.info("هنوز معامله‌ای با استفاده از منابع حاصل از فروش انجام نشده است.")
         else:
@@ -295,6 +190,121 @@ with tab4:
     else:
         st.info("برای نمایش گزارشات، ابتدا معاملات خود را ثبت کنید.")
 
-# Backup Tab
-with tab5:
-    show_backup_page()
+# Sections of the application. Only the one selected in the sidebar runs,
+# so a rerun caused by one section doesn't query or draw the others.
+SECTIONS = {
+    "پورتفولیو": show_portfolio_page,
+    "ژورنال معاملات": show_trades_page,
+    "استراتژی": show_strategy_page,
+    "گزارشات": show_reports_page,
+    "پشتیبان‌گیری": show_backup_page,
+}
+
+# Widgets that keep their values while their section is hidden. Streamlit
+# forgets the state of widgets that were not rendered in a run. Their
+# initial values must be set in session_state, not passed as value= or
+# index=, or Streamlit warns that a restored widget also has a default.
+PERSISTENT_WIDGET_KEYS = [
+    # Trade form
+    'asset_type', 'asset_selection', 'new_asset', 'trade_type', 'jalali_date', 'quantity',
+    'currency', 'price', 'sale_search', 'is_profit_sale_checkbox', 'notes',
+    # Trade history
+    'history_asset_type', 'history_trade_type', 'history_start_date', 'history_end_date',
+    'history_page_size', 'history_numeric_display', 'trade_search',
+    # Strategy form
+    'strategy_name', 'strategy_desc', 'asset_allocation', 'risk_level',
+]
+
+def keep_widget_state():
+    """
+    Save the values of PERSISTENT_WIDGET_KEYS and restore the ones Streamlit
+    dropped while their section was hidden.
+    """
+    saved_state = st.session_state.setdefault('saved_widget_state', {})
+    for key in PERSISTENT_WIDGET_KEYS:
+        if key in st.session_state:
+            saved_state[key] = st.session_state[key]
+        elif key in saved_state:
+            st.session_state[key] = saved_state[key]
+
+def show_section_timings(active_section):
+    """
+    Show in the sidebar how long each section took the last time it ran,
+    and how long building and serializing each chart of this rerun took.
+    
+    Args:
+        active_section (str): Section that ran in this rerun
+    """
+    timings = st.session_state.get('section_timings', {})
+    with st.sidebar.expander("زمان اجرای بخش‌ها"):
+        for section in SECTIONS:
+            if section == active_section:
+                st.write(f"**{section}:** {timings[section] * 1000:.0f} میلی‌ثانیه")
+            elif section in timings:
+                st.write(f"{section}: در این اجرا اجرا نشد (آخرین اجرا {timings[section] * 1000:.0f} میلی‌ثانیه)")
+            else:
+                st.write(f"{section}: اجرا نشد")
+
+        # Charts drawn by this rerun, see charts.show_chart()
+        for chart, timing in st.session_state.get('chart_timings', {}).items():
+            build = "از حافظه" if timing['cached'] else f"ساخت {timing['build_time'] * 1000:.0f}"
+            st.write(f"نمودار {chart}: {build}، ارسال {timing['serialize_time'] * 1000:.0f} میلی‌ثانیه")
+
+def show_debug_panel(profile):
+    """
+    Show the statements and timings of this rerun in the sidebar, with
+    statements repeated often enough to suggest an N+1 pattern, and offer
+    them as JSON or Prometheus text.
+
+    Args:
+        profile (RerunProfile): Finished profile of this rerun
+    """
+    summary = profile.to_dict()
+    with st.sidebar.expander("اشکال‌زدایی: پرس‌وجوهای این اجرا", expanded=True):
+        st.write(f"زمان اجرا: {summary['elapsed'] * 1000:.0f} میلی‌ثانیه")
+        st.write(f"پرس‌وجوها: {summary['statements']} "
+                 f"({summary['db_seconds'] * 1000:.0f} میلی‌ثانیه، {summary['rows']} ردیف)")
+        if summary['slow_statements']:
+            st.write(f"پرس‌وجوهای کند: {summary['slow_statements']} (در {SLOW_QUERY_LOG} ثبت شد)")
+
+        sections_df = pd.DataFrame(summary['sections'])
+        if not sections_df.empty:
+            sections_df[['seconds', 'db_seconds']] = sections_df[['seconds', 'db_seconds']] * 1000
+            st.dataframe(sections_df.rename(columns={
+                'section': 'بخش', 'seconds': 'زمان (ms)', 'statements': 'پرس‌وجو',
+                'db_seconds': 'زمان پایگاه داده (ms)', 'rows': 'ردیف'
+            }), hide_index=True)
+
+        for statement in profile.repeated_statements():
+            st.warning(f"{statement['count']} بار اجرا شد (احتمال N+1): {statement['sql'][:200]}")
+
+        statements_df = pd.DataFrame(summary['statement_summary'][:20])
+        if not statements_df.empty:
+            statements_df['duration'] = statements_df['duration'] * 1000
+            st.dataframe(statements_df.rename(columns={
+                'sql': 'پرس‌وجو', 'count': 'تعداد', 'duration': 'زمان (ms)', 'rows': 'ردیف'
+            }), hide_index=True)
+
+        cache_stats = get_query_cache_stats()
+        st.write(f"حافظه پرس‌وجو: {cache_stats['hits']} برخورد، {cache_stats['misses']} خطا، "
+                 f"{cache_stats['size']} مورد")
+        st.write("اتصال‌ها:", get_pool_stats())
+
+        st.download_button("دریافت JSON", profile.to_json(), file_name="rerun_profile.json",
+                           mime="application/json")
+        st.download_button("دریافت Prometheus", profile.to_prometheus(), file_name="rerun_profile.prom",
+                           mime="text/plain")
+
+keep_widget_state()
+
+active_section = st.sidebar.radio("بخش‌ها", list(SECTIONS), key="active_section")
+
+st.session_state['chart_timings'] = {}
+with profile.section(active_section):
+    SECTIONS[active_section]()
+st.session_state.setdefault('section_timings', {})[active_section] = profile.sections[active_section]
+
+finish_profile()
+show_section_timings(active_section)
+if DEBUG_PANEL or st.query_params.get('debug') == '1':
+    show_debug_panel(profile)
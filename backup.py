@@ -2,7 +2,12 @@ import os
 import shutil
 import datetime
 import streamlit as st
-from database import get_connection, USE_SQLITE
+from database import (
+    get_connection, close_all_connections, rebuild_all_positions, USE_SQLITE,
+    asset_triggers_enabled, enable_asset_triggers, disable_asset_triggers, check_asset_consistency,
+    check_rollup_consistency
+)
+from migrations import reset_schema_check
 
 def create_backup():
     """
@@ -111,19 +116,16 @@ def restore_backup(backup_file):
             backup_path = os.path.join("backups", backup_file)
             original_db = "portfolio.db"
             
-            # First close any open connections
-            # This is simplified; in a real app, you might need to handle
-            # open connections more carefully
-            import sqlite3
-            try:
-                conn = sqlite3.connect(original_db)
-                conn.close()
-            except:
-                pass
+            # First close the pooled connections so none of them keeps
+            # reading the old file after it has been replaced
+            close_all_connections()
                 
             # Restore by copying the backup over the original
             shutil.copy2(backup_path, original_db)
             
+            # The backup may predate some migrations
+            reset_schema_check()
+            
             return True
         else:
             # PostgreSQL restore using pg_restore
@@ -142,6 +144,10 @@ def restore_backup(backup_file):
                 env = os.environ.copy()
                 env["PGPASSWORD"] = password
                 
+                # Release pooled connections so they don't hold locks on
+                # the objects pg_restore drops and recreates
+                close_all_connections()
+                
                 # Execute pg_restore
                 import subprocess
                 cmd = [
@@ -158,6 +164,8 @@ def restore_backup(backup_file):
                 process = subprocess.run(cmd, env=env, capture_output=True, text=True)
                 
                 if process.returncode == 0:
+                    # The backup may predate some migrations
+                    reset_schema_check()
                     return True
                 else:
                     print(f"Error restoring PostgreSQL backup: {process.stderr}")
@@ -209,6 +217,54 @@ def show_backup_page():
             else:
                 st.warning("لطفاً تأیید کنید که می‌خواهید نسخه پشتیبان را بازیابی کنید")
     
+    st.subheader("بازسازی موقعیت دارایی‌ها")
+    st.write("پس از بازیابی یا وارد کردن معاملات، تعداد، میانگین قیمت خرید و سود/زیان همه دارایی‌ها را از روی معاملات دوباره محاسبه کنید.")
+    if st.button("بازسازی همه دارایی‌ها"):
+        progress_bar = st.progress(0.0)
+        result = rebuild_all_positions(
+            progress=lambda step, total, message: progress_bar.progress((step - 1) / total, text=message)
+        )
+        progress_bar.progress(1.0)
+        if result:
+            st.success(
+                f"{result['assets']} دارایی و {result['sales']} معامله فروش "
+                f"در {result['elapsed']:.2f} ثانیه بازسازی شد"
+            )
+            st.caption(" | ".join(f"{name}: {seconds:.3f}s" for name, seconds in result['timings'].items()))
+        else:
+            st.error("خطا در بازسازی دارایی‌ها")
+    
+    st.subheader("نگهداری خودکار دارایی‌ها با تریگر")
+    if asset_triggers_enabled():
+        st.info("دارایی‌ها توسط تریگرهای پایگاه داده با هر تغییر در معاملات به‌روز می‌شوند.")
+        if st.button("غیرفعال کردن تریگرها"):
+            if disable_asset_triggers():
+                st.success("تریگرها غیرفعال شدند")
+                st.rerun()
+            else:
+                st.error("خطا در غیرفعال کردن تریگرها")
+    else:
+        st.info("دارایی‌ها پس از هر معامله توسط برنامه دوباره محاسبه می‌شوند.")
+        if st.button("فعال کردن تریگرها"):
+            with st.spinner("در حال نصب تریگرها و بازسازی دارایی‌ها..."):
+                if enable_asset_triggers():
+                    st.success("تریگرها فعال شدند")
+                    st.rerun()
+                else:
+                    st.error("خطا در فعال کردن تریگرها")
+    
+    if st.button("بررسی سازگاری دارایی‌ها با معاملات"):
+        mismatches = check_asset_consistency()
+        rollup_mismatches = check_rollup_consistency()
+        if mismatches or rollup_mismatches:
+            st.warning(f"{len(mismatches) + len(rollup_mismatches)} مغایرت پیدا شد. برای رفع آن‌ها دارایی‌ها را بازسازی کنید.")
+            if mismatches:
+                st.dataframe(mismatches, use_container_width=True)
+            if rollup_mismatches:
+                st.dataframe(rollup_mismatches, use_container_width=True)
+        else:
+            st.success("همه دارایی‌ها و جمع‌های گزارشات با معاملات سازگار هستند")
+    
     st.subheader("لیست نسخه‌های پشتیبان")
     if not backups:
         st.info("هیچ نسخه پشتیبانی موجود نیست")
@@ -0,0 +1,10 @@
+"""
+Benchmark scripts. Run from the repository root, e.g.
+
+    python -m benchmarks.bench_jalali
+
+bench_suite times the hot functions and pages on journals made by
+benchmarks.journal and writes the results as JSON:
+
+    python -m benchmarks.bench_suite --sizes 1000 10000 100000
+"""
@@ -0,0 +1,64 @@
+"""
+Compare the per-row convert_to_jalali() with the vectorized format_jalali_dates().
+
+    python -m benchmarks.bench_jalali [--size 1000000] [--days 3650]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import convert_to_jalali, format_jalali_dates
+
+
+def make_dates(size, days, seed=0):
+    """
+    Random trade timestamps spread over a number of days.
+
+    Args:
+        size (int): Number of dates
+        days (int): Number of distinct days the dates fall on
+        seed (int): Random seed
+
+    Returns:
+        Series: datetime64 values
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2015-03-21T00:00:00', 's')
+    offsets = rng.integers(0, days, size) * 86400 + rng.integers(0, 86400, size)
+    return pd.Series(start + offsets.astype('timedelta64[s]'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1_000_000, help='number of dates')
+    parser.add_argument('--days', type=int, default=3650, help='number of distinct days')
+    args = parser.parse_args()
+
+    dates = make_dates(args.size, args.days)
+    print(f"{args.size:,} dates over {args.days:,} days")
+
+    started = time.perf_counter()
+    per_row = dates.apply(lambda x: convert_to_jalali(x).strftime('%Y/%m/%d'))
+    per_row_time = time.perf_counter() - started
+    print(f"per-row convert_to_jalali : {per_row_time:8.3f}s")
+
+    started = time.perf_counter()
+    vectorized = format_jalali_dates(dates)
+    vectorized_time = time.perf_counter() - started
+    print(f"format_jalali_dates       : {vectorized_time:8.3f}s")
+
+    # Every distinct day: the worst case for the per-day memo
+    all_days = make_dates(args.size, args.size)
+    started = time.perf_counter()
+    format_jalali_dates(all_days)
+    print(f"  (all dates distinct)    : {time.perf_counter() - started:8.3f}s")
+
+    print(f"speedup                   : {per_row_time / vectorized_time:8.1f}x")
+    if not (per_row.to_numpy(dtype=object) == vectorized.to_numpy(dtype=object)).all():
+        raise SystemExit("results differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Time the hot database functions and the main pages against synthetic
+journals of growing size, and write the results as JSON.
+
+    python -m benchmarks.bench_suite [--sizes 1000 10000 100000] [--repeat 5] [--out bench.json]
+    python -m benchmarks.bench_suite --compare base.json bench.json [--threshold 0.25]
+
+Every size gets a fresh journal from benchmarks.journal in a temporary
+SQLite file; with DATABASE_URL set it goes to that database instead, and
+--force lets it empty the journal tables left by an earlier size. Reads
+are timed with the query cache cleared (cold); pages are run under
+Streamlit's AppTest both cold and warm. --compare prints the median of
+every timing in two result files and exits with status 1 when one got
+slower by more than the threshold (and by more than a millisecond).
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import database
+from benchmarks.journal import generate_journal, use_database
+from charts import clear_chart_cache
+from database import (
+    delete_trade, get_asset_stats, get_available_sale_transactions, get_monthly_pnl,
+    get_portfolio_snapshot, get_trades_page, recalculate_asset_data, record_trade,
+    update_asset_after_trade
+)
+from query_cache import clear_query_cache
+from trades import SALE_OPTIONS_LIMIT
+
+# Differences below this are noise, whatever the ratio
+NOISE_SECONDS = 0.001
+
+# Pages run under AppTest, by the function that draws them
+PAGES = {
+    'show_portfolio_page': "پورتفولیو",
+    'show_trades_page': "ژورنال معاملات",
+    'show_reports_page': "گزارشات",
+}
+
+
+def time_calls(func, repeat, setup=None):
+    """
+    Time repeated calls of a function.
+
+    Args:
+        func (callable): Function to time, called without arguments
+        repeat (int): Number of calls
+        setup (callable, optional): Called untimed before each call
+
+    Returns:
+        dict: min, median and max seconds and the number of runs
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return {'min': min(seconds), 'median': statistics.median(seconds), 'max': max(seconds), 'runs': repeat}
+
+
+def _cold():
+    clear_query_cache()
+    clear_chart_cache()
+
+
+def time_functions(repeat):
+    """
+    Time the hot database functions on the active journal.
+
+    Args:
+        repeat (int): Calls per function
+
+    Returns:
+        dict: Function name mapped to its timings
+    """
+    asset_stats = get_asset_stats()
+    busiest = asset_stats.loc[(asset_stats['buys'] + asset_stats['sells']).idxmax()]
+    holdings = get_portfolio_snapshot()['holdings'].set_index('asset_name')
+    asset_type = holdings.loc[busiest['asset_name'], 'asset_type']
+    price = float(holdings.loc[busiest['asset_name'], 'current_price'])
+    timings = {}
+
+    timings['get_available_sale_transactions'] = time_calls(
+        lambda: get_available_sale_transactions(limit=SALE_OPTIONS_LIMIT), repeat, _cold)
+    timings['get_portfolio_snapshot'] = time_calls(get_portfolio_snapshot, repeat, _cold)
+    timings['get_monthly_pnl'] = time_calls(get_monthly_pnl, repeat, _cold)
+    timings['get_trades_page'] = time_calls(get_trades_page, repeat, _cold)
+
+    timings['update_asset_after_trade'] = time_calls(
+        lambda: update_asset_after_trade(busiest['asset_name'], asset_type, 1, price, 'خرید'), repeat)
+    # Also undoes the updates above
+    timings['recalculate_asset_data'] = time_calls(
+        lambda: recalculate_asset_data(busiest['asset_name'], asset_type), repeat)
+
+    trade_ids = []
+    timings['record_trade'] = time_calls(
+        lambda: trade_ids.append(record_trade(datetime.now(), busiest['asset_name'], asset_type,
+                                              'خرید', 1, price, "benchmark")), repeat)
+    timings['delete_trade'] = time_calls(lambda: delete_trade(trade_ids.pop()), repeat)
+    return timings
+
+
+def time_pages(repeat):
+    """
+    Run the main pages under AppTest, cold and warm.
+
+    Args:
+        repeat (int): Runs per page and cache state
+
+    Returns:
+        dict: '<page> (cold)' and '<page> (warm)' mapped to their timings
+    """
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.abspath('app.py'), default_timeout=600)
+    app.run()
+    timings = {}
+
+    for name, section in PAGES.items():
+        app.sidebar.radio(key='active_section').set_value(section)
+        timings[f'{name} (cold)'] = time_calls(app.run, repeat, _cold)
+        timings[f'{name} (warm)'] = time_calls(app.run, repeat)
+        if app.exception:
+            raise SystemExit(f"{name} raised: {app.exception[0].value}")
+    return timings
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, repeat, seed=0, pages=True, force=False):
+    """
+    Generate a journal of each size and time the functions and pages on it.
+
+    Args:
+        sizes (list): Numbers of trades
+        repeat (int): Calls per timing
+        seed (int): Random seed of the journals
+        pages (bool): Also time the pages under AppTest
+        force (bool): Empty the PostgreSQL journal tables between sizes
+
+    Returns:
+        dict: Environment of the run and the timings of every size
+    """
+    results = {
+        'commit': _commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'backend': 'sqlite' if database.USE_SQLITE else 'postgresql',
+        'sqlite_version': sqlite3.sqlite_version,
+        'python': platform.python_version(),
+        'seed': seed,
+        'repeat': repeat,
+        'sizes': {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            use_database(os.path.join(directory, f'journal_{size}.db'))
+            journal = generate_journal(size, seed, force)
+            print(f"{size:,} trades: generated in {journal['generate_seconds'] + journal['load_seconds']:.1f}s")
+
+            timings = time_functions(repeat)
+            if pages:
+                timings.update(time_pages(repeat))
+            for name, timing in timings.items():
+                print(f"  {name:<40} {timing['median'] * 1000:10.1f} ms")
+
+            results['sizes'][str(size)] = {'journal': journal, 'timings': timings}
+
+        database.close_all_connections()
+    return results
+
+
+def compare(base_path, new_path, threshold):
+    """
+    Print the median timings of two result files side by side.
+
+    Args:
+        base_path (str): Results to compare against
+        new_path (str): New results
+        threshold (float): Relative slowdown reported as a regression
+
+    Returns:
+        int: Number of regressions
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{'':<48} {base['commit'] or base_path:>12} {new['commit'] or new_path:>12}")
+    regressions = 0
+    for size, new_size in new['sizes'].items():
+        base_timings = base['sizes'].get(size, {}).get('timings', {})
+        print(f"{int(size):,} trades")
+        for name, timing in new_size['timings'].items():
+            if name not in base_timings:
+                print(f"  {name:<46} {'-':>12} {timing['median'] * 1000:10.1f}ms")
+                continue
+            ratio = timing['median'] / base_timings[name]['median']
+            slower = ratio > 1 + threshold and timing['median'] - base_timings[name]['median'] > NOISE_SECONDS
+            regressions += slower
+            print(f"  {name:<46} {base_timings[name]['median'] * 1000:10.1f}ms "
+                  f"{timing['median'] * 1000:10.1f}ms {ratio:6.2f}x{'  SLOWER' if slower else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+                        help='numbers of trades')
+    parser.add_argument('--repeat', type=int, default=5, help='calls per timing')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the journals')
+    parser.add_argument('--no-pages', action='store_true', help='skip the AppTest page timings')
+    parser.add_argument('--force', action='store_true', help='empty the PostgreSQL journal tables first')
+    parser.add_argument('--out', default='bench.json', help='file to write the results to')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=0.25, help='slowdown reported as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(*args.compare, args.threshold) else 0)
+
+    results = run_suite(args.sizes, args.repeat, args.seed, not args.no_pages, args.force)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
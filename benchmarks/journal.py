@@ -0,0 +1,262 @@
+"""
+Deterministic synthetic trade journal for the benchmarks.
+
+Fills a fresh database with buys and sells across the usual asset types,
+reinvestment buys funded by earlier sales and a final round of price
+updates. The same size and seed always give the same journal.
+
+    python -m benchmarks.journal --trades 100000 [--db journal.db] [--seed 0] [--force]
+
+With DATABASE_URL set the PostgreSQL database is filled instead; --force
+then empties its journal tables first.
+"""
+import argparse
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_batch
+
+import database
+from database import (
+    close_all_connections, get_connection, rebuild_all_positions, update_asset_prices_bulk,
+    update_cash_balance
+)
+from migrations import ensure_schema, reset_schema_check
+from utils import format_jalali_dates, jalali_components
+
+# (asset name, asset type, price in toman at the start of the journal, weight)
+ASSETS = [
+    ('دلار', 'ارز', 50_000, 8),
+    ('یورو', 'ارز', 55_000, 3),
+    ('درهم', 'ارز', 14_000, 2),
+    ('طلای آبشده', 'طلا', 2_500_000, 5),
+    ('سکه امامی', 'طلا', 30_000_000, 4),
+    ('ربع سکه', 'طلا', 9_000_000, 2),
+    ('فولاد', 'سهام', 500, 4),
+    ('خودرو', 'سهام', 250, 3),
+    ('شستا', 'سهام', 900, 3),
+    ('فملی', 'سهام', 700, 2),
+    ('بیت‌کوین', 'رمزارز', 3_000_000_000, 2),
+    ('اتریوم', 'رمزارز', 150_000_000, 2),
+    ('تتر', 'رمزارز', 52_000, 6),
+]
+
+BUY_CATEGORIES = ["سرمایه‌گذاری جدید", "افزایش سبد", "متنوع‌سازی", "سایر"]
+SELL_CATEGORIES = ["برداشت سود", "کاهش ضرر", "تغییر استراتژی", "نیاز به نقدینگی", "سایر"]
+
+# Tables emptied by --force before a PostgreSQL journal is generated
+JOURNAL_TABLES = ['trade_funding', 'trades', 'assets', 'pnl_monthly', 'asset_stats']
+
+
+def use_database(path):
+    """
+    Point the application at another SQLite file and bring its schema up to date.
+
+    Args:
+        path (str): SQLite database file; ignored when DATABASE_URL is set
+    """
+    database.SQLITE_PATH = path
+    close_all_connections()
+    reset_schema_check()
+    ensure_schema()
+
+
+def make_trades(trades, seed=0, days=5 * 365, sell_share=0.4, reinvest_share=0.3):
+    """
+    Random trades whose sells never exceed the quantity held.
+
+    Args:
+        trades (int): Number of trades
+        seed (int): Random seed
+        days (int): Number of days the journal spans
+        sell_share (float): Chance of a trade being a sell when the asset is held
+        reinvest_share (float): Chance of a buy being funded by earlier sales
+
+    Returns:
+        tuple: (DataFrame of trades with ids 1..n in date order,
+            list of (buy_id, sale_id, amount) funding rows)
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([asset[0] for asset in ASSETS])
+    types = np.array([asset[1] for asset in ASSETS])
+    base_prices = np.array([asset[2] for asset in ASSETS], dtype=float)
+    weights = np.array([asset[3] for asset in ASSETS], dtype=float)
+
+    day = np.sort(rng.integers(0, days, trades))
+    asset = rng.choice(len(ASSETS), trades, p=weights / weights.sum())
+
+    # A yearly drift per asset plus daily noise, rounded like real quotes
+    drift = rng.normal(0.25, 0.1, len(ASSETS))
+    price = base_prices[asset] * np.exp(drift[asset] * day / 365 + rng.normal(0, 0.03, trades))
+    step = 10.0 ** (np.floor(np.log10(base_prices)) - 2)
+    price = np.round(price / step[asset]) * step[asset]
+    # Amounts of 5 to 500 million toman per buy
+    buy_amount = np.exp(rng.uniform(np.log(5e6), np.log(5e8), trades))
+    sell_fraction = rng.uniform(0.1, 0.8, trades)
+    draws = rng.random((trades, 3))
+
+    holdings = np.zeros(len(ASSETS))
+    trade_type = np.empty(trades, dtype=object)
+    quantity = np.empty(trades)
+    category = np.empty(trades, dtype=object)
+    related_trade_id = np.full(trades, None, dtype=object)
+    open_sales = deque()
+    funding = []
+
+    for i in range(trades):
+        a = asset[i]
+        if holdings[a] > 1e-9 and draws[i, 0] < sell_share:
+            trade_type[i] = 'فروش'
+            quantity[i] = min(holdings[a], round(holdings[a] * sell_fraction[i], 4)) or holdings[a]
+            holdings[a] -= quantity[i]
+            category[i] = SELL_CATEGORIES[int(draws[i, 1] * len(SELL_CATEGORIES))]
+            open_sales.append([i + 1, quantity[i] * price[i]])
+        else:
+            trade_type[i] = 'خرید'
+            quantity[i] = round(buy_amount[i] / price[i], 4) or 1
+            holdings[a] += quantity[i]
+            category[i] = BUY_CATEGORIES[int(draws[i, 1] * len(BUY_CATEGORIES))]
+
+            if open_sales and draws[i, 2] < reinvest_share:
+                # Take from the oldest sales with money left, as _allocate_funding() does
+                remaining = quantity[i] * price[i]
+                category[i] = "سرمایه‌گذاری مجدد"
+                related_trade_id[i] = open_sales[0][0]
+                while remaining > 0 and open_sales:
+                    sale = open_sales[0]
+                    amount = min(remaining, sale[1])
+                    funding.append((i + 1, sale[0], amount))
+                    remaining -= amount
+                    sale[1] -= amount
+                    if sale[1] <= 0:
+                        open_sales.popleft()
+
+        # Sales left unused for long are no longer picked
+        while len(open_sales) > 50:
+            open_sales.popleft()
+
+    trade_date = pd.Timestamp('2020-03-20') + pd.to_timedelta(day, unit='D')
+    years, months, _ = jalali_components(trade_date)
+    is_sell = trade_type == 'فروش'
+    trades_df = pd.DataFrame({
+        'id': np.arange(1, trades + 1),
+        'trade_date': trade_date.strftime('%Y-%m-%d %H:%M:%S'),
+        'asset_name': names[asset],
+        'asset_type': types[asset],
+        'trade_type': trade_type,
+        'quantity': quantity,
+        'price': price,
+        'total_amount': quantity * price,
+        'profit_loss': 0.0,
+        'related_trade_id': related_trade_id,
+        'trade_category': category,
+        'is_profit_sale': is_sell & (draws[:, 1] < 0.2),
+        'currency': 'تومان',
+        'notes': None,
+        'jalali_date': format_jalali_dates(trade_date).to_numpy(),
+        'jalali_year': years,
+        'jalali_month': months,
+    })
+    return trades_df, funding
+
+
+def _insert_rows(cursor, table, columns, rows):
+    placeholders = ', '.join(['?' if database.USE_SQLITE else '%s'] * len(columns))
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    if database.USE_SQLITE:
+        cursor.executemany(query, rows)
+    else:
+        execute_batch(cursor, query, rows, page_size=1000)
+
+
+def generate_journal(trades, seed=0, force=False):
+    """
+    Fill the active database with a synthetic journal.
+
+    The trades and their funding rows are bulk inserted; asset positions,
+    sale profit/loss and the rollups then come from rebuild_all_positions(),
+    followed by one bulk price update and a cash balance that covers every buy
+    when it was made.
+
+    Args:
+        trades (int): Number of trades
+        seed (int): Random seed
+        force (bool): Empty the journal tables of a non-empty database first
+
+    Returns:
+        dict: Number of trades, sells, funding rows and assets, and the
+            seconds spent generating and loading them
+    """
+    started = time.perf_counter()
+    trades_df, funding = make_trades(trades, seed)
+    generate_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM trades')
+        if cursor.fetchone()[0]:
+            if not force:
+                raise SystemExit("the database already has trades, use --force to empty it")
+            for table in JOURNAL_TABLES:
+                cursor.execute(f'DELETE FROM {table}')
+
+        rows = list(trades_df.astype(object).where(trades_df.notna(), None).itertuples(index=False, name=None))
+        _insert_rows(cursor, 'trades', list(trades_df.columns), rows)
+        _insert_rows(cursor, 'trade_funding', ['buy_id', 'sale_id', 'amount'], funding)
+        if not database.USE_SQLITE:
+            # The ids were given explicitly
+            cursor.execute("SELECT setval(pg_get_serial_sequence('trades', 'id'), %s)", (trades,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    rebuild_all_positions()
+
+    # Today's quotes: the last trade price of each asset, moved a little
+    rng = np.random.default_rng(seed + 1)
+    last_prices = trades_df.groupby('asset_name')['price'].last()
+    update_asset_prices_bulk(dict(zip(last_prices.index,
+                                      (last_prices * rng.uniform(0.9, 1.1, len(last_prices))).round())))
+
+    # Deposit just enough that the balance never went negative
+    is_sell = trades_df['trade_type'] == 'فروش'
+    cash_flow = trades_df['total_amount'].where(is_sell, -trades_df['total_amount']).cumsum()
+    update_cash_balance(max(-cash_flow.min(), 0) + cash_flow.iloc[-1])
+
+    return {
+        'trades': trades,
+        'sells': int(is_sell.sum()),
+        'funding_rows': len(funding),
+        'assets': len(last_prices),
+        'generate_seconds': generate_time,
+        'load_seconds': time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trades', type=int, default=100_000, help='number of trades')
+    parser.add_argument('--db', default='journal.db', help='SQLite file to fill (without DATABASE_URL)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--force', action='store_true', help='replace an existing journal')
+    args = parser.parse_args()
+
+    if database.USE_SQLITE and os.path.exists(args.db):
+        if not args.force:
+            raise SystemExit(f"{args.db} exists, use --force to replace it")
+        os.remove(args.db)
+    use_database(args.db)
+
+    summary = generate_journal(args.trades, args.seed, args.force)
+    print(f"{summary['trades']:,} trades ({summary['sells']:,} sells), "
+          f"{summary['funding_rows']:,} funding rows, {summary['assets']} assets")
+    print(f"generated in {summary['generate_seconds']:.2f}s, loaded in {summary['load_seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
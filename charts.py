@@ -1,118 +1,240 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+import streamlit as st
+
+from utils import format_number
+
+# Maximum number of serialized figures kept in memory
+CHART_CACHE_SIZE = int(os.environ.get('CHART_CACHE_SIZE', 32))
+
+# Font stack of every chart, matching the page font
+CHART_FONT = "Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif"
+
+# Colors of positive/negative bar charts, from loss to profit
+PROFIT_LOSS_SCALE = ['#FF5757', '#FFBD59', '#4CAF50']
+
+_specs = OrderedDict()
+_specs_lock = threading.Lock()
+
+def _frame_hash(frame):
+    """
+    Hash the values, columns and dtypes of a DataFrame.
+
+    Args:
+        frame (pd.DataFrame): Chart input
+
+    Returns:
+        str: Hex digest that changes whenever the frame does
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((list(frame.columns), [str(dtype) for dtype in frame.dtypes])).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _get_spec(builder, frame, params):
+    """
+    Get the serialized figure of a chart from the cache, building it on a miss.
+
+    Args:
+        builder (function): Figure builder of this module
+        frame (pd.DataFrame): Aggregated input of the chart
+        params (dict): Other arguments of the builder
+
+    Returns:
+        tuple: (figure JSON, seconds spent building it, 0 on a cache hit)
+    """
+    key = (builder.__name__, _frame_hash(frame), repr(sorted(params.items())))
+    with _specs_lock:
+        if key in _specs:
+            _specs.move_to_end(key)
+            return _specs[key], 0.0
+
+    started = time.perf_counter()
+    spec = builder(frame, **params).to_json()
+    build_time = time.perf_counter() - started
+
+    with _specs_lock:
+        _specs[key] = spec
+        while len(_specs) > CHART_CACHE_SIZE:
+            _specs.popitem(last=False)
+    return spec, build_time
+
+def show_chart(builder, frame, chart_id=None, **params):
+    """
+    Draw a chart, reusing the figure built for the same input and parameters.
+
+    Figures are cached as JSON by a hash of the input frame and the
+    parameters, so unchanged charts skip Plotly Express and validation
+    entirely. Every session gets its own figure read from the JSON, so the
+    cache can't be changed through a drawn chart. The build and draw time of
+    each chart is kept in st.session_state.chart_timings.
+
+    Args:
+        builder (function): Figure builder of this module
+        frame (pd.DataFrame): Aggregated input of the chart
+        chart_id (str, optional): Name of the chart in the timings, for
+            builders drawn more than once per page; defaults to the builder name
+        **params: Other arguments of the builder
+    """
+    spec, build_time = _get_spec(builder, frame, params)
+
+    started = time.perf_counter()
+    # The JSON comes from a validated figure
+    st.plotly_chart(go.Figure(json.loads(spec), _validate=False), use_container_width=True)
+    serialize_time = time.perf_counter() - started
+
+    st.session_state.setdefault('chart_timings', {})[chart_id or builder.__name__] = {
+        'cached': build_time == 0.0,
+        'build_time': build_time,
+        'serialize_time': serialize_time,
+    }
+
+def clear_chart_cache():
+    """Drop every cached figure."""
+    with _specs_lock:
+        _specs.clear()
+
+def _apply_font(fig):
+    fig.update_layout(font=dict(family=CHART_FONT, size=14))
+    return fig
 
 def create_asset_allocation_chart(portfolio_data):
     """
     Create a pie chart showing asset allocation.
-    
+
     Args:
         portfolio_data (pd.DataFrame): DataFrame with asset_name and total_value columns
-        
+
     Returns:
         plotly.graph_objects.Figure: Pie chart figure
     """
+    total_value = portfolio_data['total_value'].sum()
     fig = px.pie(
-        portfolio_data, 
-        values='total_value', 
-        names='asset_name', 
-        title='ترکیب دارایی‌ها',
-        labels={'asset_name': 'نام دارایی', 'total_value': 'ارزش کل'}
-    )
-    
-    fig.update_layout(
-        font=dict(family="Arial", size=14),
-        legend=dict(font=dict(size=12))
+        portfolio_data,
+        values='total_value',
+        names='asset_name',
+        color='asset_name',  # Color by asset name for distinct colors
+        title=f'ترکیب دارایی‌ها - ارزش کل: {format_number(total_value)} تومان',
+        color_discrete_sequence=px.colors.qualitative.Set3
     )
-    
-    return fig
+
+    return _apply_font(fig)
 
 def create_performance_chart(assets_df):
     """
     Create a bar chart showing asset performance.
-    
+
     Args:
-        assets_df (pd.DataFrame): DataFrame with asset performance data
-        
+        assets_df (pd.DataFrame): DataFrame with asset_name and profit_loss_pct columns
+
     Returns:
         plotly.graph_objects.Figure: Bar chart figure
     """
     fig = px.bar(
-        assets_df, 
-        x='asset_name', 
+        assets_df,
+        x='asset_name',
         y='profit_loss_pct',
         color='profit_loss_pct',
-        color_continuous_scale=['red', 'green'],
+        color_continuous_scale=PROFIT_LOSS_SCALE,
         labels={'asset_name': 'دارایی', 'profit_loss_pct': 'بازدهی (%)'},
-        title='عملکرد دارایی‌ها (درصد)'
+        title='بازدهی دارایی‌ها'
     )
-    
+
     fig.update_layout(
         xaxis_title="دارایی",
         yaxis_title="بازدهی (%)",
-        font=dict(family="Arial", size=14)
     )
-    
-    return fig
 
-def create_monthly_pnl_chart(trades_df):
+    return _apply_font(fig)
+
+def create_monthly_pnl_chart(monthly_pnl):
     """
     Create a bar chart showing monthly profit/loss.
-    
+
     Args:
-        trades_df (pd.DataFrame): DataFrame with trade data
-        
+        monthly_pnl (pd.DataFrame): Realized profit/loss per Jalali month,
+            as returned by database.get_monthly_pnl()
+
     Returns:
         plotly.graph_objects.Figure: Bar chart figure
     """
-    # Extract year and month for grouping
-    trades_df['year_month'] = trades_df['trade_date'].dt.strftime('%Y-%m')
-    
-    # Calculate realized profit/loss by month
-    monthly_pnl = trades_df[trades_df['trade_type'] == 'فروش'].groupby('year_month').agg({
-        'profit_loss': 'sum'
-    }).reset_index()
-    
     fig = px.bar(
-        monthly_pnl, 
-        x='year_month', 
+        monthly_pnl,
+        x='year_month',
         y='profit_loss',
         color='profit_loss',
-        color_continuous_scale=['red', 'green'],
-        labels={'year_month': 'ماه', 'profit_loss': 'سود/زیان'},
+        color_continuous_scale=PROFIT_LOSS_SCALE,
+        labels={'year_month': 'ماه', 'profit_loss': 'سود/زیان (تومان)'},
         title='سود/زیان ماهانه'
     )
-    
+
     fig.update_layout(
         xaxis_title="ماه",
         yaxis_title="سود/زیان (تومان)",
-        font=dict(family="Arial", size=14)
     )
-    
-    return fig
 
-def create_trade_count_chart(trades_df):
+    return _apply_font(fig)
+
+def create_trade_count_chart(trade_counts):
     """
     Create a pie chart showing trade count by asset.
-    
+
+    Args:
+        trade_counts (pd.DataFrame): asset_name and count of trades
+
+    Returns:
+        plotly.graph_objects.Figure: Pie chart figure
+    """
+    fig = px.pie(
+        trade_counts,
+        values='count',
+        names='asset_name',
+        title='تعداد معاملات بر اساس دارایی',
+        color_discrete_sequence=px.colors.qualitative.Pastel
+    )
+
+    return _apply_font(fig)
+
+def create_category_chart(categories, title, colors):
+    """
+    Create a pie chart showing the number of trades of each category.
+
     Args:
-        trades_df (pd.DataFrame): DataFrame with trade data
-        
+        categories (pd.DataFrame): 'دسته‌بندی' and 'تعداد' columns
+        title (str): Chart title
+        colors (list): Colors of the slices
+
     Returns:
         plotly.graph_objects.Figure: Pie chart figure
     """
-    trade_counts = trades_df.groupby('asset_name').size().reset_index(name='count')
-    
     fig = px.pie(
-        trade_counts, 
-        values='count', 
-        names='asset_name', 
-        title='تعداد معاملات بر اساس دارایی'
+        categories,
+        values='تعداد',
+        names='دسته‌بندی',
+        title=title,
+        color_discrete_sequence=colors
     )
-    
     fig.update_layout(
-        font=dict(family="Arial", size=14),
-        legend=dict(font=dict(size=12))
+        font=dict(family=CHART_FONT, size=14),
+        title_font=dict(family=CHART_FONT, size=18),
+        legend_title_font=dict(family=CHART_FONT, size=14),
+        legend_font=dict(family=CHART_FONT, size=12),
+        paper_bgcolor='rgba(255,255,255,0.7)',
+        margin=dict(l=20, r=20, t=60, b=20),
+        hoverlabel=dict(font_size=12, font_family=CHART_FONT)
     )
-    
+    fig.update_traces(
+        textfont=dict(family=CHART_FONT, size=14),
+        marker=dict(line=dict(color='#FFFFFF', width=2)),
+        hovertemplate='<b>%{label}</b><br>تعداد: %{value}<br>درصد: %{percent}<extra></extra>'
+    )
+
     return fig
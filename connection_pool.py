@@ -0,0 +1,326 @@
+import os
+import sqlite3
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions as pg_extensions
+from psycopg2 import pool as pg_pool
+
+from profiling import ProfiledPGCursor, ProfiledSQLiteCursor
+
+# Pool sizing and health check settings (overridable from the environment)
+POOL_MIN_CONNECTIONS = int(os.environ.get('DB_POOL_MIN', 2))
+POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_SECONDS', 30))
+
+
+class PoolExhaustedError(Exception):
+    """
+    Raised when no pooled connection becomes available within POOL_TIMEOUT.
+    """
+
+
+class PooledSQLiteConnection(sqlite3.Connection):
+    """
+    SQLite connection whose close() hands it back to its pool.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owner = None
+        self._checkouts = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def nested(self):
+        """True if an outer holder on this thread has it checked out too."""
+        return self._checkouts > 1
+
+    def cursor(self, factory=ProfiledSQLiteCursor):
+        return super().cursor(factory)
+
+    # The built-in shortcuts open a plain cursor, which the profile would miss
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        owner = self._owner
+        if owner is None:
+            super().close()
+        elif self._checkouts > 0:
+            owner.release(self)
+
+    def discard(self):
+        """Really close the connection and detach it from its pool."""
+        self._owner = None
+        try:
+            super().close()
+        except sqlite3.Error:
+            pass
+
+
+class PooledPGConnection(pg_extensions.connection):
+    """
+    PostgreSQL connection whose close() hands it back to its pool.
+    """
+    # Every checkout gets a connection of its own
+    nested = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = ProfiledPGCursor
+        self._owner = None
+        self._checked_out = False
+        self._returning = False
+        self.last_used = time.monotonic()
+
+    def close(self):
+        owner = self._owner
+        # psycopg2's pool closes surplus connections itself while they are being
+        # returned, so those calls must reach the real close()
+        if owner is None or owner.closing or self._returning:
+            super().close()
+        elif self._checked_out:
+            owner.release(self)
+
+
+class SQLiteConnectionPool:
+    """
+    Reuses one SQLite connection per thread.
+
+    Streamlit runs every script run in its own thread, so all the
+    get_connection() calls made during a rerun share a single connection.
+    Connections of finished threads are closed the next time a thread needs
+    a new one.
+    """
+    def __init__(self, database, max_connections=POOL_MAX_CONNECTIONS):
+        self.database = database
+        self.max_connections = max_connections
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'checkouts': 0,
+            'overflow': 0,
+            'health_check_failures': 0,
+        }
+
+    def _connect(self):
+        return sqlite3.connect(self.database, factory=PooledSQLiteConnection,
+                               check_same_thread=False)
+
+    def _is_healthy(self, conn):
+        if conn._owner is not self:
+            return False
+        if time.monotonic() - conn.last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def getconn(self):
+        """
+        Check out the connection of the current thread.
+
+        Returns:
+            PooledSQLiteConnection: A connection whose close() releases it
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not self._is_healthy(conn):
+            conn.discard()
+            conn = None
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            if conn is None:
+                self._prune()
+                if len(self._connections) >= self.max_connections:
+                    # Too many threads hold a connection, hand out an unpooled one
+                    self._stats['overflow'] += 1
+                    return sqlite3.connect(self.database, factory=PooledSQLiteConnection)
+
+                conn = self._connect()
+                conn._owner = self
+                self._connections[threading.current_thread()] = conn
+                self._local.conn = conn
+                self._stats['created'] += 1
+            else:
+                self._stats['reused'] += 1
+
+        # Drop a transaction left open by a caller that never closed its connection
+        if conn._checkouts == 0 and conn.in_transaction:
+            conn.rollback()
+
+        conn._checkouts += 1
+        return conn
+
+    def _prune(self):
+        # Close the connections whose threads have finished
+        for thread in [t for t in self._connections if not t.is_alive()]:
+            self._connections.pop(thread).discard()
+
+    def release(self, conn):
+        """
+        Return a connection checked out with getconn().
+
+        Uncommitted work is rolled back once the last holder has released it.
+        """
+        conn._checkouts = max(conn._checkouts - 1, 0)
+        conn.last_used = time.monotonic()
+        if conn._checkouts == 0 and conn.in_transaction:
+            conn.rollback()
+
+    def closeall(self):
+        """Close every connection owned by the pool."""
+        with self._lock:
+            for conn in self._connections.values():
+                conn.discard()
+            self._connections = {}
+            self._local = threading.local()
+
+    def stats(self):
+        """
+        Get pool statistics.
+
+        Returns:
+            dict: Counters and current pool occupancy
+        """
+        with self._lock:
+            self._prune()
+            connections = list(self._connections.values())
+            stats = dict(self._stats)
+        stats.update({
+            'backend': 'sqlite',
+            'max_connections': self.max_connections,
+            'open': len(connections),
+            'in_use': sum(1 for conn in connections if conn._checkouts > 0),
+        })
+        return stats
+
+
+class PostgresConnectionPool:
+    """
+    Thread-safe PostgreSQL pool built on psycopg2's ThreadedConnectionPool.
+
+    Up to min_connections idle connections are kept open between checkouts,
+    and at most max_connections are open at once. Callers wait up to
+    POOL_TIMEOUT seconds for a free connection.
+    """
+    def __init__(self, dsn, min_connections=POOL_MIN_CONNECTIONS,
+                 max_connections=POOL_MAX_CONNECTIONS):
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.closing = False
+        self._pool = pg_pool.ThreadedConnectionPool(
+            min_connections, max_connections, dsn,
+            connection_factory=PooledPGConnection
+        )
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._stats = {
+            'checkouts': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+        }
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self):
+        """
+        Check out a connection, waiting for a free slot if the pool is full.
+
+        Returns:
+            PooledPGConnection: A connection whose close() releases it
+        """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=POOL_TIMEOUT):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolExhaustedError(
+                f"No database connection available after {POOL_TIMEOUT} seconds"
+            )
+
+        try:
+            conn = self._pool.getconn()
+            while not self._is_healthy(conn):
+                with self._lock:
+                    self._stats['health_check_failures'] += 1
+                conn._owner = None
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        conn._owner = self
+        conn._checked_out = True
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['wait_time'] += time.monotonic() - started
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection checked out with getconn().
+
+        psycopg2 rolls back any transaction left open before pooling it again.
+        """
+        conn._checked_out = False
+        conn.last_used = time.monotonic()
+        conn._returning = True
+        try:
+            self._pool.putconn(conn, close=conn.closed)
+        finally:
+            conn._returning = False
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        """Close every connection owned by the pool."""
+        self.closing = True
+        self._pool.closeall()
+
+    def stats(self):
+        """
+        Get pool statistics.
+
+        Returns:
+            dict: Counters and current pool occupancy
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            in_use = self._in_use
+        stats.update({
+            'backend': 'postgresql',
+            'min_connections': self.min_connections,
+            'max_connections': self.max_connections,
+            'open': len(self._pool._pool) + len(self._pool._used),
+            'idle': len(self._pool._pool),
+            'in_use': in_use,
+        })
+        return stats
@@ -1,9 +1,15 @@
 import os
-import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
-import sqlite3
+from contextlib import contextmanager
+import threading
+import time
+import pandas as pd
+import jdatetime
+
+from connection_pool import SQLiteConnectionPool, PostgresConnectionPool
+from query_cache import cached_query, bump_data_version
 
 # Get PostgreSQL connection details from environment
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -11,648 +17,1993 @@ DATABASE_URL = os.environ.get('DATABASE_URL')
 # Check if we should use SQLite as fallback (for development)
 USE_SQLITE = DATABASE_URL is None
 
-def initialize_database():
+# SQLite database file used when DATABASE_URL is not set
+SQLITE_PATH = 'portfolio.db'
+
+# Process-wide connection pool, shared by every Streamlit session and rerun
+_pool = None
+_pool_lock = threading.Lock()
+
+# Keep assets in step with trades through database triggers (see enable_asset_triggers)
+USE_ASSET_TRIGGERS = os.environ.get('ASSET_TRIGGERS') == '1'
+ASSET_TRIGGER_NAMES = ['trg_trades_asset_insert', 'trg_trades_asset_update', 'trg_trades_asset_delete']
+# Buy quantities at or below this are treated as zero when averaging
+ASSET_TRIGGER_EPSILON = 1e-9
+_asset_triggers_enabled = None
+
+# Default number of trades per page of the trade history
+TRADES_PAGE_SIZE = int(os.environ.get('TRADES_PAGE_SIZE', 50))
+
+# Default number of matches offered by the trade pickers
+TRADE_SEARCH_LIMIT = 20
+
+def initialize_database():
+    """
+    Initialize the database with the required tables if they don't exist.
+    
+    The tables are created by the schema migrations in migrations.py; this
+    applies the pending ones.
+    """
+    from migrations import run_migrations
+    run_migrations()
+
+def update_database_schema():
+    """
+    Update database schema with new columns for existing tables.
+    
+    Applies the pending schema migrations in migrations.py.
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    from migrations import run_migrations
+    return run_migrations() is not None
+
+def get_pool():
+    """
+    Get the process-wide connection pool, creating it on first use.
+    
+    Returns:
+        SQLiteConnectionPool | PostgresConnectionPool: The active pool
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if USE_SQLITE:
+                    _pool = SQLiteConnectionPool(SQLITE_PATH)
+                else:
+                    _pool = PostgresConnectionPool(DATABASE_URL)
+    return _pool
+
+def get_connection():
+    """
+    Get a pooled connection to the database.
+    
+    Calling close() on the returned connection hands it back to the pool;
+    any uncommitted work is rolled back at that point.
+    
+    Returns:
+        Connection: A database connection (PostgreSQL or SQLite)
+    """
+    return get_pool().getconn()
+
+@contextmanager
+def connection():
+    """
+    Context manager around a pooled connection.
+    
+    Commits when the block succeeds, rolls back when it raises and always
+    returns the connection to the pool. A block nested in another one on the
+    same SQLite connection runs in a savepoint instead: its work is undone
+    when it raises and committed or rolled back with the outer block.
+    
+    Yields:
+        Connection: A database connection (PostgreSQL or SQLite)
+    """
+    conn = get_connection()
+    nested = conn.nested
+    try:
+        if nested:
+            # Make the outer holder own the transaction, or RELEASE would commit
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            conn.execute('SAVEPOINT nested_connection')
+        yield conn
+        if nested:
+            conn.execute('RELEASE SAVEPOINT nested_connection')
+        else:
+            conn.commit()
+            bump_data_version()
+    except Exception:
+        if nested:
+            conn.execute('ROLLBACK TO SAVEPOINT nested_connection')
+            conn.execute('RELEASE SAVEPOINT nested_connection')
+        else:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_pool_stats():
+    """
+    Get statistics of the connection pool.
+    
+    Returns:
+        dict: Checkout counters and current pool occupancy
+    """
+    return get_pool().stats()
+
+def close_all_connections():
+    """
+    Close every pooled connection and drop the pool.
+    
+    The next get_connection() call creates a fresh pool. Used before the
+    database file is replaced during a backup restore.
+    """
+    global _pool, _asset_triggers_enabled
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+        # The restored database may differ in whether it has the asset triggers
+        _asset_triggers_enabled = None
+    # Nothing read from the old database is valid any more
+    bump_data_version()
+
+class InsufficientQuantityError(Exception):
+    """
+    Raised when a sell trade asks for more units of an asset than are held.
+    """
+
+def _apply_trade_to_asset(cursor, asset_name, asset_type, quantity, price, trade_type):
+    """
+    Apply a trade to the asset row using an open cursor, without committing.
+    
+    Buys add to the running buy totals and the average buy price is their
+    ratio, the same as in _recalculate_asset() and the asset triggers, so
+    every write path and check_asset_consistency() agree on it.
+    
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        asset_name (str): Name of the asset
+        asset_type (str): Type of the asset
+        quantity (float): Quantity traded
+        price (float): Price of the trade
+        trade_type (str): Type of trade (خرید/فروش)
+    """
+    if USE_SQLITE:
+        # SQLite version
+        # Check if asset exists
+        cursor.execute('SELECT quantity, bought_quantity, buy_cost FROM assets WHERE asset_name = ?',
+                       (asset_name,))
+        asset = cursor.fetchone()
+        
+        if trade_type == 'خرید':
+            if asset:
+                # Asset exists, update it
+                new_quantity = asset[0] + quantity
+                bought_quantity = (asset[1] or 0) + quantity
+                buy_cost = (asset[2] or 0) + quantity * price
+                
+                # Calculate new average price from the buy totals
+                if bought_quantity > ASSET_TRIGGER_EPSILON:
+                    new_avg_price = buy_cost / bought_quantity
+                else:
+                    new_avg_price = price
+                
+                cursor.execute('''
+                    UPDATE assets 
+                    SET quantity = ?, avg_buy_price = ?, bought_quantity = ?, buy_cost = ?, 
+                        current_price = ?, last_updated = ? 
+                    WHERE asset_name = ?
+                ''', (new_quantity, new_avg_price, bought_quantity, buy_cost, price, datetime.now(), asset_name))
+            else:
+                # New asset, insert it
+                cursor.execute('''
+                    INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                        last_updated, bought_quantity, buy_cost)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (asset_name, asset_type, quantity, price, price, datetime.now(), quantity, quantity * price))
+        elif trade_type == 'فروش':
+            if asset:
+                # Update quantity after sell
+                new_quantity = asset[0] - quantity
+                
+                # Keep the average buy price and buy totals the same
+                cursor.execute('''
+                    UPDATE assets 
+                    SET quantity = ?, current_price = ?, last_updated = ? 
+                    WHERE asset_name = ?
+                ''', (new_quantity, price, datetime.now(), asset_name))
+                
+                # If quantity is zero, optionally delete the asset
+                if new_quantity <= 0:
+                    pass  # We'll keep the asset with zero quantity for history
+            else:
+                # Shouldn't happen, but handle it anyway
+                cursor.execute('''
+                    INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                        last_updated, bought_quantity, buy_cost)
+                    VALUES (?, ?, ?, ?, ?, ?, 0, 0)
+                ''', (asset_name, asset_type, -quantity, 0, price, datetime.now()))
+    else:
+        # PostgreSQL version
+        # Check if asset exists
+        cursor.execute('SELECT quantity, bought_quantity, buy_cost FROM assets WHERE asset_name = %s',
+                       (asset_name,))
+        asset = cursor.fetchone()
+        
+        if trade_type == 'خرید':
+            if asset:
+                # Asset exists, update it
+                new_quantity = asset[0] + quantity
+                bought_quantity = (asset[1] or 0) + quantity
+                buy_cost = (asset[2] or 0) + quantity * price
+                
+                # Calculate new average price from the buy totals
+                if bought_quantity > ASSET_TRIGGER_EPSILON:
+                    new_avg_price = buy_cost / bought_quantity
+                else:
+                    new_avg_price = price
+                
+                cursor.execute('''
+                    UPDATE assets 
+                    SET quantity = %s, avg_buy_price = %s, bought_quantity = %s, buy_cost = %s, 
+                        current_price = %s, last_updated = %s 
+                    WHERE asset_name = %s
+                ''', (new_quantity, new_avg_price, bought_quantity, buy_cost, price, datetime.now(), asset_name))
+            else:
+                # New asset, insert it
+                cursor.execute('''
+                    INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                        last_updated, bought_quantity, buy_cost)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ''', (asset_name, asset_type, quantity, price, price, datetime.now(), quantity, quantity * price))
+        elif trade_type == 'فروش':
+            if asset:
+                # Update quantity after sell
+                new_quantity = asset[0] - quantity
+                
+                # Keep the average buy price and buy totals the same
+                cursor.execute('''
+                    UPDATE assets 
+                    SET quantity = %s, current_price = %s, last_updated = %s 
+                    WHERE asset_name = %s
+                ''', (new_quantity, price, datetime.now(), asset_name))
+                
+                # If quantity is zero, optionally delete the asset
+                if new_quantity <= 0:
+                    pass  # We'll keep the asset with zero quantity for history
+            else:
+                # Shouldn't happen, but handle it anyway
+                cursor.execute('''
+                    INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                        last_updated, bought_quantity, buy_cost)
+                    VALUES (%s, %s, %s, %s, %s, %s, 0, 0)
+                ''', (asset_name, asset_type, -quantity, 0, price, datetime.now()))
+
+def update_asset_after_trade(asset_name, asset_type, quantity, price, trade_type):
+    """
+    Update asset information after a trade is recorded.
+    
+    Args:
+        asset_name (str): Name of the asset
+        asset_type (str): Type of the asset
+        quantity (float): Quantity traded
+        price (float): Price of the trade
+        trade_type (str): Type of trade (خرید/فروش)
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            _apply_trade_to_asset(cursor, asset_name, asset_type, quantity, price, trade_type)
+        return True
+    except Exception as e:
+        print(f"Error updating asset: {e}")
+        return False
+
+def _apply_cash_movement(cursor, amount, is_deposit=True):
+    """
+    Move cash in or out of the balance using an open cursor, without committing.
+    
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        amount (float): Amount to add or subtract
+        is_deposit (bool): True for deposit, False for withdrawal
+        
+    Returns:
+        float: The new cash balance
+    """
+    delta = amount if is_deposit else -amount
+    
+    if USE_SQLITE:
+        # SQLite version
+        cursor.execute('''
+            UPDATE cash_balance 
+            SET amount_irr = amount_irr + ?, last_updated = ? 
+            WHERE id = 1
+        ''', (delta, datetime.now()))
+        cursor.execute('SELECT amount_irr FROM cash_balance WHERE id = 1')
+        return cursor.fetchone()[0]
+    else:
+        # PostgreSQL version
+        cursor.execute('''
+            UPDATE cash_balance 
+            SET amount_irr = amount_irr + %s, last_updated = %s 
+            WHERE id = 1
+            RETURNING amount_irr
+        ''', (delta, datetime.now()))
+        return cursor.fetchone()[0]
+
+def update_cash_balance(amount, is_deposit=True):
+    """
+    Update cash balance.
+    
+    Args:
+        amount (float): Amount to add or subtract
+        is_deposit (bool): True for deposit, False for withdrawal
+    """
+    with connection() as conn:
+        new_balance = _apply_cash_movement(conn.cursor(), amount, is_deposit)
+    
+    return new_balance
+
+def _jalali_fields(trade_date):
+    """
+    Get the Jalali date columns stored with a trade.
+    
+    Args:
+        trade_date (datetime): Date of the trade
+        
+    Returns:
+        tuple: ('YYYY/MM/DD' Jalali date, Jalali year, Jalali month)
+    """
+    jalali = jdatetime.date.fromgregorian(date=pd.Timestamp(trade_date).date())
+    return jalali.strftime('%Y/%m/%d'), jalali.year, jalali.month
+
+def _allocate_funding(cursor, buy_id, sale_ids, total_amount):
+    """
+    Split a purchase across the sales that fund it.
+
+    The sales are used oldest first, each covering as much of the purchase
+    as it still has available. Whatever they don't cover is paid from cash.
+
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        buy_id (int): ID of the purchase
+        sale_ids (list): IDs of the funding sales
+        total_amount (float): Total amount of the purchase
+
+    Returns:
+        float: Part of the purchase covered by the sales
+    """
+    sale_ids = sorted({int(sale_id) for sale_id in sale_ids})
+    if not sale_ids:
+        return 0
+
+    available_query = '''
+        SELECT s.id,
+               s.total_amount - COALESCE((SELECT SUM(f.amount) FROM trade_funding f
+                                          WHERE f.sale_id = s.id), 0) AS available_amount
+        FROM trades s
+        WHERE s.trade_type = 'فروش' AND s.id IN ({placeholders})
+        ORDER BY s.trade_date, s.id
+    '''
+
+    if USE_SQLITE:
+        # SQLite version
+        cursor.execute(available_query.format(placeholders=', '.join(['?'] * len(sale_ids))), sale_ids)
+    else:
+        # PostgreSQL version
+        # Lock the sales so concurrent purchases can't spend the same money
+        cursor.execute(available_query.format(placeholders=', '.join(['%s'] * len(sale_ids))) + ' FOR UPDATE OF s',
+                       sale_ids)
+
+    remaining = total_amount
+    allocations = []
+    for sale_id, available_amount in cursor.fetchall():
+        amount = min(remaining, available_amount)
+        if amount <= 0:
+            continue
+        allocations.append((buy_id, sale_id, amount))
+        remaining -= amount
+        if remaining <= 0:
+            break
+
+    if allocations:
+        if USE_SQLITE:
+            cursor.executemany('INSERT INTO trade_funding (buy_id, sale_id, amount) VALUES (?, ?, ?)',
+                               allocations)
+        else:
+            cursor.executemany('INSERT INTO trade_funding (buy_id, sale_id, amount) VALUES (%s, %s, %s)',
+                               allocations)
+
+    return total_amount - remaining
+
+def _reallocate_funding(cursor, buy_id, total_amount):
+    """
+    Split an edited purchase again across the sales that already fund it.
+
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        buy_id (int): ID of the purchase
+        total_amount (float): New total amount of the purchase, 0 to unlink it
+    """
+    if USE_SQLITE:
+        cursor.execute('SELECT sale_id FROM trade_funding WHERE buy_id = ?', (buy_id,))
+        sale_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM trade_funding WHERE buy_id = ?', (buy_id,))
+    else:
+        cursor.execute('SELECT sale_id FROM trade_funding WHERE buy_id = %s', (buy_id,))
+        sale_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM trade_funding WHERE buy_id = %s', (buy_id,))
+
+    if total_amount > 0:
+        _allocate_funding(cursor, buy_id, sale_ids, total_amount)
+
+def _cap_sale_funding(cursor, sale_id, total_amount):
+    """
+    Shrink the funding an edited sale gives so it fits its new total amount.
+
+    The buys it funds keep their share oldest first, the order in which
+    _allocate_funding() handed the money out; the rows of the later buys
+    are cut down or removed.
+
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        sale_id (int): ID of the sale
+        total_amount (float): New total amount of the sale
+    """
+    query = '''
+        SELECT f.id, f.amount
+        FROM trade_funding f
+        JOIN trades b ON b.id = f.buy_id
+        WHERE f.sale_id = ?
+        ORDER BY b.trade_date, b.id, f.id
+    '''
+
+    if USE_SQLITE:
+        # SQLite version
+        cursor.execute(query, (sale_id,))
+    else:
+        # PostgreSQL version
+        cursor.execute(query.replace('?', '%s'), (sale_id,))
+
+    remaining = total_amount
+    capped = []
+    removed = []
+    for funding_id, amount in cursor.fetchall():
+        kept = min(amount, max(remaining, 0))
+        remaining -= kept
+        if kept <= 0:
+            removed.append((funding_id,))
+        elif kept < amount:
+            capped.append((kept, funding_id))
+
+    if USE_SQLITE:
+        cursor.executemany('UPDATE trade_funding SET amount = ? WHERE id = ?', capped)
+        cursor.executemany('DELETE FROM trade_funding WHERE id = ?', removed)
+    else:
+        cursor.executemany('UPDATE trade_funding SET amount = %s WHERE id = %s', capped)
+        cursor.executemany('DELETE FROM trade_funding WHERE id = %s', removed)
+
+def _apply_trades_to_rollups(cursor, where, params, sign):
+    """
+    Add the trades matching a condition to the pnl_monthly and asset_stats
+    rollups, or take them out, using an open cursor and without committing.
+
+    Write paths call this with sign=-1 before a trade row changes and with
+    sign=1 after, so the rollups follow the trades without regrouping the
+    journal. Taking trades out can leave first_trade/last_trade stale and
+    empty rows behind; _prune_rollups() fixes both.
+
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        where (str): Condition on trades, with the placeholders of the backend
+        params (tuple): Parameters of the condition
+        sign (int): 1 to add the trades, -1 to take them out
+    """
+    sign = 1 if sign > 0 else -1
+
+    if USE_SQLITE:
+        # SQLite version
+        period_sql = "jalali_year || '-' || substr('0' || jalali_month, -2)"
+        least, greatest = 'MIN', 'MAX'
+    else:
+        # PostgreSQL version
+        period_sql = "jalali_year || '-' || LPAD(CAST(jalali_month AS TEXT), 2, '0')"
+        least, greatest = 'LEAST', 'GREATEST'
+
+    cursor.execute(f'''
+        INSERT INTO pnl_monthly (period, realized_pl, trade_count)
+        SELECT {period_sql}, {sign} * SUM(profit_loss), {sign} * COUNT(*)
+        FROM trades
+        WHERE trade_type = 'فروش' AND ({where})
+        GROUP BY jalali_year, jalali_month
+        ON CONFLICT (period) DO UPDATE SET
+            realized_pl = pnl_monthly.realized_pl + excluded.realized_pl,
+            trade_count = pnl_monthly.trade_count + excluded.trade_count
+    ''', params)
+
+    cursor.execute(f'''
+        INSERT INTO asset_stats (asset_name, buys, sells, qty_bought, qty_sold, sales_total,
+                                 realized_pl, first_trade, last_trade)
+        SELECT asset_name,
+               {sign} * SUM(CASE WHEN trade_type = 'خرید' THEN 1 ELSE 0 END),
+               {sign} * SUM(CASE WHEN trade_type = 'فروش' THEN 1 ELSE 0 END),
+               {sign} * SUM(CASE WHEN trade_type = 'خرید' THEN quantity ELSE 0 END),
+               {sign} * SUM(CASE WHEN trade_type = 'فروش' THEN quantity ELSE 0 END),
+               {sign} * SUM(CASE WHEN trade_type = 'فروش' THEN total_amount ELSE 0 END),
+               {sign} * SUM(CASE WHEN trade_type = 'فروش' THEN profit_loss ELSE 0 END),
+               MIN(trade_date), MAX(trade_date)
+        FROM trades
+        WHERE {where}
+        GROUP BY asset_name
+        ON CONFLICT (asset_name) DO UPDATE SET
+            buys = asset_stats.buys + excluded.buys,
+            sells = asset_stats.sells + excluded.sells,
+            qty_bought = asset_stats.qty_bought + excluded.qty_bought,
+            qty_sold = asset_stats.qty_sold + excluded.qty_sold,
+            sales_total = asset_stats.sales_total + excluded.sales_total,
+            realized_pl = asset_stats.realized_pl + excluded.realized_pl,
+            first_trade = {least}(asset_stats.first_trade, excluded.first_trade),
+            last_trade = {greatest}(asset_stats.last_trade, excluded.last_trade)
+    ''', params)
+
+def _prune_rollups(cursor, asset_names):
+    """
+    Tidy the rollups after trades were taken out, using an open cursor and
+    without committing.
+
+    Months and assets left without trades are deleted, and the first and
+    last trade dates of the given assets are read again from the index.
+
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        asset_names (list): Assets whose trades were changed or deleted
+    """
+    asset_names = list(dict.fromkeys(asset_names))
+    cursor.execute('DELETE FROM pnl_monthly WHERE trade_count <= 0')
+
+    if USE_SQLITE:
+        placeholders = ', '.join('?' for _ in asset_names)
+    else:
+        placeholders = ', '.join('%s' for _ in asset_names)
+    cursor.execute(f'DELETE FROM asset_stats WHERE buys + sells <= 0 AND asset_name IN ({placeholders})',
+                   asset_names)
+    cursor.execute(f'''
+        UPDATE asset_stats SET
+            first_trade = (SELECT MIN(t.trade_date) FROM trades t WHERE t.asset_name = asset_stats.asset_name),
+            last_trade = (SELECT MAX(t.trade_date) FROM trades t WHERE t.asset_name = asset_stats.asset_name)
+        WHERE asset_name IN ({placeholders})
+    ''', asset_names)
+
+def _rebuild_rollups(cursor):
+    """
+    Regroup the whole journal into the rollups using an open cursor, without
+    committing.
+
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+
+    Returns:
+        int: Number of assets in asset_stats
+    """
+    cursor.execute('DELETE FROM pnl_monthly')
+    cursor.execute('DELETE FROM asset_stats')
+    _apply_trades_to_rollups(cursor, 'TRUE', (), 1)
+    cursor.execute('SELECT COUNT(*) FROM asset_stats')
+    return cursor.fetchone()[0]
+
+def _rewrite_sale_profit_loss(cursor, query, params, asset_name):
+    """
+    Run an UPDATE of an asset's sale profit/loss and move the rollups by the
+    difference, using an open cursor and without committing.
+
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        query (str): UPDATE statement of trades.profit_loss
+        params (tuple): Parameters of the statement
+        asset_name (str): Name of the asset whose sales are rewritten
+    """
+    if USE_SQLITE:
+        sales = ("asset_name = ? AND trade_type = 'فروش'", (asset_name,))
+    else:
+        sales = ("asset_name = %s AND trade_type = 'فروش'", (asset_name,))
+
+    _apply_trades_to_rollups(cursor, *sales, -1)
+    cursor.execute(query, params)
+    _apply_trades_to_rollups(cursor, *sales, 1)
+
+def _insert_trade(cursor, trade):
+    """
+    Check, insert and apply a single trade using an open cursor.
+    
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        trade (dict): Trade fields as accepted by record_trade()
+        
+    Returns:
+        tuple: (id of the new trade, signed cash movement of the trade)
+        
+    Raises:
+        InsufficientQuantityError: If a sell exceeds the quantity held
+    """
+    asset_name = trade['asset_name']
+    asset_type = trade['asset_type']
+    trade_type = trade['trade_type']
+    quantity = trade['quantity']
+    price = trade['price']
+    total_amount = quantity * price
+    is_sell = trade_type == 'فروش'
+
+    # related_trade_id keeps the first funding sale for older readers
+    funding_sale_ids = [] if is_sell else list(trade.get('funding_sale_ids') or [])
+    if not funding_sale_ids and not is_sell and trade.get('related_trade_id'):
+        funding_sale_ids = [trade['related_trade_id']]
+    related_trade_id = funding_sale_ids[0] if funding_sale_ids else trade.get('related_trade_id')
+
+    values = (trade['trade_date'], asset_name, asset_type, trade_type, quantity,
+              price, total_amount, 0, related_trade_id,
+              trade.get('trade_category'), bool(trade.get('is_profit_sale')) if is_sell else False,
+              trade.get('currency') or 'تومان', trade.get('notes'),
+              *_jalali_fields(trade['trade_date']))
+    
+    if USE_SQLITE:
+        # SQLite version
+        # Check if we have enough assets to sell
+        if is_sell:
+            cursor.execute('SELECT quantity FROM assets WHERE asset_name = ?', (asset_name,))
+            result = cursor.fetchone()
+            if not result or result[0] < quantity:
+                raise InsufficientQuantityError(asset_name)
+        
+        cursor.execute('''
+            INSERT INTO trades (trade_date, asset_name, asset_type, trade_type, 
+                              quantity, price, total_amount, profit_loss, 
+                              related_trade_id, trade_category, is_profit_sale, currency, notes,
+                              jalali_date, jalali_year, jalali_month)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', values)
+        trade_id = cursor.lastrowid
+        _apply_trades_to_rollups(cursor, 'id = ?', (trade_id,), 1)
+    else:
+        # PostgreSQL version
+        # Lock the asset row so concurrent sells can't both pass the check
+        if is_sell:
+            cursor.execute('SELECT quantity FROM assets WHERE asset_name = %s FOR UPDATE', (asset_name,))
+            result = cursor.fetchone()
+            if not result or result[0] < quantity:
+                raise InsufficientQuantityError(asset_name)
+        
+        cursor.execute('''
+            INSERT INTO trades (trade_date, asset_name, asset_type, trade_type, 
+                              quantity, price, total_amount, profit_loss, 
+                              related_trade_id, trade_category, is_profit_sale, currency, notes,
+                              jalali_date, jalali_year, jalali_month)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        ''', values)
+        trade_id = cursor.fetchone()[0]
+        _apply_trades_to_rollups(cursor, 'id = %s', (trade_id,), 1)
+
+    if funding_sale_ids:
+        _allocate_funding(cursor, trade_id, funding_sale_ids, total_amount)
+
+    # The asset triggers have already applied the trade when they are installed
+    if not asset_triggers_enabled():
+        _apply_trade_to_asset(cursor, asset_name, asset_type, quantity, price, trade_type)
+    
+    # Sells add their proceeds to cash, buys are paid from it
+    return trade_id, (total_amount if is_sell else -total_amount)
+
+def record_trades(trades):
+    """
+    Record several trades in one transaction (group commit).
+    
+    Every trade is checked, inserted and applied to its asset in order, and
+    the net cash movement of the whole batch is booked once. Either all the
+    trades are stored or none of them.
+    
+    Args:
+        trades (list): Dictionaries with the keyword arguments of record_trade()
+        
+    Returns:
+        list: IDs of the new trades, or None if the batch could not be stored
+        
+    Raises:
+        InsufficientQuantityError: If a sell exceeds the quantity held
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        
+        if USE_SQLITE and not conn.in_transaction:
+            # Take the write lock up front so the sell checks stay valid until commit
+            cursor.execute('BEGIN IMMEDIATE')
+        
+        trade_ids = []
+        cash_delta = 0
+        for trade in trades:
+            trade_id, cash_movement = _insert_trade(cursor, trade)
+            trade_ids.append(trade_id)
+            cash_delta += cash_movement
+        
+        if trades:
+            _apply_cash_movement(cursor, abs(cash_delta), cash_delta >= 0)
+        
+        conn.commit()
+        bump_data_version()
+        return trade_ids
+    except InsufficientQuantityError:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        print(f"Error recording trades: {e}")
+        return None
+    finally:
+        conn.close()
+
+def record_trade(trade_date, asset_name, asset_type, trade_type, quantity, price, notes,
+                 currency=None, is_profit_sale=False, trade_category=None, related_trade_id=None,
+                 funding_sale_ids=None):
+    """
+    Record a trade together with its asset and cash updates in one transaction.
+    
+    Args:
+        trade_date (datetime): Date of the trade
+        asset_name (str): Name of the asset
+        asset_type (str): Type of the asset
+        trade_type (str): Type of trade (خرید/فروش)
+        quantity (float): Quantity traded
+        price (float): Price of the trade
+        notes (str): Trade notes
+        currency (str, optional): The currency used for the trade (تومان/دلار)
+        is_profit_sale (bool, optional): Whether this sale is from profit of previous trades
+        trade_category (str, optional): The category of the trade
+        related_trade_id (int, optional): ID of the sale that funds this purchase
+        funding_sale_ids (list, optional): IDs of the sales that fund this purchase,
+            split across them oldest first (replaces related_trade_id)
+        
+    Returns:
+        int: ID of the new trade, or None if it could not be stored
+        
+    Raises:
+        InsufficientQuantityError: If a sell exceeds the quantity held
+    """
+    trade_ids = record_trades([{
+        'trade_date': trade_date,
+        'asset_name': asset_name,
+        'asset_type': asset_type,
+        'trade_type': trade_type,
+        'quantity': quantity,
+        'price': price,
+        'notes': notes,
+        'currency': currency,
+        'is_profit_sale': is_profit_sale,
+        'trade_category': trade_category,
+        'related_trade_id': related_trade_id,
+        'funding_sale_ids': funding_sale_ids,
+    }])
+    return trade_ids[0] if trade_ids else None
+
+def update_asset_current_price(asset_name, current_price):
+    """
+    Update the current price of an asset.
+    
+    Args:
+        asset_name (str): Name of the asset
+        current_price (float): Current price of the asset
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        
+        if USE_SQLITE:
+            # SQLite version
+            cursor.execute('''
+                UPDATE assets 
+                SET current_price = ?, last_updated = ? 
+                WHERE asset_name = ?
+            ''', (current_price, datetime.now(), asset_name))
+        else:
+            # PostgreSQL version
+            cursor.execute('''
+                UPDATE assets 
+                SET current_price = %s, last_updated = %s 
+                WHERE asset_name = %s
+            ''', (current_price, datetime.now(), asset_name))
+
+def update_asset_prices_bulk(prices):
+    """
+    Update the current price of many assets in one transaction.
+    
+    Args:
+        prices (dict): Current price of each asset, keyed by asset name
+        
+    Returns:
+        int: Number of assets updated, or None if the prices could not be stored
+    """
+    if not prices:
+        return 0
+    
+    now = datetime.now()
+    values = [(float(price), now, asset_name) for asset_name, price in prices.items()]
+    
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        
+        if USE_SQLITE:
+            # SQLite version
+            cursor.executemany('''
+                UPDATE assets 
+                SET current_price = ?, last_updated = ? 
+                WHERE asset_name = ?
+            ''', values)
+        else:
+            # PostgreSQL version
+            cursor.executemany('''
+                UPDATE assets 
+                SET current_price = %s, last_updated = %s 
+                WHERE asset_name = %s
+            ''', values)
+        updated = cursor.rowcount
+        
+        conn.commit()
+        bump_data_version()
+        return updated
+    except Exception as e:
+        conn.rollback()
+        print(f"Error updating asset prices: {e}")
+        return None
+    finally:
+        conn.close()
+
+@cached_query
+def get_available_sale_transactions(limit=None, search=None):
     """
-    Initialize the database with the required tables if they don't exist.
+    Get all sale transactions that can be linked to new purchases.
+    These are sales that don't have all funds already used for purchases.
+    
+    Args:
+        limit (int, optional): Maximum number of sales to return (most recent first)
+        search (str, optional): Only return sales whose ID or asset name matches
+    
+    Returns:
+        list: List of dictionaries containing sale transaction details
+        
+    Raises:
+        Exception: Database errors are raised, not cached as an empty list
     """
-    if USE_SQLITE:
-        # SQLite initialization
-        conn = sqlite3.connect('portfolio.db')
+    conn = get_connection()
+    try:
         cursor = conn.cursor()
         
-        # Create assets table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS assets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            asset_name TEXT NOT NULL,
-            asset_type TEXT NOT NULL,
-            quantity REAL DEFAULT 0,
-            avg_buy_price REAL DEFAULT 0,
-            current_price REAL DEFAULT 0,
-            last_updated TIMESTAMP,
-            UNIQUE(asset_name)
-        )
-        ''')
+        # Walk the sales newest first in idx_trades_type_date_id, summing the
+        # funding taken from each from idx_trade_funding_sale. Grouping in
+        # index order lets LIMIT stop the walk early.
+        placeholder = '?' if USE_SQLITE else '%s'
+        like = 'LIKE' if USE_SQLITE else 'ILIKE'
+        query = '''
+            SELECT s.id, s.trade_date, s.jalali_date, s.asset_name, s.asset_type, s.quantity, 
+                   s.price, s.total_amount, s.profit_loss, s.notes, s.created_at,
+                   s.total_amount - COALESCE(SUM(f.amount), 0) AS available_amount
+            FROM trades s
+            LEFT JOIN trade_funding f ON f.sale_id = s.id
+            WHERE s.trade_type = 'فروش'
+        '''
+        params = []
         
-        # Create trades table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS trades (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            trade_date TIMESTAMP NOT NULL,
-            asset_name TEXT NOT NULL,
-            asset_type TEXT NOT NULL,
-            trade_type TEXT NOT NULL,
-            quantity REAL NOT NULL,
-            price REAL NOT NULL,
-            total_amount REAL NOT NULL,
-            profit_loss REAL DEFAULT 0,
-            related_trade_id INTEGER DEFAULT NULL,
-            trade_category TEXT DEFAULT NULL,
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
+        if search:
+            query += f" AND (s.asset_name {like} {placeholder} OR CAST(s.id AS TEXT) = {placeholder})"
+            params.extend([f"%{search.strip()}%", search.strip()])
+        query += '''
+            GROUP BY s.trade_date, s.id
+            HAVING s.total_amount - COALESCE(SUM(f.amount), 0) > 0
+            ORDER BY s.trade_date DESC, s.id DESC
+        '''
+        if limit:
+            query += f" LIMIT {placeholder}"
+            params.append(int(limit))
         
-        # Create cash_balance table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cash_balance (
-            id INTEGER PRIMARY KEY,
-            amount_irr REAL DEFAULT 0,
-            amount_usd REAL DEFAULT 0,
-            last_updated TIMESTAMP
-        )
-        ''')
+        cursor.execute(query, params)
         
+        # Get the column names
+        columns = [column[0] for column in cursor.description]
         
-        # Initialize cash balance if not exists
-        cursor.execute('SELECT COUNT(*) FROM cash_balance')
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('INSERT INTO cash_balance (id, amount_irr, amount_usd, last_updated) VALUES (1, 0, 0, ?)', 
-                          (datetime.now(),))
+        # Convert to list of dictionaries
+        sales_list = [dict(zip(columns, sale)) for sale in cursor.fetchall()]
         
-        conn.commit()
+        return sales_list
+    finally:
         conn.close()
-    else:
-        try:
-            # PostgreSQL initialization
-            conn = psycopg2.connect(DATABASE_URL)
-            cursor = conn.cursor()
-            
-            conn.commit()
-            
-            # Check if cash_balance is initialized
-            cursor.execute('SELECT COUNT(*) FROM cash_balance')
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('INSERT INTO cash_balance (id, amount_irr, amount_usd, last_updated) VALUES (1, 0, 0, %s)',
-                              (datetime.now(),))
-                conn.commit()
-                
-            conn.close()
-        except Exception as e:
-            print(f"Error initializing PostgreSQL database: {e}")
 
-def update_database_schema():
+@cached_query
+def get_trades():
     """
-    Update database schema with new columns for existing tables.
-    This function should be called after initialize_database.
+    Get every trade, newest first.
+    
+    Returns:
+        DataFrame: All columns of the trades table
+    """
+    conn = get_connection()
+    try:
+        return pd.read_sql('SELECT * FROM trades ORDER BY trade_date DESC, id DESC', conn)
+    finally:
+        conn.close()
+
+@cached_query
+def get_trades_page(asset_type=None, trade_type=None, start_date=None, end_date=None,
+                    after=None, page_size=TRADES_PAGE_SIZE):
+    """
+    Get one page of the trade history, newest first.
+    
+    Filters are applied in SQL and pages are read by keyset on
+    (trade_date, id), so only the requested rows are ever loaded.
+    
+    Args:
+        asset_type (str, optional): Only return trades of this asset type
+        trade_type (str, optional): Only return trades of this type (خرید/فروش)
+        start_date (datetime, optional): Only return trades on or after this date
+        end_date (datetime, optional): Only return trades before this date
+        after (tuple, optional): (trade_date, id) of the last row of the previous page
+        page_size (int): Maximum number of trades to return
+        
+    Returns:
+        tuple: (DataFrame of trades with the asset names and Jalali dates of
+            the funding sales of reinvestment buys (related_asset_name and
+            related_jalali_date, comma separated), (trade_date, id) key of the
+            next page or None on the last page)
+    """
+    conditions = []
+    params = []
+    
+    if asset_type:
+        conditions.append('t.asset_type = ?')
+        params.append(asset_type)
+    if trade_type:
+        conditions.append('t.trade_type = ?')
+        params.append(trade_type)
+    if start_date:
+        conditions.append('t.trade_date >= ?')
+        params.append(start_date)
+    if end_date:
+        conditions.append('t.trade_date < ?')
+        params.append(end_date)
+    if after:
+        conditions.append('(t.trade_date, t.id) < (?, ?)')
+        params.extend(after)
+    
+    query = f'''
+        SELECT t.*
+        FROM trades t
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY t.trade_date DESC, t.id DESC
+        LIMIT ?
+    '''
+    # Read one extra row to know whether there is a next page
+    params.append(int(page_size) + 1)
+    
+    if not USE_SQLITE:
+        query = query.replace('?', '%s')
+    
+    conn = get_connection()
+    try:
+        trades_df = pd.read_sql(query, conn, params=params)
+    finally:
+        conn.close()
+    
+    next_page_key = None
+    if len(trades_df) > page_size:
+        trades_df = trades_df.iloc[:page_size]
+        last_row = trades_df.iloc[-1]
+        next_page_key = (last_row['trade_date'], int(last_row['id']))
+    
+    # Attach the funding sales of the buys on this page, one row per buy
+    links = get_trade_links(buy_ids=tuple(int(trade_id) for trade_id in trades_df['id']))
+    links = links.groupby('buy_id', as_index=False).agg(
+        related_asset_name=('sale_asset', '، '.join),
+        related_jalali_date=('sale_jalali_date', '، '.join),
+    ).rename(columns={'buy_id': 'id'})
+    return trades_df.merge(links, on='id', how='left'), next_page_key
+
+@cached_query
+def get_trade_links(buy_ids=None):
+    """
+    Get the reinvestment buys with the sales that funded each of them.
+    
+    Reads the trade_links view, which joins every trade_funding row to its
+    buy and sale by primary key.
+    
+    Args:
+        buy_ids (tuple, optional): Only return the links of these buys
+        
+    Returns:
+        DataFrame: buy_id, buy_jalali_date, buy_asset, buy_amount, sale_id,
+            sale_jalali_date, sale_asset, sale_amount and funded_amount (part
+            of the buy paid by the sale), one row per buy and sale, newest
+            buy first
+    """
+    query = 'SELECT * FROM trade_links'
+    params = []
+    if buy_ids is not None:
+        if not buy_ids:
+            query += ' WHERE 1 = 0'
+        else:
+            placeholder = '?' if USE_SQLITE else '%s'
+            query += f" WHERE buy_id IN ({', '.join([placeholder] * len(buy_ids))})"
+            params = list(buy_ids)
+    query += ' ORDER BY buy_id DESC, sale_id'
+    
+    conn = get_connection()
+    try:
+        return pd.read_sql(query, conn, params=params)
+    finally:
+        conn.close()
+
+@cached_query
+def get_trade(trade_id):
+    """
+    Get a single trade.
+
+    Args:
+        trade_id (int): ID of the trade
+
+    Returns:
+        dict: All columns of the trade, or None if it doesn't exist
+    """
+    query = 'SELECT * FROM trades WHERE id = ?' if USE_SQLITE else 'SELECT * FROM trades WHERE id = %s'
+    conn = get_connection()
+    try:
+        trade_df = pd.read_sql(query, conn, params=[int(trade_id)])
+    finally:
+        conn.close()
+    return trade_df.iloc[0].to_dict() if not trade_df.empty else None
+
+@cached_query
+def get_trade_labels():
+    """
+    Get the label of every trade shown by the trade pickers.
+
+    Built with column operations once per data version, so formatting an
+    option is a single lookup.
+
+    Returns:
+        Series: 'شناسه <id>: <Jalali date> - <trade type> <asset name>' labels
+            indexed by trade ID
+    """
+    conn = get_connection()
+    try:
+        trades_df = pd.read_sql('SELECT id, jalali_date, trade_type, asset_name FROM trades', conn)
+    finally:
+        conn.close()
+
+    # The text columns of an empty result don't concatenate
+    if trades_df.empty:
+        return pd.Series(dtype=object)
+
+    labels = ("شناسه " + trades_df['id'].astype(str) + ": " + trades_df['jalali_date'].fillna('') +
+              " - " + trades_df['trade_type'] + " " + trades_df['asset_name'])
+    return pd.Series(labels.to_numpy(), index=trades_df['id'].to_numpy())
+
+@cached_query
+def search_trades(search=None, limit=TRADE_SEARCH_LIMIT):
+    """
+    Find trades by ID, asset name or Jalali date, newest first.
+
+    Args:
+        search (str, optional): Trade ID, part of an asset name or the start
+            of a Jalali date (YYYY/MM/DD or YYYY-MM-DD); the newest trades
+            are returned when empty
+        limit (int): Maximum number of trades to return
+
+    Returns:
+        list: IDs of the matching trades
+    """
+    conditions = []
+    params = []
+    search = (search or '').strip()
+    if search:
+        conditions = ['CAST(id AS TEXT) = ?', 'asset_name LIKE ?', 'jalali_date LIKE ?']
+        params = [search, f"%{search}%", f"{search.replace('-', '/')}%"]
+
+    query = f'''
+        SELECT id
+        FROM trades
+        {'WHERE ' + ' OR '.join(conditions) if conditions else ''}
+        ORDER BY trade_date DESC, id DESC
+        LIMIT ?
+    '''
+    params.append(int(limit))
+
+    if not USE_SQLITE:
+        query = query.replace('?', '%s').replace('asset_name LIKE', 'asset_name ILIKE')
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+@cached_query
+def get_trade_asset_types():
+    """
+    Get the asset types that have been traded.
+    
+    Returns:
+        list: Asset types in alphabetical order
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT asset_type FROM assets ORDER BY asset_type')
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+@cached_query
+def get_assets():
+    """
+    Get every asset ordered by type and name.
+    
+    Returns:
+        DataFrame: All columns of the assets table
+    """
+    conn = get_connection()
+    try:
+        return pd.read_sql('SELECT * FROM assets ORDER BY asset_type, asset_name', conn)
+    finally:
+        conn.close()
+
+@cached_query
+def get_portfolio_snapshot():
+    """
+    Get everything the portfolio page shows in one query.
+    
+    Each asset comes with its value and unrealized profit/loss, computed in
+    SQL, and the totals of its sales from the asset_stats rollup; the cash
+    balance is joined onto every row.
+    
+    Returns:
+        dict: 'holdings', a DataFrame of every asset ordered by type and name
+            (all asset columns plus total_value, profit_loss, profit_loss_pct,
+            sold_quantity and total_sales, the last two missing for assets
+            never sold), and 'cash_balance', the cash balance in IRR
     """
+    conn = get_connection()
+    try:
+        snapshot_df = pd.read_sql('''
+            SELECT a.id, a.asset_name, a.asset_type, a.quantity, a.avg_buy_price, a.current_price,
+                   a.last_updated,
+                   a.quantity * a.current_price AS total_value,
+                   a.quantity * (a.current_price - a.avg_buy_price) AS profit_loss,
+                   CASE WHEN a.avg_buy_price <> 0
+                        THEN (a.current_price - a.avg_buy_price) / a.avg_buy_price * 100
+                   END AS profit_loss_pct,
+                   s.qty_sold AS sold_quantity, s.sales_total AS total_sales,
+                   c.cash_balance
+            FROM (SELECT COALESCE((SELECT amount_irr FROM cash_balance WHERE id = 1), 0) AS cash_balance) c
+            LEFT JOIN assets a ON TRUE
+            LEFT JOIN asset_stats s ON s.asset_name = a.asset_name AND s.sells > 0
+            ORDER BY a.asset_type, a.asset_name
+        ''', conn)
+    finally:
+        conn.close()
+    
+    # The cash row is there even without assets
+    cash_balance = float(snapshot_df['cash_balance'].iloc[0]) if not snapshot_df.empty else 0
+    holdings_df = snapshot_df[snapshot_df['id'].notna()].drop(columns='cash_balance')
+    numeric_columns = ['quantity', 'avg_buy_price', 'current_price', 'total_value', 'profit_loss',
+                       'profit_loss_pct', 'sold_quantity', 'total_sales']
+    holdings_df = holdings_df.astype({'id': int, **dict.fromkeys(numeric_columns, float)})
+    holdings_df = holdings_df.reset_index(drop=True)
+    return {'holdings': holdings_df, 'cash_balance': cash_balance}
+
+@cached_query
+def get_asset_names(asset_type):
+    """
+    Get the names of the existing assets of a type.
+    
+    Args:
+        asset_type (str): Type of the asset
+        
+    Returns:
+        list: Asset names
+    """
+    conn = get_connection()
     try:
-        conn = get_connection()
         cursor = conn.cursor()
         
         if USE_SQLITE:
-            # Check if columns exist in trades table
-            cursor.execute("PRAGMA table_info(trades)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            # Add new columns if they don't exist
-            if 'related_trade_id' not in columns:
-                cursor.execute('ALTER TABLE trades ADD COLUMN related_trade_id INTEGER DEFAULT NULL')
-            if 'trade_category' not in columns:
-                cursor.execute('ALTER TABLE trades ADD COLUMN trade_category TEXT DEFAULT NULL')
-            if 'is_profit_sale' not in columns:
-                cursor.execute('ALTER TABLE trades ADD COLUMN is_profit_sale BOOLEAN DEFAULT 0')
-            if 'currency' not in columns:
-                cursor.execute('ALTER TABLE trades ADD COLUMN currency TEXT DEFAULT "تومان"')
+            cursor.execute('SELECT DISTINCT asset_name FROM assets WHERE asset_type = ?', (asset_type,))
         else:
-            # PostgreSQL version
-            # Check if related_trade_id column exists
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'trades' AND column_name = 'related_trade_id'
-            """)
-            if cursor.fetchone() is None:
-                cursor.execute('ALTER TABLE trades ADD COLUMN related_trade_id INTEGER DEFAULT NULL')
+            cursor.execute('SELECT DISTINCT asset_name FROM assets WHERE asset_type = %s', (asset_type,))
+        
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+@cached_query
+def get_monthly_pnl():
+    """
+    Get the realized profit/loss of each Jalali month.
+    
+    Returns:
+        DataFrame: jalali_year, jalali_month, year_month ('YYYY-MM') and
+            profit_loss, oldest month first
+    """
+    conn = get_connection()
+    try:
+        # One pre-aggregated row per month, kept up to date by the write paths
+        monthly_pnl = pd.read_sql('''
+            SELECT period AS year_month, realized_pl AS profit_loss
+            FROM pnl_monthly
+            ORDER BY period
+        ''', conn)
+    finally:
+        conn.close()
+    
+    # Periods are 'YYYY-MM'
+    monthly_pnl['jalali_year'] = monthly_pnl['year_month'].str[:4].astype(int)
+    monthly_pnl['jalali_month'] = monthly_pnl['year_month'].str[5:].astype(int)
+    return monthly_pnl[['jalali_year', 'jalali_month', 'year_month', 'profit_loss']]
+
+@cached_query
+def get_asset_stats():
+    """
+    Get the trade totals of every traded asset from the asset_stats rollup.
+    
+    Returns:
+        DataFrame: asset_name, buys, sells, qty_bought, qty_sold, sales_total,
+            realized_pl, first_trade and last_trade, ordered by asset name
+    """
+    conn = get_connection()
+    try:
+        return pd.read_sql('SELECT * FROM asset_stats ORDER BY asset_name', conn)
+    finally:
+        conn.close()
+
+@cached_query
+def get_trade_category_counts(trade_type):
+    """
+    Count the trades of one type in every trade category.
+    
+    Args:
+        trade_type (str): Type of the trades ('خرید' or 'فروش')
+        
+    Returns:
+        DataFrame: trade_category and count, most used category first.
+            Trades without a category are left out.
+    """
+    placeholder = '?' if USE_SQLITE else '%s'
+    conn = get_connection()
+    try:
+        return pd.read_sql(f'''
+            SELECT trade_category, COUNT(*) AS count
+            FROM trades
+            WHERE trade_type = {placeholder} AND trade_category IS NOT NULL
+            GROUP BY trade_category
+            ORDER BY count DESC, trade_category
+        ''', conn, params=[trade_type])
+    finally:
+        conn.close()
+
+@cached_query
+def get_strategies():
+    """
+    Get the saved portfolio strategies, newest first.
+    
+    Returns:
+        DataFrame: All columns of the strategies table
+    """
+    conn = get_connection()
+    try:
+        return pd.read_sql('SELECT * FROM strategies ORDER BY created_at DESC', conn)
+    finally:
+        conn.close()
+
+def delete_trade(trade_id):
+    """
+    Delete a trade and update related asset data.
+    
+    Args:
+        trade_id (int): ID of the trade to delete
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            if USE_SQLITE:
+                # SQLite version
+                # Get trade information before deleting
+                cursor.execute('SELECT * FROM trades WHERE id = ?', (trade_id,))
+                trade = cursor.fetchone()
+                
+                if not trade:
+                    return False
+                    
+                # Extract trade details
+                asset_name = trade[2]
+                asset_type = trade[3]
                 
-            # Check if trade_category column exists
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'trades' AND column_name = 'trade_category'
-            """)
-            if cursor.fetchone() is None:
-                cursor.execute('ALTER TABLE trades ADD COLUMN trade_category TEXT DEFAULT NULL')
+                # Delete the trade and the funding it took or gave
+                _apply_trades_to_rollups(cursor, 'id = ?', (trade_id,), -1)
+                cursor.execute('DELETE FROM trade_funding WHERE buy_id = ? OR sale_id = ?', (trade_id, trade_id))
+                cursor.execute('DELETE FROM trades WHERE id = ?', (trade_id,))
+            else:
+                # PostgreSQL version
+                # Get trade information before deleting
+                cursor.execute('SELECT * FROM trades WHERE id = %s', (trade_id,))
+                trade = cursor.fetchone()
                 
-            # Check if is_profit_sale column exists
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'trades' AND column_name = 'is_profit_sale'
-            """)
-            if cursor.fetchone() is None:
-                cursor.execute('ALTER TABLE trades ADD COLUMN is_profit_sale BOOLEAN DEFAULT FALSE')
+                if not trade:
+                    return False
+                    
+                # Extract trade details
+                asset_name = trade[2]
+                asset_type = trade[3]
                 
-            # Check if currency column exists
-            cursor.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'trades' AND column_name = 'currency'
-            """)
-            if cursor.fetchone() is None:
-                cursor.execute('ALTER TABLE trades ADD COLUMN currency TEXT DEFAULT \'تومان\'')
+                # Delete the trade and the funding it took or gave
+                _apply_trades_to_rollups(cursor, 'id = %s', (trade_id,), -1)
+                cursor.execute('DELETE FROM trade_funding WHERE buy_id = %s OR sale_id = %s', (trade_id, trade_id))
+                cursor.execute('DELETE FROM trades WHERE id = %s', (trade_id,))
+            
+            # Recalculate asset data in the same transaction
+            if asset_triggers_enabled():
+                _update_sale_profit_loss(cursor, asset_name)
+            else:
+                _recalculate_asset(cursor, asset_name, asset_type)
+            _prune_rollups(cursor, [asset_name])
         
-        conn.commit()
-        conn.close()
         return True
     except Exception as e:
-        print(f"Error updating database schema: {e}")
+        print(f"Error deleting trade: {e}")
         return False
 
-def get_connection():
+def _recalculate_asset(cursor, asset_name, asset_type):
     """
-    Get a connection to the database.
+    Recalculate an asset from its trades using an open cursor, without committing.
     
-    Returns:
-        Connection: A database connection (PostgreSQL or SQLite)
+    Quantity and weighted average buy price are aggregated in SQL and the
+    profit/loss of every sell trade is rewritten with one UPDATE.
+    
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        asset_name (str): Name of the asset
+        asset_type (str): Type of the asset
+    """
+    if USE_SQLITE:
+        # SQLite version
+        # Aggregate bought/sold quantity and buy cost in one pass
+        cursor.execute('''
+            SELECT COALESCE(SUM(CASE WHEN trade_type = 'خرید' THEN quantity END), 0),
+                   COALESCE(SUM(CASE WHEN trade_type = 'فروش' THEN quantity END), 0),
+                   COALESCE(SUM(CASE WHEN trade_type = 'خرید' THEN quantity * price END), 0)
+            FROM trades 
+            WHERE asset_name = ?
+        ''', (asset_name,))
+        total_bought, total_sold, total_cost = cursor.fetchone()
+        
+        current_quantity = total_bought - total_sold
+        avg_buy_price = total_cost / total_bought if total_bought > 0 else 0
+        
+        # Update or insert asset data
+        cursor.execute('''
+            UPDATE assets 
+            SET quantity = ?, avg_buy_price = ?, bought_quantity = ?, buy_cost = ?, last_updated = ? 
+            WHERE asset_name = ?
+        ''', (current_quantity, avg_buy_price, total_bought, total_cost, datetime.now(), asset_name))
+        
+        if cursor.rowcount == 0:  # Asset doesn't exist
+            cursor.execute('''
+                INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                    last_updated, bought_quantity, buy_cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (asset_name, asset_type, current_quantity, avg_buy_price, 0, datetime.now(),
+                  total_bought, total_cost))
+        
+        # Update profit/loss values for all sell trades at once
+        _rewrite_sale_profit_loss(cursor, '''
+            UPDATE trades 
+            SET profit_loss = quantity * (price - ?) 
+            WHERE asset_name = ? AND trade_type = 'فروش'
+        ''', (avg_buy_price, asset_name), asset_name)
+    else:
+        # PostgreSQL version
+        # Aggregate bought/sold quantity and buy cost in one pass
+        cursor.execute('''
+            SELECT COALESCE(SUM(quantity) FILTER (WHERE trade_type = 'خرید'), 0),
+                   COALESCE(SUM(quantity) FILTER (WHERE trade_type = 'فروش'), 0),
+                   COALESCE(SUM(quantity * price) FILTER (WHERE trade_type = 'خرید'), 0)
+            FROM trades 
+            WHERE asset_name = %s
+        ''', (asset_name,))
+        total_bought, total_sold, total_cost = cursor.fetchone()
+        
+        current_quantity = total_bought - total_sold
+        avg_buy_price = total_cost / total_bought if total_bought > 0 else 0
+        
+        # Update or insert asset data
+        cursor.execute('''
+            UPDATE assets 
+            SET quantity = %s, avg_buy_price = %s, bought_quantity = %s, buy_cost = %s, last_updated = %s 
+            WHERE asset_name = %s
+        ''', (current_quantity, avg_buy_price, total_bought, total_cost, datetime.now(), asset_name))
+        
+        if cursor.rowcount == 0:  # Asset doesn't exist
+            cursor.execute('''
+                INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                    last_updated, bought_quantity, buy_cost)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ''', (asset_name, asset_type, current_quantity, avg_buy_price, 0, datetime.now(),
+                  total_bought, total_cost))
+        
+        # Update profit/loss values for all sell trades at once
+        _rewrite_sale_profit_loss(cursor, '''
+            UPDATE trades 
+            SET profit_loss = quantity * (price - %s) 
+            WHERE asset_name = %s AND trade_type = 'فروش'
+        ''', (avg_buy_price, asset_name), asset_name)
+
+def _update_sale_profit_loss(cursor, asset_name):
+    """
+    Rewrite the profit/loss of an asset's sell trades from its stored average
+    buy price, using an open cursor and without committing.
+    
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+        asset_name (str): Name of the asset
     """
     if USE_SQLITE:
-        return sqlite3.connect('portfolio.db')
+        _rewrite_sale_profit_loss(cursor, '''
+            UPDATE trades 
+            SET profit_loss = quantity * (price - COALESCE(
+                (SELECT avg_buy_price FROM assets WHERE asset_name = ?), 0))
+            WHERE asset_name = ? AND trade_type = 'فروش'
+        ''', (asset_name, asset_name), asset_name)
     else:
-        # Connect to PostgreSQL
-        return psycopg2.connect(DATABASE_URL)
+        _rewrite_sale_profit_loss(cursor, '''
+            UPDATE trades 
+            SET profit_loss = quantity * (price - COALESCE(
+                (SELECT avg_buy_price FROM assets WHERE asset_name = %s), 0))
+            WHERE asset_name = %s AND trade_type = 'فروش'
+        ''', (asset_name, asset_name), asset_name)
 
-def update_asset_after_trade(asset_name, asset_type, quantity, price, trade_type):
+def recalculate_asset_data(asset_name, asset_type):
     """
-    Update asset information after a trade is recorded.
+    Recalculate asset data based on all related trades.
     
     Args:
         asset_name (str): Name of the asset
         asset_type (str): Type of the asset
-        quantity (float): Quantity traded
-        price (float): Price of the trade
-        trade_type (str): Type of trade (خرید/فروش)
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        if USE_SQLITE:
-            # SQLite version
-            # Check if asset exists
-            cursor.execute('SELECT * FROM assets WHERE asset_name = ?', (asset_name,))
-            asset = cursor.fetchone()
-            
-            if trade_type == 'خرید':
-                if asset:
-                    # Asset exists, update it
-                    current_quantity = asset[3]
-                    current_avg_price = asset[4]
-                    
-                    # Calculate new average price and quantity
-                    new_quantity = current_quantity + quantity
-                    if new_quantity > 0:
-                        new_avg_price = ((current_quantity * current_avg_price) + (quantity * price)) / new_quantity
-                    else:
-                        new_avg_price = price
-                    
-                    cursor.execute('''
-                        UPDATE assets 
-                        SET quantity = ?, avg_buy_price = ?, current_price = ?, last_updated = ? 
-                        WHERE asset_name = ?
-                    ''', (new_quantity, new_avg_price, price, datetime.now(), asset_name))
-                else:
-                    # New asset, insert it
-                    cursor.execute('''
-                        INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, last_updated)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (asset_name, asset_type, quantity, price, price, datetime.now()))
-            elif trade_type == 'فروش':
-                if asset:
-                    # Update quantity after sell
-                    new_quantity = asset[3] - quantity
-                    
-                    # Keep the average buy price the same
-                    cursor.execute('''
-                        UPDATE assets 
-                        SET quantity = ?, current_price = ?, last_updated = ? 
-                        WHERE asset_name = ?
-                    ''', (new_quantity, price, datetime.now(), asset_name))
-                    
-                    # If quantity is zero, optionally delete the asset
-                    if new_quantity <= 0:
-                        pass  # We'll keep the asset with zero quantity for history
-                else:
-                    # Shouldn't happen, but handle it anyway
-                    cursor.execute('''
-                        INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, last_updated)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (asset_name, asset_type, -quantity, price, price, datetime.now()))
-        else:
-            # PostgreSQL version
-            # Check if asset exists
-            cursor.execute('SELECT * FROM assets WHERE asset_name = %s', (asset_name,))
-            asset = cursor.fetchone()
-            
-            if trade_type == 'خرید':
-                if asset:
-                    # Asset exists, update it
-                    current_quantity = asset[3]
-                    current_avg_price = asset[4]
-                    
-                    # Calculate new average price and quantity
-                    new_quantity = current_quantity + quantity
-                    if new_quantity > 0:
-                        new_avg_price = ((current_quantity * current_avg_price) + (quantity * price)) / new_quantity
-                    else:
-                        new_avg_price = price
-                    
-                    cursor.execute('''
-                        UPDATE assets 
-                        SET quantity = %s, avg_buy_price = %s, current_price = %s, last_updated = %s 
-                        WHERE asset_name = %s
-                    ''', (new_quantity, new_avg_price, price, datetime.now(), asset_name))
-                else:
-                    # New asset, insert it
-                    cursor.execute('''
-                        INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, last_updated)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    ''', (asset_name, asset_type, quantity, price, price, datetime.now()))
-            elif trade_type == 'فروش':
-                if asset:
-                    # Update quantity after sell
-                    new_quantity = asset[3] - quantity
-                    
-                    # Keep the average buy price the same
-                    cursor.execute('''
-                        UPDATE assets 
-                        SET quantity = %s, current_price = %s, last_updated = %s 
-                        WHERE asset_name = %s
-                    ''', (new_quantity, price, datetime.now(), asset_name))
-                    
-                    # If quantity is zero, optionally delete the asset
-                    if new_quantity <= 0:
-                        pass  # We'll keep the asset with zero quantity for history
-                else:
-                    # Shouldn't happen, but handle it anyway
-                    cursor.execute('''
-                        INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, last_updated)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    ''', (asset_name, asset_type, -quantity, price, price, datetime.now()))
-        
-        conn.commit()
-        conn.close()
+        with connection() as conn:
+            _recalculate_asset(conn.cursor(), asset_name, asset_type)
         return True
     except Exception as e:
-        print(f"Error updating asset: {e}")
+        print(f"Error recalculating asset data: {e}")
         return False
 
-def update_cash_balance(amount, is_deposit=True):
+def _rebuild_all_positions(cursor, progress=None):
     """
-    Update cash balance.
+    Rebuild every asset position, sell-trade profit/loss and the rollups
+    using an open cursor, without committing.
     
     Args:
-        amount (float): Amount to add or subtract
-        is_deposit (bool): True for deposit, False for withdrawal
+        cursor: Cursor of the connection that owns the current transaction
+        progress (callable, optional): Called as progress(step, total_steps, message)
+            before each step
+    
+    Returns:
+        tuple: (rows written per step, seconds spent per step)
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    steps = [
+        ('positions', "بازسازی تعداد و میانگین قیمت خرید دارایی‌ها"),
+        ('orphans', "صفر کردن دارایی‌های بدون معامله"),
+        ('profit_loss', "محاسبه سود/زیان معاملات فروش"),
+        ('rollups', "بازسازی جمع‌های ماهانه و دارایی‌ها"),
+    ]
+    counts = {}
+    timings = {}
+    now = datetime.now()
     
     if USE_SQLITE:
         # SQLite version
-        cursor.execute('SELECT amount_irr FROM cash_balance WHERE id = 1')
-        current_balance = cursor.fetchone()[0]
-        
-        if is_deposit:
-            new_balance = current_balance + amount
-        else:
-            new_balance = current_balance - amount
-        
-        cursor.execute('''
-            UPDATE cash_balance 
-            SET amount_irr = ?, last_updated = ? 
-            WHERE id = 1
-        ''', (new_balance, datetime.now()))
+        statements = {
+            'positions': ('''
+                INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                    last_updated, bought_quantity, buy_cost)
+                SELECT asset_name, MAX(asset_type),
+                       SUM(CASE WHEN trade_type = 'خرید' THEN quantity ELSE 0 END)
+                         - SUM(CASE WHEN trade_type = 'فروش' THEN quantity ELSE 0 END),
+                       COALESCE(SUM(CASE WHEN trade_type = 'خرید' THEN quantity * price END)
+                         / NULLIF(SUM(CASE WHEN trade_type = 'خرید' THEN quantity END), 0), 0),
+                       0, ?,
+                       SUM(CASE WHEN trade_type = 'خرید' THEN quantity ELSE 0 END),
+                       SUM(CASE WHEN trade_type = 'خرید' THEN quantity * price ELSE 0 END)
+                FROM trades
+                WHERE TRUE
+                GROUP BY asset_name
+                ON CONFLICT (asset_name) DO UPDATE SET
+                    quantity = excluded.quantity,
+                    avg_buy_price = excluded.avg_buy_price,
+                    bought_quantity = excluded.bought_quantity,
+                    buy_cost = excluded.buy_cost,
+                    last_updated = excluded.last_updated
+            ''', (now,)),
+            'orphans': ('''
+                UPDATE assets 
+                SET quantity = 0, avg_buy_price = 0, bought_quantity = 0, buy_cost = 0, last_updated = ? 
+                WHERE asset_name NOT IN (SELECT asset_name FROM trades)
+            ''', (now,)),
+            'profit_loss': ('''
+                UPDATE trades 
+                SET profit_loss = pl.profit_loss
+                FROM (
+                    SELECT id, trade_type,
+                           quantity * (price - COALESCE(
+                               SUM(CASE WHEN trade_type = 'خرید' THEN quantity * price END) OVER w
+                               / NULLIF(SUM(CASE WHEN trade_type = 'خرید' THEN quantity END) OVER w, 0),
+                               0)) AS profit_loss
+                    FROM trades
+                    WINDOW w AS (PARTITION BY asset_name)
+                ) AS pl
+                WHERE trades.id = pl.id AND pl.trade_type = 'فروش'
+            ''', ()),
+        }
     else:
         # PostgreSQL version
-        cursor.execute('SELECT amount_irr FROM cash_balance WHERE id = 1')
-        current_balance = cursor.fetchone()[0]
-        
-        if is_deposit:
-            new_balance = current_balance + amount
+        statements = {
+            'positions': ('''
+                INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                    last_updated, bought_quantity, buy_cost)
+                SELECT asset_name, MAX(asset_type),
+                       COALESCE(SUM(quantity) FILTER (WHERE trade_type = 'خرید'), 0)
+                         - COALESCE(SUM(quantity) FILTER (WHERE trade_type = 'فروش'), 0),
+                       COALESCE(SUM(quantity * price) FILTER (WHERE trade_type = 'خرید')
+                         / NULLIF(SUM(quantity) FILTER (WHERE trade_type = 'خرید'), 0), 0),
+                       0, %s,
+                       COALESCE(SUM(quantity) FILTER (WHERE trade_type = 'خرید'), 0),
+                       COALESCE(SUM(quantity * price) FILTER (WHERE trade_type = 'خرید'), 0)
+                FROM trades
+                GROUP BY asset_name
+                ON CONFLICT (asset_name) DO UPDATE SET
+                    quantity = EXCLUDED.quantity,
+                    avg_buy_price = EXCLUDED.avg_buy_price,
+                    bought_quantity = EXCLUDED.bought_quantity,
+                    buy_cost = EXCLUDED.buy_cost,
+                    last_updated = EXCLUDED.last_updated
+            ''', (now,)),
+            'orphans': ('''
+                UPDATE assets 
+                SET quantity = 0, avg_buy_price = 0, bought_quantity = 0, buy_cost = 0, last_updated = %s 
+                WHERE asset_name NOT IN (SELECT asset_name FROM trades)
+            ''', (now,)),
+            'profit_loss': ('''
+                UPDATE trades 
+                SET profit_loss = pl.profit_loss
+                FROM (
+                    SELECT id, trade_type,
+                           quantity * (price - COALESCE(
+                               SUM(quantity * price) FILTER (WHERE trade_type = 'خرید') OVER w
+                               / NULLIF(SUM(quantity) FILTER (WHERE trade_type = 'خرید') OVER w, 0),
+                               0)) AS profit_loss
+                    FROM trades
+                    WINDOW w AS (PARTITION BY asset_name)
+                ) AS pl
+                WHERE trades.id = pl.id AND pl.trade_type = 'فروش'
+            ''', ()),
+        }
+    
+    for step, (name, message) in enumerate(steps, start=1):
+        if progress:
+            progress(step, len(steps), message)
+        step_started = time.perf_counter()
+        if name == 'rollups':
+            # The profit/loss of every sale may have changed
+            counts[name] = _rebuild_rollups(cursor)
         else:
-            new_balance = current_balance - amount
-        
-        cursor.execute('''
-            UPDATE cash_balance 
-            SET amount_irr = %s, last_updated = %s 
-            WHERE id = 1
-        ''', (new_balance, datetime.now()))
+            query, params = statements[name]
+            cursor.execute(query, params)
+            counts[name] = cursor.rowcount
+        timings[name] = time.perf_counter() - step_started
     
-    conn.commit()
-    conn.close()
+    return counts, timings
+
+def rebuild_all_positions(progress=None):
+    """
+    Rebuild every asset position and sell-trade profit/loss from the trade ledger.
     
-    return new_balance
+    Quantities and weighted average buy prices of all assets come from one
+    grouped query and are written back with a single bulk upsert; the
+    profit/loss of every sale is then set from a window over each asset's
+    trades, and the pnl_monthly and asset_stats rollups are regrouped.
+    Everything runs in one transaction.
+    
+    Args:
+        progress (callable, optional): Called as progress(step, total_steps, message)
+            before each step
+    
+    Returns:
+        dict: Number of assets and sales rebuilt, per-step timings and total
+            elapsed seconds, or None if the rebuild failed
+    """
+    started = time.perf_counter()
+    
+    try:
+        with connection() as conn:
+            counts, timings = _rebuild_all_positions(conn.cursor(), progress)
+            commit_started = time.perf_counter()
+        # Leaving the block commits and invalidates the cached reads
+        timings['commit'] = time.perf_counter() - commit_started
+        
+        return {
+            'assets': counts['positions'],
+            'sales': counts['profit_loss'],
+            'timings': timings,
+            'elapsed': time.perf_counter() - started,
+        }
+    except Exception as e:
+        print(f"Error rebuilding positions: {e}")
+        return None
 
-def update_asset_current_price(asset_name, current_price):
+def _asset_delta_sql(row, sign, now_sql, set_current_price=False):
     """
-    Update the current price of an asset.
+    Build the UPDATE that adds a trade row to (or removes it from) its asset.
     
     Args:
-        asset_name (str): Name of the asset
-        current_price (float): Current price of the asset
+        row (str): NEW or OLD, the trigger row to apply
+        sign (int): 1 to add the trade, -1 to remove it
+        now_sql (str): SQL expression for the current time
+        set_current_price (bool): Also take the trade price as the current price
+        
+    Returns:
+        str: SQL statement for a trigger body
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    op = '+' if sign > 0 else '-'
+    quantity = f"CASE WHEN {row}.trade_type = 'خرید' THEN {row}.quantity ELSE -{row}.quantity END"
+    bought = f"CASE WHEN {row}.trade_type = 'خرید' THEN {row}.quantity ELSE 0 END"
+    cost = f"CASE WHEN {row}.trade_type = 'خرید' THEN {row}.quantity * {row}.price ELSE 0 END"
+    current_price = f"current_price = {row}.price," if set_current_price else ""
+    
+    # SET expressions see the old column values, so the average is computed
+    # from the updated totals inline
+    return f"""
+        UPDATE assets SET
+            quantity = quantity {op} ({quantity}),
+            bought_quantity = bought_quantity {op} ({bought}),
+            buy_cost = buy_cost {op} ({cost}),
+            avg_buy_price = CASE WHEN bought_quantity {op} ({bought}) > {ASSET_TRIGGER_EPSILON}
+                                 THEN (buy_cost {op} ({cost})) / (bought_quantity {op} ({bought}))
+                                 ELSE 0 END,
+            {current_price}
+            last_updated = {now_sql}
+        WHERE asset_name = {row}.asset_name;
+    """
+
+def _asset_trigger_ddl():
+    """
+    Get the DDL statements that install the asset triggers.
     
+    Returns:
+        list: SQL statements to execute in order
+    """
     if USE_SQLITE:
         # SQLite version
-        cursor.execute('''
-            UPDATE assets 
-            SET current_price = ?, last_updated = ? 
-            WHERE asset_name = ?
-        ''', (current_price, datetime.now(), asset_name))
+        now_sql = "datetime('now', 'localtime')"
+        ensure_asset = """
+            INSERT OR IGNORE INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                          last_updated, bought_quantity, buy_cost)
+            VALUES (NEW.asset_name, NEW.asset_type, 0, 0, NEW.price, datetime('now', 'localtime'), 0, 0);
+        """
+        return [
+            f"""
+            CREATE TRIGGER trg_trades_asset_insert AFTER INSERT ON trades
+            BEGIN
+                {ensure_asset}
+                {_asset_delta_sql('NEW', 1, now_sql, set_current_price=True)}
+            END
+            """,
+            f"""
+            CREATE TRIGGER trg_trades_asset_update 
+            AFTER UPDATE OF asset_name, asset_type, trade_type, quantity, price ON trades
+            BEGIN
+                {_asset_delta_sql('OLD', -1, now_sql)}
+                {ensure_asset}
+                {_asset_delta_sql('NEW', 1, now_sql)}
+            END
+            """,
+            f"""
+            CREATE TRIGGER trg_trades_asset_delete AFTER DELETE ON trades
+            BEGIN
+                {_asset_delta_sql('OLD', -1, now_sql)}
+            END
+            """,
+        ]
     else:
         # PostgreSQL version
-        cursor.execute('''
-            UPDATE assets 
-            SET current_price = %s, last_updated = %s 
-            WHERE asset_name = %s
-        ''', (current_price, datetime.now(), asset_name))
+        now_sql = "NOW()"
+        ensure_asset = """
+            INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, 
+                                last_updated, bought_quantity, buy_cost)
+            VALUES (NEW.asset_name, NEW.asset_type, 0, 0, NEW.price, NOW(), 0, 0)
+            ON CONFLICT (asset_name) DO NOTHING;
+        """
+        return [
+            f"""
+            CREATE OR REPLACE FUNCTION maintain_asset_position() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    {_asset_delta_sql('OLD', -1, now_sql)}
+                END IF;
+                IF TG_OP = 'INSERT' THEN
+                    {ensure_asset}
+                    {_asset_delta_sql('NEW', 1, now_sql, set_current_price=True)}
+                ELSIF TG_OP = 'UPDATE' THEN
+                    {ensure_asset}
+                    {_asset_delta_sql('NEW', 1, now_sql)}
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE TRIGGER trg_trades_asset_position
+            AFTER INSERT OR DELETE OR UPDATE OF asset_name, asset_type, trade_type, quantity, price
+            ON trades
+            FOR EACH ROW EXECUTE FUNCTION maintain_asset_position()
+            """,
+        ]
+
+def _drop_asset_triggers(cursor):
+    """
+    Drop the asset triggers if they exist.
     
-    conn.commit()
-    conn.close()
+    Args:
+        cursor: Cursor of the connection that owns the current transaction
+    """
+    if USE_SQLITE:
+        for name in ASSET_TRIGGER_NAMES:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    else:
+        cursor.execute('DROP TRIGGER IF EXISTS trg_trades_asset_position ON trades')
+        cursor.execute('DROP FUNCTION IF EXISTS maintain_asset_position()')
 
-def get_available_sale_transactions():
+def asset_triggers_enabled():
     """
-    Get all sale transactions that can be linked to new purchases.
-    These are sales that don't have all funds already used for purchases.
+    Check whether assets are maintained by database triggers.
+    
+    The answer is cached for the process and refreshed by
+    enable_asset_triggers() and disable_asset_triggers().
     
     Returns:
-        list: List of dictionaries containing sale transaction details
+        bool: True if the asset triggers are installed
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        if USE_SQLITE:
-            # SQLite version - Get sales that don't have all funds allocated
-            cursor.execute('''
-                SELECT s.id, s.trade_date, s.asset_name, s.asset_type, s.quantity, 
-                       s.price, s.total_amount, s.profit_loss, s.notes, s.created_at
-                FROM trades s
-                WHERE s.trade_type = 'فروش' 
-                ORDER BY s.trade_date DESC
-            ''')
-            sales = cursor.fetchall()
-            
-            # Get the column names
-            columns = [column[0] for column in cursor.description]
-            
-            # Convert to list of dictionaries
-            sales_list = []
-            for sale in sales:
-                sale_dict = dict(zip(columns, sale))
-                
-                # Get sum of related purchases for this sale
-                cursor.execute('''
-                    SELECT COALESCE(SUM(total_amount), 0) 
-                    FROM trades 
-                    WHERE related_trade_id = ? AND trade_type = 'خرید'
-                ''', (sale_dict['id'],))
-                allocated_amount = cursor.fetchone()[0] or 0
-                
-                # Calculate remaining amount
-                sale_dict['available_amount'] = sale_dict['total_amount'] - allocated_amount
-                
-                # Only include if there's still money available
-                if sale_dict['available_amount'] > 0:
-                    sales_list.append(sale_dict)
+    global _asset_triggers_enabled
+    if _asset_triggers_enabled is None:
+        try:
+            conn = get_connection()
+            try:
+                cursor = conn.cursor()
                 
-        else:
-            # PostgreSQL version
-            cursor.execute('''
-                SELECT s.id, s.trade_date, s.asset_name, s.asset_type, s.quantity, 
-                       s.price, s.total_amount, s.profit_loss, s.notes, s.created_at
-                FROM trades s
-                WHERE s.trade_type = 'فروش'
-                ORDER BY s.trade_date DESC
-            ''')
-            sales = cursor.fetchall()
+                if USE_SQLITE:
+                    cursor.execute(f'''
+                        SELECT COUNT(*) FROM sqlite_master 
+                        WHERE type = 'trigger' AND name IN ({', '.join('?' for _ in ASSET_TRIGGER_NAMES)})
+                    ''', ASSET_TRIGGER_NAMES)
+                    _asset_triggers_enabled = cursor.fetchone()[0] == len(ASSET_TRIGGER_NAMES)
+                else:
+                    cursor.execute("SELECT COUNT(*) FROM pg_trigger WHERE tgname = 'trg_trades_asset_position'")
+                    _asset_triggers_enabled = cursor.fetchone()[0] > 0
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error checking asset triggers: {e}")
+            return False
+    return _asset_triggers_enabled
+
+def enable_asset_triggers():
+    """
+    Install the triggers that keep assets in step with trades.
+    
+    Every insert, update and delete on trades then adjusts quantity, buy
+    totals and average buy price of the affected asset in O(1), so the
+    write paths no longer recalculate assets in Python. Positions are
+    rebuilt from the ledger first so the triggers start from exact totals.
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    global _asset_triggers_enabled
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
             
-            # Get the column names
-            columns = [column[0] for column in cursor.description]
+            _drop_asset_triggers(cursor)
+            for statement in _asset_trigger_ddl():
+                cursor.execute(statement)
             
-            # Convert to list of dictionaries
-            sales_list = []
-            for sale in sales:
-                sale_dict = dict(zip(columns, sale))
-                
-                # Get sum of related purchases for this sale
-                cursor.execute('''
-                    SELECT COALESCE(SUM(total_amount), 0) 
-                    FROM trades 
-                    WHERE related_trade_id = %s AND trade_type = 'خرید'
-                ''', (sale_dict['id'],))
-                allocated_amount = cursor.fetchone()[0] or 0
-                
-                # Calculate remaining amount
-                sale_dict['available_amount'] = sale_dict['total_amount'] - allocated_amount
-                
-                # Only include if there's still money available
-                if sale_dict['available_amount'] > 0:
-                    sales_list.append(sale_dict)
-                
-        conn.close()
-        return sales_list
+            # Seed the running totals the triggers build on
+            _rebuild_all_positions(cursor)
+        _asset_triggers_enabled = True
+        return True
     except Exception as e:
-        print(f"Error getting available sale transactions: {e}")
-        return []
+        print(f"Error enabling asset triggers: {e}")
+        return False
 
-def delete_trade(trade_id):
+def disable_asset_triggers():
     """
-    Delete a trade and update related asset data.
+    Remove the asset triggers and go back to Python-side asset updates.
     
-    Args:
-        trade_id (int): ID of the trade to delete
-        
     Returns:
         bool: True if successful, False otherwise
     """
+    global _asset_triggers_enabled
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        if USE_SQLITE:
-            # SQLite version
-            # Get trade information before deleting
-            cursor.execute('SELECT * FROM trades WHERE id = ?', (trade_id,))
-            trade = cursor.fetchone()
-            
-            if not trade:
-                conn.close()
-                return False
-                
-            # Extract trade details
-            asset_name = trade[2]
-            asset_type = trade[3]
-            
-            # Delete the trade
-            cursor.execute('DELETE FROM trades WHERE id = ?', (trade_id,))
-        else:
-            # PostgreSQL version
-            # Get trade information before deleting
-            cursor.execute('SELECT * FROM trades WHERE id = %s', (trade_id,))
-            trade = cursor.fetchone()
-            
-            if not trade:
-                conn.close()
-                return False
-                
-            # Extract trade details
-            asset_name = trade[2]
-            asset_type = trade[3]
-            
-            # Delete the trade
-            cursor.execute('DELETE FROM trades WHERE id = %s', (trade_id,))
-            
-        conn.commit()
-        conn.close()
-        
-        # Recalculate asset data
-        recalculate_asset_data(asset_name, asset_type)
-        
+        with connection() as conn:
+            _drop_asset_triggers(conn.cursor())
+        _asset_triggers_enabled = False
         return True
     except Exception as e:
-        print(f"Error deleting trade: {e}")
+        print(f"Error disabling asset triggers: {e}")
         return False
 
-def recalculate_asset_data(asset_name, asset_type):
+def check_asset_consistency(tolerance=1e-6):
     """
-    Recalculate asset data based on all related trades.
+    Compare the stored asset positions with a full rebuild from the ledger.
+    
+    Quantity, running buy totals and average buy price are checked; every
+    write path keeps the average as buy_cost / bought_quantity.
     
     Args:
-        asset_name (str): Name of the asset
-        asset_type (str): Type of the asset
+        tolerance (float): Allowed relative difference between stored and
+            expected values
+    
+    Returns:
+        list: One dictionary per mismatching field with asset_name, field,
+            stored and expected values; empty if everything matches
     """
+    conn = get_connection()
     try:
-        conn = get_connection()
         cursor = conn.cursor()
+    
+        # Expected positions, computed the same way as rebuild_all_positions()
+        cursor.execute('''
+            SELECT asset_name,
+                   SUM(CASE WHEN trade_type = 'خرید' THEN quantity ELSE 0 END)
+                     - SUM(CASE WHEN trade_type = 'فروش' THEN quantity ELSE 0 END),
+                   SUM(CASE WHEN trade_type = 'خرید' THEN quantity ELSE 0 END),
+                   SUM(CASE WHEN trade_type = 'خرید' THEN quantity * price ELSE 0 END)
+            FROM trades
+            GROUP BY asset_name
+        ''')
+        expected = {}
+        for asset_name, quantity, bought_quantity, buy_cost in cursor.fetchall():
+            expected[asset_name] = {
+                'quantity': quantity,
+                'avg_buy_price': buy_cost / bought_quantity if bought_quantity > 0 else 0,
+                'bought_quantity': bought_quantity,
+                'buy_cost': buy_cost,
+            }
+    
+        cursor.execute('''
+            SELECT asset_name, quantity, avg_buy_price, bought_quantity, buy_cost 
+            FROM assets
+        ''')
+        stored = {
+            row[0]: dict(zip(['quantity', 'avg_buy_price', 'bought_quantity', 'buy_cost'], row[1:]))
+            for row in cursor.fetchall()
+        }
+    finally:
+        conn.close()
+    
+    fields = ['quantity', 'avg_buy_price', 'bought_quantity', 'buy_cost']
+    
+    mismatches = []
+    for asset_name in sorted(set(expected) | set(stored)):
+        if asset_name not in stored:
+            mismatches.append({'asset_name': asset_name, 'field': 'row', 'stored': None, 'expected': 'present'})
+            continue
         
-        if USE_SQLITE:
-            # SQLite version
-            # Get all buy trades for the asset
-            cursor.execute('''
-                SELECT quantity, price, total_amount 
-                FROM trades 
-                WHERE asset_name = ? AND trade_type = 'خرید'
-                ORDER BY trade_date
-            ''', (asset_name,))
-            buy_trades = cursor.fetchall()
-            
-            # Get all sell trades for the asset
-            cursor.execute('''
-                SELECT quantity 
-                FROM trades 
-                WHERE asset_name = ? AND trade_type = 'فروش'
-                ORDER BY trade_date
-            ''', (asset_name,))
-            sell_trades = cursor.fetchall() or []
-            
-            # Calculate total bought and current quantity
-            total_bought = sum(trade[0] for trade in buy_trades) if buy_trades else 0
-            total_sold = sum(trade[0] for trade in sell_trades) if sell_trades else 0
-            current_quantity = total_bought - total_sold
-            
-            # Calculate average buy price if there are buy trades
-            if buy_trades:
-                total_cost = sum(trade[0] * trade[1] for trade in buy_trades)
-                avg_buy_price = total_cost / total_bought if total_bought > 0 else 0
-            else:
-                avg_buy_price = 0
-                
-            # Get current price
-            cursor.execute('SELECT current_price FROM assets WHERE asset_name = ?', (asset_name,))
-            result = cursor.fetchone()
-            current_price = result[0] if result and result[0] is not None else 0
-            
-            # Update or insert asset data
-            cursor.execute('''
-                UPDATE assets 
-                SET quantity = ?, avg_buy_price = ?, last_updated = ? 
-                WHERE asset_name = ?
-            ''', (current_quantity, avg_buy_price, datetime.now(), asset_name))
-            
-            if cursor.rowcount == 0:  # Asset doesn't exist
-                cursor.execute('''
-                    INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, last_updated)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (asset_name, asset_type, current_quantity, avg_buy_price, current_price, datetime.now()))
-                
-            # Update profit/loss values for sell trades
-            for sell_trade in cursor.execute('''
-                SELECT id, quantity, price FROM trades WHERE asset_name = ? AND trade_type = 'فروش'
-            ''', (asset_name,)):
-                sell_trade_id, sell_quantity, sell_price = sell_trade
-                profit_loss = sell_quantity * (sell_price - avg_buy_price)
-                cursor.execute('UPDATE trades SET profit_loss = ? WHERE id = ?', (profit_loss, sell_trade_id))
-        
-        else:
-            # PostgreSQL version
-            # Get all buy trades for the asset
-            cursor.execute('''
-                SELECT quantity, price, total_amount 
-                FROM trades 
-                WHERE asset_name = %s AND trade_type = 'خرید'
-                ORDER BY trade_date
-            ''', (asset_name,))
-            buy_trades = cursor.fetchall() or []
-            
-            # Get all sell trades for the asset
-            cursor.execute('''
-                SELECT quantity 
-                FROM trades 
-                WHERE asset_name = %s AND trade_type = 'فروش'
-                ORDER BY trade_date
-            ''', (asset_name,))
-            sell_trades = cursor.fetchall() or []
-            
-            # Calculate total bought and current quantity
-            total_bought = sum(trade[0] for trade in buy_trades) if buy_trades else 0
-            total_sold = sum(trade[0] for trade in sell_trades) if sell_trades else 0
-            current_quantity = total_bought - total_sold
-            
-            # Calculate average buy price if there are buy trades
-            if buy_trades:
-                total_cost = sum(trade[0] * trade[1] for trade in buy_trades)
-                avg_buy_price = total_cost / total_bought if total_bought > 0 else 0
-            else:
-                avg_buy_price = 0
-                
-            # Get current price
-            cursor.execute('SELECT current_price FROM assets WHERE asset_name = %s', (asset_name,))
-            result = cursor.fetchone()
-            current_price = result[0] if result and result[0] is not None else 0
-            
-            # Update or insert asset data
-            cursor.execute('''
-                UPDATE assets 
-                SET quantity = %s, avg_buy_price = %s, last_updated = %s 
-                WHERE asset_name = %s
-            ''', (current_quantity, avg_buy_price, datetime.now(), asset_name))
-            
-            if cursor.rowcount == 0:  # Asset doesn't exist
-                cursor.execute('''
-                    INSERT INTO assets (asset_name, asset_type, quantity, avg_buy_price, current_price, last_updated)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                ''', (asset_name, asset_type, current_quantity, avg_buy_price, current_price, datetime.now()))
-                
-            # Update profit/loss values for sell trades
-            cursor.execute('''
-                SELECT id, quantity, price FROM trades WHERE asset_name = %s AND trade_type = 'فروش'
-            ''', (asset_name,))
-            
-            for sell_trade in cursor.fetchall():
-                sell_trade_id, sell_quantity, sell_price = sell_trade
-                profit_loss = sell_quantity * (sell_price - avg_buy_price)
-                cursor.execute('UPDATE trades SET profit_loss = %s WHERE id = %s', (profit_loss, sell_trade_id))
-                
-        conn.commit()
+        for field in fields:
+            expected_value = expected[asset_name][field] if asset_name in expected else 0
+            stored_value = stored[asset_name][field] or 0
+            if abs(stored_value - expected_value) > tolerance * max(1, abs(expected_value)):
+                mismatches.append({
+                    'asset_name': asset_name,
+                    'field': field,
+                    'stored': stored_value,
+                    'expected': expected_value,
+                })
+    
+    return mismatches
+
+def check_rollup_consistency(tolerance=1e-6):
+    """
+    Compare the pnl_monthly and asset_stats rollups with a regrouping of
+    the whole journal.
+
+    Args:
+        tolerance (float): Allowed relative difference between stored and
+            expected values
+
+    Returns:
+        list: One dictionary per mismatching field with table, key, field,
+            stored and expected values; empty if everything matches
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT jalali_year, jalali_month, SUM(profit_loss), COUNT(*)
+            FROM trades
+            WHERE trade_type = 'فروش'
+            GROUP BY jalali_year, jalali_month
+        ''')
+        expected = {
+            ('pnl_monthly', f"{year}-{str(month).zfill(2)}"): {'realized_pl': realized_pl, 'trade_count': trade_count}
+            for year, month, realized_pl, trade_count in cursor.fetchall()
+        }
+        cursor.execute('''
+            SELECT asset_name,
+                   SUM(CASE WHEN trade_type = 'خرید' THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN trade_type = 'فروش' THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN trade_type = 'خرید' THEN quantity ELSE 0 END),
+                   SUM(CASE WHEN trade_type = 'فروش' THEN quantity ELSE 0 END),
+                   SUM(CASE WHEN trade_type = 'فروش' THEN total_amount ELSE 0 END),
+                   SUM(CASE WHEN trade_type = 'فروش' THEN profit_loss ELSE 0 END)
+            FROM trades
+            GROUP BY asset_name
+        ''')
+        asset_fields = ['buys', 'sells', 'qty_bought', 'qty_sold', 'sales_total', 'realized_pl']
+        for row in cursor.fetchall():
+            expected[('asset_stats', row[0])] = dict(zip(asset_fields, row[1:]))
+
+        cursor.execute('SELECT period, realized_pl, trade_count FROM pnl_monthly')
+        stored = {
+            ('pnl_monthly', period): {'realized_pl': realized_pl, 'trade_count': trade_count}
+            for period, realized_pl, trade_count in cursor.fetchall()
+        }
+        cursor.execute(f"SELECT asset_name, {', '.join(asset_fields)} FROM asset_stats")
+        for row in cursor.fetchall():
+            stored[('asset_stats', row[0])] = dict(zip(asset_fields, row[1:]))
+    finally:
         conn.close()
-        return True
-    except Exception as e:
-        print(f"Error recalculating asset data: {e}")
-        return False
+
+    mismatches = []
+    for table, key in sorted(set(expected) | set(stored)):
+        expected_row = expected.get((table, key))
+        stored_row = stored.get((table, key))
+        if expected_row is None or stored_row is None:
+            mismatches.append({
+                'table': table, 'key': key, 'field': 'row',
+                'stored': 'present' if stored_row else None,
+                'expected': 'present' if expected_row else None,
+            })
+            continue
+
+        for field, expected_value in expected_row.items():
+            expected_value = expected_value or 0
+            stored_value = stored_row[field] or 0
+            if abs(stored_value - expected_value) > tolerance * max(1, abs(expected_value)):
+                mismatches.append({
+                    'table': table,
+                    'key': key,
+                    'field': field,
+                    'stored': stored_value,
+                    'expected': expected_value,
+                })
+
+    return mismatches
 
 def edit_trade(trade_id, trade_date, asset_name, asset_type, trade_type, quantity, price, notes, currency=None, is_profit_sale=None, trade_category=None):
     """
@@ -675,121 +2026,140 @@ def edit_trade(trade_id, trade_date, asset_name, asset_type, trade_type, quantit
         bool: True if successful, False otherwise
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
         
-        if USE_SQLITE:
-            # SQLite version
-            # Get original trade data
-            cursor.execute('SELECT asset_name, asset_type FROM trades WHERE id = ?', (trade_id,))
-            original_trade = cursor.fetchone()
+            if USE_SQLITE:
+                # SQLite version
+                # Get original trade data
+                cursor.execute('SELECT asset_name, asset_type FROM trades WHERE id = ?', (trade_id,))
+                original_trade = cursor.fetchone()
             
-            if not original_trade:
-                conn.close()
-                return False
+                if not original_trade:
+                    return False
                 
-            original_asset_name = original_trade[0]
-            original_asset_type = original_trade[1]
+                original_asset_name = original_trade[0]
+                original_asset_type = original_trade[1]
             
-            # Calculate total amount
-            total_amount = quantity * price
+                # Calculate total amount
+                total_amount = quantity * price
             
-            # Calculate profit/loss for sell trade
-            profit_loss = 0
-            if trade_type == 'فروش':
-                cursor.execute('SELECT avg_buy_price FROM assets WHERE asset_name = ?', (asset_name,))
-                result = cursor.fetchone()
-                if result and result[0]:
-                    avg_buy_price = result[0]
-                    profit_loss = quantity * (price - avg_buy_price)
+                # Calculate profit/loss for sell trade
+                profit_loss = 0
+                if trade_type == 'فروش':
+                    cursor.execute('SELECT avg_buy_price FROM assets WHERE asset_name = ?', (asset_name,))
+                    result = cursor.fetchone()
+                    if result and result[0]:
+                        avg_buy_price = result[0]
+                        profit_loss = quantity * (price - avg_buy_price)
             
-            # Update the trade with optional parameters
-            update_fields = [
-                "trade_date = ?", "asset_name = ?", "asset_type = ?", "trade_type = ?",
-                "quantity = ?", "price = ?", "total_amount = ?", "profit_loss = ?", "notes = ?"
-            ]
-            params = [trade_date, asset_name, asset_type, trade_type, quantity, price, 
-                     total_amount, profit_loss, notes]
+                # Update the trade with optional parameters
+                update_fields = [
+                    "trade_date = ?", "asset_name = ?", "asset_type = ?", "trade_type = ?",
+                    "quantity = ?", "price = ?", "total_amount = ?", "profit_loss = ?", "notes = ?",
+                    "jalali_date = ?", "jalali_year = ?", "jalali_month = ?"
+                ]
+                params = [trade_date, asset_name, asset_type, trade_type, quantity, price, 
+                         total_amount, profit_loss, notes, *_jalali_fields(trade_date)]
             
-            # Add optional parameters if provided
-            if currency is not None:
-                update_fields.append("currency = ?")
-                params.append(currency)
+                # Add optional parameters if provided
+                if currency is not None:
+                    update_fields.append("currency = ?")
+                    params.append(currency)
             
-            if is_profit_sale is not None and trade_type == 'فروش':
-                update_fields.append("is_profit_sale = ?")
-                params.append(is_profit_sale)
+                if is_profit_sale is not None and trade_type == 'فروش':
+                    update_fields.append("is_profit_sale = ?")
+                    params.append(is_profit_sale)
                 
-            if trade_category is not None:
-                update_fields.append("trade_category = ?")
-                params.append(trade_category)
+                if trade_category is not None:
+                    update_fields.append("trade_category = ?")
+                    params.append(trade_category)
                 
-            # Add trade_id to params
-            params.append(trade_id)
+                # Add trade_id to params
+                params.append(trade_id)
             
-            # Build and execute the query
-            query = f"UPDATE trades SET {', '.join(update_fields)} WHERE id = ?"
-            cursor.execute(query, params)
-        else:
-            # PostgreSQL version
-            # Get original trade data
-            cursor.execute('SELECT asset_name, asset_type FROM trades WHERE id = %s', (trade_id,))
-            original_trade = cursor.fetchone()
+                # Build and execute the query, moving the trade in the rollups
+                query = f"UPDATE trades SET {', '.join(update_fields)} WHERE id = ?"
+                _apply_trades_to_rollups(cursor, 'id = ?', (trade_id,), -1)
+                cursor.execute(query, params)
+                _apply_trades_to_rollups(cursor, 'id = ?', (trade_id,), 1)
+            else:
+                # PostgreSQL version
+                # Get original trade data
+                cursor.execute('SELECT asset_name, asset_type FROM trades WHERE id = %s', (trade_id,))
+                original_trade = cursor.fetchone()
             
-            if not original_trade:
-                conn.close()
-                return False
+                if not original_trade:
+                    return False
                 
-            original_asset_name = original_trade[0]
-            original_asset_type = original_trade[1]
+                original_asset_name = original_trade[0]
+                original_asset_type = original_trade[1]
             
-            # Calculate total amount
-            total_amount = quantity * price
+                # Calculate total amount
+                total_amount = quantity * price
             
-            # Calculate profit/loss for sell trade
-            profit_loss = 0
-            if trade_type == 'فروش':
-                cursor.execute('SELECT avg_buy_price FROM assets WHERE asset_name = %s', (asset_name,))
-                result = cursor.fetchone()
-                if result and result[0]:
-                    avg_buy_price = result[0]
-                    profit_loss = quantity * (price - avg_buy_price)
+                # Calculate profit/loss for sell trade
+                profit_loss = 0
+                if trade_type == 'فروش':
+                    cursor.execute('SELECT avg_buy_price FROM assets WHERE asset_name = %s', (asset_name,))
+                    result = cursor.fetchone()
+                    if result and result[0]:
+                        avg_buy_price = result[0]
+                        profit_loss = quantity * (price - avg_buy_price)
             
-            # Update the trade with optional parameters
-            update_fields = [
-                "trade_date = %s", "asset_name = %s", "asset_type = %s", "trade_type = %s",
-                "quantity = %s", "price = %s", "total_amount = %s", "profit_loss = %s", "notes = %s"
-            ]
-            params = [trade_date, asset_name, asset_type, trade_type, quantity, price, 
-                     total_amount, profit_loss, notes]
+                # Update the trade with optional parameters
+                update_fields = [
+                    "trade_date = %s", "asset_name = %s", "asset_type = %s", "trade_type = %s",
+                    "quantity = %s", "price = %s", "total_amount = %s", "profit_loss = %s", "notes = %s",
+                    "jalali_date = %s", "jalali_year = %s", "jalali_month = %s"
+                ]
+                params = [trade_date, asset_name, asset_type, trade_type, quantity, price, 
+                         total_amount, profit_loss, notes, *_jalali_fields(trade_date)]
             
-            # Add optional parameters if provided
-            if currency is not None:
-                update_fields.append("currency = %s")
-                params.append(currency)
+                # Add optional parameters if provided
+                if currency is not None:
+                    update_fields.append("currency = %s")
+                    params.append(currency)
             
-            if is_profit_sale is not None and trade_type == 'فروش':
-                update_fields.append("is_profit_sale = %s")
-                params.append(is_profit_sale)
+                if is_profit_sale is not None and trade_type == 'فروش':
+                    update_fields.append("is_profit_sale = %s")
+                    params.append(is_profit_sale)
                 
-            if trade_category is not None:
-                update_fields.append("trade_category = %s")
-                params.append(trade_category)
+                if trade_category is not None:
+                    update_fields.append("trade_category = %s")
+                    params.append(trade_category)
                 
-            # Add trade_id to params
-            params.append(trade_id)
+                # Add trade_id to params
+                params.append(trade_id)
             
-            # Build and execute the query
-            query = f"UPDATE trades SET {', '.join(update_fields)} WHERE id = %s"
-            cursor.execute(query, params)
+                # Build and execute the query, moving the trade in the rollups
+                query = f"UPDATE trades SET {', '.join(update_fields)} WHERE id = %s"
+                _apply_trades_to_rollups(cursor, 'id = %s', (trade_id,), -1)
+                cursor.execute(query, params)
+                _apply_trades_to_rollups(cursor, 'id = %s', (trade_id,), 1)
         
-        conn.commit()
-        conn.close()
+            # Split the new amount across the same funding sales; a trade that is
+            # no longer a buy keeps none and one that is no longer a sale funds none
+            _reallocate_funding(cursor, trade_id, total_amount if trade_type == 'خرید' else 0)
+            if trade_type == 'فروش':
+                # A smaller sale can't keep funding as much as before
+                _cap_sale_funding(cursor, trade_id, total_amount)
+            elif USE_SQLITE:
+                cursor.execute('DELETE FROM trade_funding WHERE sale_id = ?', (trade_id,))
+            else:
+                cursor.execute('DELETE FROM trade_funding WHERE sale_id = %s', (trade_id,))
         
-        # Recalculate asset data for both original and new asset if they're different
-        recalculate_asset_data(asset_name, asset_type)
-        if original_asset_name != asset_name:
-            recalculate_asset_data(original_asset_name, original_asset_type)
+            # Recalculate asset data for both original and new asset if they're different,
+            # in the same transaction as the edit
+            if asset_triggers_enabled():
+                _update_sale_profit_loss(cursor, asset_name)
+                if original_asset_name != asset_name:
+                    _update_sale_profit_loss(cursor, original_asset_name)
+            else:
+                _recalculate_asset(cursor, asset_name, asset_type)
+                if original_asset_name != asset_name:
+                    _recalculate_asset(cursor, original_asset_name, original_asset_type)
+            _prune_rollups(cursor, [asset_name, original_asset_name])
         
         return True
     except Exception as e:
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Currency shown when a trade has none recorded
+DEFAULT_CURRENCY = "تومان"
+
+def format_numbers(values):
+    """
+    Format a column of numbers with thousands separators.
+
+    Vectorized counterpart of utils.format_number(): values are truncated to
+    integers and missing values are shown as 0.
+
+    Args:
+        values (Series): Numbers to format
+
+    Returns:
+        Series: Formatted numbers as strings, with the index of values
+    """
+    values = pd.to_numeric(values, errors='coerce')
+    integers = pd.Series(np.trunc(values.fillna(0).to_numpy(dtype=float)).astype(np.int64),
+                         index=values.index)
+    # str.format on plain ints is about as fast as astype(str) and much
+    # faster than inserting the commas with a regex
+    return integers.map('{:,}'.format)
+
+def format_amounts(values, currencies=None):
+    """
+    Format a column of amounts followed by their currency.
+
+    Args:
+        values (Series): Amounts to format
+        currencies (Series, optional): Currency of each amount, DEFAULT_CURRENCY
+            where missing or when not given
+
+    Returns:
+        Series: Strings such as '1,250,000 تومان'
+    """
+    if currencies is None:
+        currencies = pd.Series(DEFAULT_CURRENCY, index=values.index)
+    return format_numbers(values) + " " + currencies.fillna(DEFAULT_CURRENCY).astype(str)
+
+def format_flags(flags, applies=None, true_label="بله", false_label="خیر", other_label=""):
+    """
+    Turn a column of booleans into labels.
+
+    Args:
+        flags (Series): Boolean values, missing values count as False
+        applies (Series, optional): Rows where an unset flag is shown as
+            false_label; unset flags of the other rows get other_label
+        true_label (str): Label for True
+        false_label (str): Label for False
+        other_label (str): Label for unset flags of rows the flag doesn't apply to
+
+    Returns:
+        Series: Labels, with the index of flags
+    """
+    is_set = flags.fillna(False).astype(bool).to_numpy()
+    unset_label = false_label
+    if applies is not None:
+        unset_label = np.where(applies.to_numpy(dtype=bool), false_label, other_label)
+    return pd.Series(np.where(is_set, true_label, unset_label), index=flags.index)
+
+def number_column(label, help=None):
+    """
+    Column config showing a numeric column with thousands separators.
+
+    Keeping numbers numeric and formatting them in the browser sends less
+    data than pre-formatted strings and keeps the column sortable.
+
+    Args:
+        label (str): Column header
+        help (str, optional): Tooltip of the header
+
+    Returns:
+        NumberColumn: Streamlit column config
+    """
+    return st.column_config.NumberColumn(label, help=help, format="localized")
@@ -0,0 +1,313 @@
+import sys
+
+from database import connection, get_connection, USE_SQLITE
+
+# Secondary indexes the application relies on. Each entry is created at
+# startup if it is missing and rebuilt if its columns don't match.
+INDEXES = [
+    {
+        # recalculate_asset_data: buy and sell totals of one asset, with
+        # quantity and price so the sums never touch the table
+        'name': 'idx_trades_asset_type_date',
+        'table': 'trades',
+        'columns': ['asset_name', 'trade_type', 'trade_date', 'quantity', 'price'],
+    },
+    {
+        # Trade history: newest first, paged by keyset
+        'name': 'idx_trades_date_id',
+        'table': 'trades',
+        'columns': ['trade_date', 'id'],
+    },
+    {
+        # get_available_sale_transactions: only the sales, newest first
+        'name': 'idx_trades_type_date_id',
+        'table': 'trades',
+        'columns': ['trade_type', 'trade_date', 'id'],
+    },
+    {
+        # trade_links of a page and edit_trade: the sales funding each buy
+        'name': 'idx_trade_funding_buy',
+        'table': 'trade_funding',
+        'columns': ['buy_id', 'sale_id', 'amount'],
+    },
+    {
+        # get_available_sale_transactions: funding already taken from each sale
+        'name': 'idx_trade_funding_sale',
+        'table': 'trade_funding',
+        'columns': ['sale_id', 'amount'],
+    },
+    {
+        # Trade form: existing assets of the selected type
+        'name': 'idx_assets_type_name',
+        'table': 'assets',
+        'columns': ['asset_type', 'asset_name'],
+    },
+]
+
+# Hot queries whose plans are checked by print_query_plans(). Placeholders
+# are written as ? and converted for PostgreSQL.
+HOT_QUERIES = [
+    {
+        'name': 'recalculate_asset_data (totals)',
+        'sql': '''
+            SELECT COALESCE(SUM(CASE WHEN trade_type = 'خرید' THEN quantity END), 0),
+                   COALESCE(SUM(CASE WHEN trade_type = 'فروش' THEN quantity END), 0),
+                   COALESCE(SUM(CASE WHEN trade_type = 'خرید' THEN quantity * price END), 0)
+            FROM trades
+            WHERE asset_name = ?
+        ''',
+        'params': ('',),
+    },
+    {
+        'name': 'recalculate_asset_data (sale profit/loss)',
+        'sql': "UPDATE trades SET profit_loss = quantity * (price - ?) WHERE asset_name = ? AND trade_type = 'فروش'",
+        'params': (0, ''),
+    },
+    {
+        'name': 'get_available_sale_transactions',
+        'sql': '''
+            SELECT s.id, s.total_amount - COALESCE(SUM(f.amount), 0)
+            FROM trades s
+            LEFT JOIN trade_funding f ON f.sale_id = s.id
+            WHERE s.trade_type = 'فروش'
+            GROUP BY s.trade_date, s.id
+            HAVING s.total_amount - COALESCE(SUM(f.amount), 0) > 0
+            ORDER BY s.trade_date DESC, s.id DESC
+            LIMIT ?
+        ''',
+        'params': (50,),
+    },
+    {
+        'name': 'trade history (next page)',
+        'sql': '''
+            SELECT t.*
+            FROM trades t
+            WHERE (t.trade_date, t.id) < (?, ?)
+            ORDER BY t.trade_date DESC, t.id DESC
+            LIMIT ?
+        ''',
+        'params': ('', 0, 51),
+    },
+    {
+        'name': 'trade links',
+        'sql': 'SELECT * FROM trade_links',
+        'params': (),
+        # The reinvestment report lists every trade_funding row
+        'full_scan_ok': True,
+    },
+    {
+        'name': 'trade links of a page',
+        'sql': 'SELECT * FROM trade_links WHERE buy_id IN (?, ?)',
+        'params': (0, 0),
+    },
+    {
+        'name': 'trade search',
+        'sql': '''
+            SELECT id
+            FROM trades
+            WHERE CAST(id AS TEXT) = ? OR asset_name LIKE ? OR jalali_date LIKE ?
+            ORDER BY trade_date DESC, id DESC
+            LIMIT ?
+        ''',
+        'params': ('طلا', '%طلا%', 'طلا%', 20),
+        # A LIKE with a leading wildcard can't use an index, and neither can
+        # an OR of conditions on different columns, so the search walks the
+        # trades newest first until it finds enough matches
+        'full_scan_ok': True,
+    },
+    {
+        'name': 'portfolio snapshot',
+        'sql': '''
+            SELECT a.asset_name, s.qty_sold, s.sales_total, c.cash_balance
+            FROM (SELECT COALESCE((SELECT amount_irr FROM cash_balance WHERE id = 1), 0) AS cash_balance) c
+            LEFT JOIN assets a ON TRUE
+            LEFT JOIN asset_stats s ON s.asset_name = a.asset_name AND s.sells > 0
+            ORDER BY a.asset_type, a.asset_name
+        ''',
+        'params': (),
+        # The page lists every asset
+        'full_scan_ok': True,
+    },
+    {
+        'name': 'monthly profit/loss',
+        'sql': 'SELECT period, realized_pl FROM pnl_monthly ORDER BY period',
+        'params': (),
+        # One pre-aggregated row per month
+        'full_scan_ok': True,
+    },
+    {
+        'name': 'rollup delta of a trade',
+        'sql': '''
+            SELECT asset_name, SUM(quantity), MIN(trade_date)
+            FROM trades
+            WHERE id = ?
+            GROUP BY asset_name
+        ''',
+        'params': (0,),
+    },
+    {
+        'name': 'first/last trade of an asset',
+        'sql': 'SELECT MIN(trade_date), MAX(trade_date) FROM trades WHERE asset_name = ?',
+        'params': ('',),
+    },
+    {
+        'name': 'existing assets by type',
+        'sql': 'SELECT DISTINCT asset_name FROM assets WHERE asset_type = ?',
+        'params': ('',),
+    },
+]
+
+def _existing_index_columns(cursor, index):
+    """
+    Get the columns of an existing index.
+
+    Args:
+        cursor: Database cursor
+        index (dict): Entry of INDEXES
+
+    Returns:
+        list: Column names in index order, or None if the index doesn't exist
+    """
+    if USE_SQLITE:
+        cursor.execute(f"PRAGMA index_info({index['name']})")
+        rows = cursor.fetchall()
+        return [row[2] for row in sorted(rows)] if rows else None
+    else:
+        cursor.execute('''
+            SELECT a.attname
+            FROM pg_class i
+            JOIN pg_index ix ON ix.indexrelid = i.oid
+            JOIN LATERAL unnest(ix.indkey) WITH ORDINALITY AS k(attnum, ord) ON TRUE
+            JOIN pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum
+            WHERE i.relname = %s
+            ORDER BY k.ord
+        ''', (index['name'],))
+        rows = cursor.fetchall()
+        return [row[0] for row in rows] if rows else None
+
+def ensure_indexes():
+    """
+    Create missing indexes of INDEXES and rebuild those whose columns differ.
+
+    Returns:
+        dict: Index name mapped to 'ok', 'created' or 'rebuilt'
+    """
+    report = {}
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+
+            for index in INDEXES:
+                existing_columns = _existing_index_columns(cursor, index)
+
+                if existing_columns == index['columns']:
+                    report[index['name']] = 'ok'
+                    continue
+
+                if existing_columns is not None:
+                    cursor.execute(f"DROP INDEX {index['name']}")
+                    report[index['name']] = 'rebuilt'
+                else:
+                    report[index['name']] = 'created'
+
+                cursor.execute(
+                    f"CREATE INDEX {index['name']} ON {index['table']} ({', '.join(index['columns'])})"
+                )
+
+            # Refresh planner statistics for the new indexes. Without them SQLite
+            # prefers any index with an equality match, even for whole-table
+            # aggregates such as the monthly report.
+            if any(status != 'ok' for status in report.values()):
+                for table in sorted({index['table'] for index in INDEXES}):
+                    cursor.execute(f'ANALYZE {table}')
+    except Exception as e:
+        print(f"Error ensuring indexes: {e}")
+    return report
+
+def _scanned_without_condition(node):
+    """
+    Find the PostgreSQL plan nodes that read a whole table or index.
+
+    Args:
+        node (dict): Plan node of EXPLAIN (FORMAT JSON)
+
+    Returns:
+        list: Node types of the full scans under node, itself included
+    """
+    scans = []
+    node_type = node['Node Type']
+    if node_type == 'Seq Scan' or (node_type in ('Index Scan', 'Index Only Scan')
+                                   and 'Index Cond' not in node):
+        scans.append(node_type)
+    for child in node.get('Plans', []):
+        scans.extend(_scanned_without_condition(child))
+    return scans
+
+def explain_query(cursor, query):
+    """
+    Get the plan of a hot query.
+
+    Args:
+        cursor: Database cursor
+        query (dict): Entry of HOT_QUERIES
+
+    Returns:
+        tuple: (list of plan lines, True if the plan reads a whole table and
+            the query is not marked full_scan_ok)
+    """
+    if USE_SQLITE:
+        cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'], query['params'])
+        plan = [row[3] for row in cursor.fetchall()]
+        # "SEARCH" looks rows up by key; "SCAN" walks a whole table or index,
+        # unless it reads a subquery or a constant row
+        subqueries = {line.split()[1] for line in plan if line.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+        full_scan = any(line.startswith('SCAN ') and line.split()[1] not in subqueries | {'CONSTANT'}
+                        for line in plan)
+    else:
+        sql = query['sql'].replace('?', '%s')
+        cursor.execute('EXPLAIN ' + sql, query['params'])
+        plan = [row[0] for row in cursor.fetchall()]
+        # An index scan without an Index Cond walks the whole index
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, query['params'])
+        full_scan = bool(_scanned_without_condition(cursor.fetchone()[0][0]['Plan']))
+    return plan, full_scan and not query.get('full_scan_ok', False)
+
+def print_query_plans():
+    """
+    Print the plan of every hot query and flag the ones that full-scan.
+
+    PostgreSQL reads small tables whole even where an index applies, so on
+    an empty or fresh database every query would look like a full scan.
+    Sequential scans are therefore discouraged for the check, which leaves
+    only the queries no index can serve flagged. SQLite picks the indexes
+    without statistics as well.
+
+    Returns:
+        bool: True if none of the hot queries reads a whole table
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        all_indexed = True
+
+        if not USE_SQLITE:
+            # Only for this transaction, which is rolled back when the
+            # connection goes back to the pool
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        for query in HOT_QUERIES:
+            plan, full_scan = explain_query(cursor, query)
+            all_indexed = all_indexed and not full_scan
+
+            print(f"{'FULL SCAN' if full_scan else 'OK':<9} {query['name']}")
+            for line in plan:
+                print(f"          {line}")
+    finally:
+        conn.close()
+    return all_indexed
+
+if __name__ == "__main__":
+    for name, status in ensure_indexes().items():
+        print(f"{status:<9} {name}")
+    print()
+    sys.exit(0 if print_query_plans() else 1)
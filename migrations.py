@@ -0,0 +1,466 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+from psycopg2.extras import execute_batch
+
+from database import (
+    get_connection, USE_SQLITE, USE_ASSET_TRIGGERS,
+    asset_triggers_enabled, enable_asset_triggers, _rebuild_all_positions, _rebuild_rollups
+)
+from indexes import ensure_indexes
+from utils import format_jalali_dates, jalali_components
+from query_cache import bump_data_version
+
+# Set once the schema has been brought up to date in this server process
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def _column_exists(cursor, table, column):
+    """
+    Check whether a table has a column.
+
+    Args:
+        cursor: Database cursor
+        table (str): Table name
+        column (str): Column name
+
+    Returns:
+        bool: True if the column exists
+    """
+    if USE_SQLITE:
+        cursor.execute(f"PRAGMA table_info({table})")
+        return column in [row[1] for row in cursor.fetchall()]
+    else:
+        cursor.execute("""
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_name = %s AND column_name = %s
+        """, (table, column))
+        return cursor.fetchone() is not None
+
+def _create_base_tables(cursor):
+    """
+    Create the assets, trades, cash_balance and strategies tables.
+    """
+    if USE_SQLITE:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS assets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            asset_name TEXT NOT NULL,
+            asset_type TEXT NOT NULL,
+            quantity REAL DEFAULT 0,
+            avg_buy_price REAL DEFAULT 0,
+            current_price REAL DEFAULT 0,
+            last_updated TIMESTAMP,
+            UNIQUE(asset_name)
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trade_date TIMESTAMP NOT NULL,
+            asset_name TEXT NOT NULL,
+            asset_type TEXT NOT NULL,
+            trade_type TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            price REAL NOT NULL,
+            total_amount REAL NOT NULL,
+            profit_loss REAL DEFAULT 0,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cash_balance (
+            id INTEGER PRIMARY KEY,
+            amount_irr REAL DEFAULT 0,
+            amount_usd REAL DEFAULT 0,
+            last_updated TIMESTAMP
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS strategies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            asset_allocation TEXT,
+            risk_level TEXT,
+            created_at TIMESTAMP,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+    else:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS assets (
+            id SERIAL PRIMARY KEY,
+            asset_name TEXT NOT NULL UNIQUE,
+            asset_type TEXT NOT NULL,
+            quantity DOUBLE PRECISION DEFAULT 0,
+            avg_buy_price DOUBLE PRECISION DEFAULT 0,
+            current_price DOUBLE PRECISION DEFAULT 0,
+            last_updated TIMESTAMP
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trades (
+            id SERIAL PRIMARY KEY,
+            trade_date TIMESTAMP NOT NULL,
+            asset_name TEXT NOT NULL,
+            asset_type TEXT NOT NULL,
+            trade_type TEXT NOT NULL,
+            quantity DOUBLE PRECISION NOT NULL,
+            price DOUBLE PRECISION NOT NULL,
+            total_amount DOUBLE PRECISION NOT NULL,
+            profit_loss DOUBLE PRECISION DEFAULT 0,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cash_balance (
+            id INTEGER PRIMARY KEY,
+            amount_irr DOUBLE PRECISION DEFAULT 0,
+            amount_usd DOUBLE PRECISION DEFAULT 0,
+            last_updated TIMESTAMP
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS strategies (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            asset_allocation TEXT,
+            risk_level TEXT,
+            created_at TIMESTAMP,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+def _seed_cash_balance(cursor):
+    """
+    Insert the single cash balance row if it doesn't exist.
+    """
+    cursor.execute('SELECT COUNT(*) FROM cash_balance')
+    if cursor.fetchone()[0] == 0:
+        if USE_SQLITE:
+            cursor.execute('INSERT INTO cash_balance (id, amount_irr, amount_usd, last_updated) VALUES (1, 0, 0, ?)',
+                           (datetime.now(),))
+        else:
+            cursor.execute('INSERT INTO cash_balance (id, amount_irr, amount_usd, last_updated) VALUES (1, 0, 0, %s)',
+                           (datetime.now(),))
+
+def _add_trade_details(cursor):
+    """
+    Add the reinvestment link, category, profit-sale flag and currency to trades.
+    """
+    if USE_SQLITE:
+        columns = [
+            ('related_trade_id', 'INTEGER DEFAULT NULL'),
+            ('trade_category', 'TEXT DEFAULT NULL'),
+            ('is_profit_sale', 'BOOLEAN DEFAULT 0'),
+            ('currency', 'TEXT DEFAULT "تومان"'),
+        ]
+    else:
+        columns = [
+            ('related_trade_id', 'INTEGER DEFAULT NULL'),
+            ('trade_category', 'TEXT DEFAULT NULL'),
+            ('is_profit_sale', 'BOOLEAN DEFAULT FALSE'),
+            ('currency', "TEXT DEFAULT 'تومان'"),
+        ]
+
+    # Databases created before migrations existed may already have them
+    for column, definition in columns:
+        if not _column_exists(cursor, 'trades', column):
+            cursor.execute(f'ALTER TABLE trades ADD COLUMN {column} {definition}')
+
+def _add_asset_buy_totals(cursor):
+    """
+    Add the running buy totals used by the asset triggers to assets.
+    """
+    column_type = 'REAL' if USE_SQLITE else 'DOUBLE PRECISION'
+    for column in ['bought_quantity', 'buy_cost']:
+        if not _column_exists(cursor, 'assets', column):
+            cursor.execute(f'ALTER TABLE assets ADD COLUMN {column} {column_type} DEFAULT 0')
+
+def _add_jalali_dates(cursor):
+    """
+    Add the Jalali date, year and month columns to trades and fill them in.
+    """
+    columns = [('jalali_date', 'TEXT'), ('jalali_year', 'INTEGER'), ('jalali_month', 'INTEGER')]
+    for column, definition in columns:
+        if not _column_exists(cursor, 'trades', column):
+            cursor.execute(f'ALTER TABLE trades ADD COLUMN {column} {definition}')
+
+    # Backfill the existing trades, converting all their dates in one pass
+    cursor.execute('SELECT id, trade_date FROM trades WHERE jalali_date IS NULL')
+    rows = cursor.fetchall()
+    if not rows:
+        return
+
+    trade_dates = pd.Series([row[1] for row in rows])
+    jalali_dates = format_jalali_dates(trade_dates)
+    years, months, _ = jalali_components(trade_dates)
+    values = [
+        (jalali_date, int(year), int(month), row[0])
+        for row, jalali_date, year, month in zip(rows, jalali_dates, years, months)
+    ]
+
+    if USE_SQLITE:
+        cursor.executemany('UPDATE trades SET jalali_date = ?, jalali_year = ?, jalali_month = ? WHERE id = ?',
+                           values)
+    else:
+        execute_batch(cursor, 'UPDATE trades SET jalali_date = %s, jalali_year = %s, jalali_month = %s WHERE id = %s',
+                      values, page_size=1000)
+
+def _create_trade_links_view(cursor):
+    """
+    Create the trade_links view resolving each reinvestment buy to the sale
+    that funded it.
+    """
+    cursor.execute('DROP VIEW IF EXISTS trade_links')
+    # The range condition on related_trade_id lets the join start from the
+    # linked buys in idx_trades_related_trade instead of reading every buy
+    cursor.execute('''
+        CREATE VIEW trade_links AS
+        SELECT b.id AS buy_id, b.jalali_date AS buy_jalali_date, b.asset_name AS buy_asset,
+               b.total_amount AS buy_amount,
+               s.id AS sale_id, s.jalali_date AS sale_jalali_date, s.asset_name AS sale_asset,
+               s.total_amount AS sale_amount
+        FROM trades b
+        JOIN trades s ON s.id = b.related_trade_id
+        WHERE b.related_trade_id > 0 AND b.trade_type = 'خرید'
+    ''')
+
+def _create_trade_funding(cursor):
+    """
+    Create the trade_funding table splitting reinvestment buys across the
+    sales that fund them, and move the trade_links view onto it.
+    """
+    if USE_SQLITE:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trade_funding (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            buy_id INTEGER NOT NULL,
+            sale_id INTEGER NOT NULL,
+            amount REAL NOT NULL
+        )
+        ''')
+    else:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trade_funding (
+            id SERIAL PRIMARY KEY,
+            buy_id INTEGER NOT NULL,
+            sale_id INTEGER NOT NULL,
+            amount DOUBLE PRECISION NOT NULL
+        )
+        ''')
+
+    # Backfill from the single related_trade_id link, letting each buy take
+    # at most what its sale had left after the earlier buys
+    cursor.execute('''
+        SELECT buy_id, buy_amount, sale_id, sale_amount
+        FROM trade_links
+        ORDER BY buy_id
+    ''')
+    remaining = {}
+    allocations = []
+    for buy_id, buy_amount, sale_id, sale_amount in cursor.fetchall():
+        available_amount = remaining.get(sale_id, sale_amount)
+        amount = min(buy_amount, available_amount)
+        if amount > 0:
+            allocations.append((buy_id, sale_id, amount))
+            remaining[sale_id] = available_amount - amount
+
+    if allocations:
+        if USE_SQLITE:
+            cursor.executemany('INSERT INTO trade_funding (buy_id, sale_id, amount) VALUES (?, ?, ?)',
+                               allocations)
+        else:
+            execute_batch(cursor, 'INSERT INTO trade_funding (buy_id, sale_id, amount) VALUES (%s, %s, %s)',
+                          allocations, page_size=1000)
+
+    cursor.execute('DROP VIEW IF EXISTS trade_links')
+    cursor.execute('''
+        CREATE VIEW trade_links AS
+        SELECT f.buy_id, b.jalali_date AS buy_jalali_date, b.asset_name AS buy_asset,
+               b.total_amount AS buy_amount,
+               f.sale_id, s.jalali_date AS sale_jalali_date, s.asset_name AS sale_asset,
+               s.total_amount AS sale_amount, f.amount AS funded_amount
+        FROM trade_funding f
+        JOIN trades b ON b.id = f.buy_id
+        JOIN trades s ON s.id = f.sale_id
+    ''')
+
+def _create_rollups(cursor):
+    """
+    Create the pnl_monthly and asset_stats rollup tables and fill them from
+    the journal.
+    """
+    if USE_SQLITE:
+        real = 'REAL'
+    else:
+        real = 'DOUBLE PRECISION'
+
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS pnl_monthly (
+        period TEXT PRIMARY KEY,
+        realized_pl {real} NOT NULL DEFAULT 0,
+        trade_count INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS asset_stats (
+        asset_name TEXT PRIMARY KEY,
+        buys INTEGER NOT NULL DEFAULT 0,
+        sells INTEGER NOT NULL DEFAULT 0,
+        qty_bought {real} NOT NULL DEFAULT 0,
+        qty_sold {real} NOT NULL DEFAULT 0,
+        sales_total {real} NOT NULL DEFAULT 0,
+        realized_pl {real} NOT NULL DEFAULT 0,
+        first_trade TIMESTAMP,
+        last_trade TIMESTAMP
+    )
+    ''')
+    _rebuild_rollups(cursor)
+
+    # The reports and the portfolio snapshot read the rollups instead
+    cursor.execute('DROP INDEX IF EXISTS idx_trades_jalali_month')
+    cursor.execute('DROP INDEX IF EXISTS idx_trades_type_asset')
+
+    # Buys are linked to the sales funding them through trade_funding now,
+    # so nothing reads trades by related_trade_id any more. The available
+    # sales are found from idx_trades_type_date_id and idx_trade_funding_sale.
+    cursor.execute('DROP INDEX IF EXISTS idx_trades_related_trade')
+
+def _fill_asset_buy_totals(cursor):
+    """
+    Rebuild every position from the journal so the running buy totals are
+    set for all assets, not only those written while the asset triggers
+    were installed, and the average buy price is their ratio.
+    """
+    _rebuild_all_positions(cursor)
+
+# Ordered schema migrations: (version, description, step). Steps must be
+# safe to run against databases that predate the schema_version table.
+MIGRATIONS = [
+    (1, 'create base tables', _create_base_tables),
+    (2, 'seed cash balance', _seed_cash_balance),
+    (3, 'add trade details', _add_trade_details),
+    (4, 'add asset buy totals', _add_asset_buy_totals),
+    (5, 'add jalali dates', _add_jalali_dates),
+    (6, 'create trade links view', _create_trade_links_view),
+    (7, 'create trade funding', _create_trade_funding),
+    (8, 'create rollups', _create_rollups),
+    (9, 'fill asset buy totals', _fill_asset_buy_totals),
+]
+
+def get_schema_version():
+    """
+    Get the version of the latest applied migration.
+
+    Returns:
+        int: Schema version, 0 if no migration has been applied
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+def run_migrations():
+    """
+    Apply the pending migrations in order, each in its own transaction.
+
+    Returns:
+        list: Versions of the migrations that were applied, or None if a
+            migration failed
+    """
+    applied = []
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP
+            )
+        ''')
+        conn.commit()
+
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        current_version = cursor.fetchone()[0]
+
+        for version, description, step in MIGRATIONS:
+            if version <= current_version:
+                continue
+
+            if USE_SQLITE:
+                # Make the DDL of the step part of the transaction
+                cursor.execute('BEGIN')
+            step(cursor)
+
+            if USE_SQLITE:
+                cursor.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                               (version, description, datetime.now()))
+            else:
+                cursor.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)',
+                               (version, description, datetime.now()))
+            conn.commit()
+            applied.append(version)
+    except Exception as e:
+        conn.rollback()
+        print(f"Error running migrations: {e}")
+        applied = None
+    finally:
+        conn.close()
+
+    if applied:
+        # Cached frames were read with the old columns
+        bump_data_version()
+    return applied
+
+def ensure_schema():
+    """
+    Bring the database up to date once per server process.
+
+    Runs the pending migrations, verifies the indexes and installs the asset
+    triggers when ASSET_TRIGGERS=1. Later calls, such as those made on every
+    Streamlit rerun, return immediately.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with _schema_lock:
+        if _schema_ready:
+            return
+
+        if run_migrations() is None:
+            # Leave the flag unset so the next rerun tries again
+            return
+        ensure_indexes()
+        if USE_ASSET_TRIGGERS and not asset_triggers_enabled():
+            enable_asset_triggers()
+
+        _schema_ready = True
+
+def reset_schema_check():
+    """
+    Make the next ensure_schema() call check the database again.
+
+    Used after a backup restore, which may bring back an older schema.
+    """
+    global _schema_ready
+    with _schema_lock:
+        _schema_ready = False
@@ -1,9 +1,117 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import numpy as np
 from datetime import datetime
-from utils import convert_to_jalali, format_number
-from database import update_asset_current_price, get_connection, USE_SQLITE
+from utils import convert_to_jalali
+from formatting import format_numbers
+from charts import show_chart, create_asset_allocation_chart
+from database import (
+    update_asset_prices_bulk, get_portfolio_snapshot
+)
+
+# Columns of the holdings table
+HOLDINGS_COLUMNS = [
+    'نام دارایی', 'نوع دارایی', 'تعداد', 'قیمت خرید (تومان)', 'قیمت فعلی (تومان)', 
+    'ارزش کل (تومان)', 'سود/زیان (تومان)', 'سود/زیان (%)'
+]
+
+def build_holdings_table(holdings_df):
+    """
+    Build the holdings table: every asset followed by its sales total row.
+    
+    The asset rows and the total rows are built with column operations and
+    interleaved by sorting on (asset position, row kind), so the cost grows
+    linearly with the number of assets.
+    
+    Args:
+        holdings_df (DataFrame): Holdings as returned by get_portfolio_snapshot()
+        
+    Returns:
+        DataFrame: Formatted table with HOLDINGS_COLUMNS, every column as
+            strings so Arrow doesn't have to guess a type for mixed columns
+    """
+    position = np.arange(len(holdings_df))
+    
+    asset_rows = pd.DataFrame({
+        'نام دارایی': holdings_df['asset_name'].to_numpy(),
+        'نوع دارایی': holdings_df['asset_type'].to_numpy(),
+        'تعداد': holdings_df['quantity'].astype(str).to_numpy(),
+        'قیمت خرید (تومان)': format_numbers(holdings_df['avg_buy_price']).to_numpy(),
+        'قیمت فعلی (تومان)': format_numbers(holdings_df['current_price']).to_numpy(),
+        'ارزش کل (تومان)': format_numbers(holdings_df['total_value']).to_numpy(),
+        'سود/زیان (تومان)': format_numbers(holdings_df['profit_loss']).to_numpy(),
+        'سود/زیان (%)': holdings_df['profit_loss_pct'].round(2).astype(str).to_numpy(),
+        'position': position,
+        'is_total': 0,
+    })
+    
+    # Total rows of the assets that have been sold
+    sold = holdings_df['total_sales'].notna().to_numpy()
+    sales = holdings_df[sold]
+    total_rows = pd.DataFrame({
+        'نام دارایی': ("جمع کل فروش: " + sales['asset_name']).to_numpy(),
+        'نوع دارایی': sales['asset_type'].to_numpy(),
+        'تعداد': format_numbers(sales['sold_quantity']).to_numpy(),
+        'قیمت خرید (تومان)': '',
+        'قیمت فعلی (تومان)': '',
+        'ارزش کل (تومان)': format_numbers(sales['total_sales']).to_numpy(),
+        'سود/زیان (تومان)': '',
+        'سود/زیان (%)': '',
+        'position': position[sold],
+        'is_total': 1,
+    })
+    
+    table = pd.concat([asset_rows, total_rows], ignore_index=True)
+    table = table.sort_values(['position', 'is_total'], kind='stable')
+    return table[HOLDINGS_COLUMNS].reset_index(drop=True)
+
+def parse_price_csv(price_file, asset_names):
+    """
+    Read asset prices from an uploaded CSV file.
+    
+    The file needs an asset_name and a price column; other columns are ignored.
+    
+    Args:
+        price_file (file): Uploaded CSV file
+        asset_names (Series): Names of the existing assets
+        
+    Returns:
+        tuple: (dict of prices keyed by asset name, list of rejected asset
+            names or row descriptions)
+    """
+    try:
+        prices_df = pd.read_csv(price_file, dtype={'asset_name': str})
+    except Exception as e:
+        return {}, [f"خطا در خواندن فایل: {e}"]
+    
+    if not {'asset_name', 'price'}.issubset(prices_df.columns):
+        return {}, ["ستون‌های asset_name و price در فایل وجود ندارند"]
+    
+    names = prices_df['asset_name'].fillna('').str.strip()
+    prices = pd.to_numeric(prices_df['price'], errors='coerce')
+    valid = names.isin(set(asset_names)) & prices.notna() & (prices >= 0)
+    
+    rejected = [name or f"ردیف {row + 1}" for row, name in zip(np.flatnonzero(~valid.to_numpy()), names[~valid])]
+    return dict(zip(names[valid], prices[valid])), rejected
+
+def _save_prices(prices):
+    """
+    Store new asset prices and rerun the page.
+    
+    Args:
+        prices (dict): Current price of each asset, keyed by asset name
+    """
+    if not prices:
+        st.info("قیمتی تغییر نکرده است.")
+        return
+    
+    updated = update_asset_prices_bulk(prices)
+    if updated is None:
+        st.error("خطا در بروزرسانی قیمت‌ها. لطفا دوباره تلاش کنید.")
+        return
+    
+    st.success(f"قیمت {updated} دارایی بروزرسانی شد.")
+    st.rerun()
 
 def show_portfolio_page():
     """
@@ -12,198 +120,78 @@ def show_portfolio_page():
     """
     st.header("پورتفولیو")
 
-    # Get asset data and cash balance
-    conn = get_connection()
-    cursor = conn.cursor()
-
+    # Get asset data and cash balance in one query
     try:
-        # Get active assets
-        if USE_SQLITE:
-            assets_df = pd.read_sql('''
-                SELECT asset_name, asset_type, quantity, avg_buy_price, current_price 
-                FROM assets 
-                WHERE quantity > 0
-            ''', conn)
-
-            cursor.execute('SELECT amount_irr FROM cash_balance WHERE id = 1')
-        else:
-            import psycopg2.extras
-            # Create a server-side cursor for PostgreSQL to avoid loading all data into memory
-            assets_df = pd.read_sql('''
-                SELECT asset_name, asset_type, quantity, avg_buy_price, current_price 
-                FROM assets 
-                WHERE quantity > 0
-            ''', conn)
-
-            cursor.execute('SELECT amount_irr FROM cash_balance WHERE id = 1')
-
-        cash_data = cursor.fetchone()
-        cash_balance_irr = cash_data[0] if cash_data else 0
+        snapshot = get_portfolio_snapshot()
+        holdings_df = snapshot['holdings']
+        cash_balance_irr = snapshot['cash_balance']
     except Exception as e:
         st.error(f"خطا در بارگذاری اطلاعات: {e}")
-        assets_df = pd.DataFrame(columns=['asset_name', 'asset_type', 'quantity', 'avg_buy_price', 'current_price'])
+        holdings_df = pd.DataFrame(columns=[
+            'id', 'asset_name', 'asset_type', 'quantity', 'avg_buy_price', 'current_price', 'last_updated',
+            'total_value', 'profit_loss', 'profit_loss_pct', 'sold_quantity', 'total_sales'
+        ])
         cash_balance_irr = 0
-    finally:
-        conn.close()
 
     # Portfolio Visualization Section
     st.subheader("ترکیب دارایی‌ها")
 
-    if not assets_df.empty:
-        # Calculate asset values
-        assets_df['total_value'] = assets_df['quantity'] * assets_df['current_price']
-        assets_df['profit_loss'] = assets_df['quantity'] * (assets_df['current_price'] - assets_df['avg_buy_price'])
-        assets_df['profit_loss_pct'] = ((assets_df['current_price'] - assets_df['avg_buy_price']) / 
-                                       assets_df['avg_buy_price'] * 100)
-
-        # Portfolio allocation chart (without cash)
-        total_portfolio_value = assets_df['total_value'].sum()
-
-        # Use asset_type for grouping in the pie chart
-        portfolio_data = assets_df[['asset_name', 'asset_type', 'total_value']].copy()
-        portfolio_data['percentage'] = portfolio_data['total_value'] / total_portfolio_value * 100
-
-        # Create a more informative pie chart with distinct colors for each asset
-        fig = px.pie(
-            portfolio_data, 
-            values='total_value', 
-            names='asset_name', 
-            color='asset_name',  # Color by asset name for distinct colors
-            title=f'ترکیب دارایی‌ها - ارزش کل: {format_number(total_portfolio_value)} تومان',
-            color_discrete_sequence=px.colors.qualitative.Set3  # Use a colorful palette
-        )
-
-        fig.update_layout(
-            font=dict(family="Nazanin, Vazirmatn, B Nazanin, tahoma, sans-serif", size=14),
-        )
+    active_assets_df = holdings_df[holdings_df['quantity'] > 0]
 
-        st.plotly_chart(fig, use_container_width=True)
+    if not active_assets_df.empty:
+        # Portfolio allocation chart (without cash), one slice per asset
+        show_chart(create_asset_allocation_chart, active_assets_df[['asset_name', 'total_value']])
     else:
         st.info("هیچ دارایی در پورتفولیو ثبت نشده است.")
 
     # Asset List
     st.subheader("لیست دارایی‌ها")
 
-    # Get asset data 
-    conn = get_connection()
-    try:
-        assets_df = pd.read_sql('SELECT * FROM assets ORDER BY asset_type, asset_name', conn)
-    except Exception as e:
-        st.error(f"خطا در بارگذاری اطلاعات دارایی‌ها: {e}")
-        assets_df = pd.DataFrame(columns=['id', 'asset_name', 'asset_type', 'quantity', 'avg_buy_price', 'current_price', 'last_updated'])
-    finally:
-        conn.close()
-
-    if not assets_df.empty:
-        # Add calculated columns for display
-        assets_df['total_value'] = assets_df['quantity'] * assets_df['current_price']
-        assets_df['profit_loss'] = assets_df['quantity'] * (assets_df['current_price'] - assets_df['avg_buy_price'])
-        assets_df['profit_loss_pct'] = ((assets_df['current_price'] - assets_df['avg_buy_price']) / 
-                                       assets_df['avg_buy_price'] * 100).round(2)
-
-        # Add asset_type to display dataframe for better organization
-        display_df = assets_df[['asset_name', 'asset_type', 'quantity', 'avg_buy_price', 'current_price', 
-                             'total_value', 'profit_loss', 'profit_loss_pct']].copy()
-
-        display_df.columns = [
-            'نام دارایی', 'نوع دارایی', 'تعداد', 'قیمت خرید (تومان)', 'قیمت فعلی (تومان)', 
-            'ارزش کل (تومان)', 'سود/زیان (تومان)', 'سود/زیان (%)'
-        ]
-
-        # Apply formatting
-        for col in ['قیمت خرید (تومان)', 'قیمت فعلی (تومان)', 'ارزش کل (تومان)', 'سود/زیان (تومان)']:
-            display_df[col] = display_df[col].apply(format_number)
-
-        # Get all sell trades data
-        conn = get_connection()
-        try:
-            query = '''
-                SELECT asset_name, asset_type, SUM(quantity) as total_quantity, 
-                SUM(total_amount) as total_sales
-                FROM trades 
-                WHERE trade_type = 'فروش'
-                GROUP BY asset_name, asset_type
-                ORDER BY asset_type, asset_name
-            '''
-
-            sell_trades_df = pd.read_sql(query, conn)
-        except Exception as e:
-            st.error(f"خطا در بارگذاری اطلاعات فروش: {e}")
-            sell_trades_df = pd.DataFrame(columns=['asset_name', 'asset_type', 'total_quantity', 'total_sales'])
-        finally:
-            conn.close()
-
-        # Create the final display dataframe
-        final_display_df = pd.DataFrame(columns=display_df.columns)
-
-        # Group assets by asset_name for display
-        asset_names = display_df['نام دارایی'].unique()
-
-        # Add each asset and its sale total (if any)
-        for asset_name in asset_names:
-            # Get asset data
-            asset_data = display_df[display_df['نام دارایی'] == asset_name]
-            asset_type = asset_data['نوع دارایی'].iloc[0]
-
-            # Add asset row to final dataframe
-            final_display_df = pd.concat([final_display_df, asset_data])
-
-            # Check if this asset has sell transactions
-            if not sell_trades_df.empty:
-                sell_data = sell_trades_df[(sell_trades_df['asset_name'] == asset_name) & 
-                                         (sell_trades_df['asset_type'] == asset_type)]
-
-                if not sell_data.empty:
-                    # Create total row with only quantity and total value
-                    sell_row = sell_data.iloc[0]
-                    total_row = pd.DataFrame([{
-                        'نام دارایی': f"جمع کل فروش: {asset_name}",
-                        'نوع دارایی': asset_type,
-                        'تعداد': str(format_number(sell_row['total_quantity'])),
-                        'قیمت خرید (تومان)': '',
-                        'قیمت فعلی (تومان)': '',
-                        'ارزش کل (تومان)': format_number(sell_row['total_sales']),
-                        'سود/زیان (تومان)': '',
-                        'سود/زیان (%)': ''
-                    }])
-
-                    # Make sure 'تعداد' column is properly converted to string before concatenation to avoid type conversion issues
-                    if 'تعداد' in total_row.columns:
-                        total_row['تعداد'] = total_row['تعداد'].astype(str)
-
-                    # Add total sales row to final dataframe
-                    final_display_df = pd.concat([final_display_df, total_row], sort=False)
-
-                    # Ensure all numeric columns that might be displayed as string are properly handled
-                    if 'تعداد' in final_display_df.columns:
-                        final_display_df['تعداد'] = final_display_df['تعداد'].astype(str)
+    if not holdings_df.empty:
+        # Each asset followed by its sale total (if any)
+        final_display_df = build_holdings_table(holdings_df)
 
         # Display the consolidated dataframe
-        st.dataframe(final_display_df.reset_index(drop=True), use_container_width=True)
+        st.dataframe(final_display_df, use_container_width=True)
 
         # Update current price controls
         st.subheader("بروزرسانی قیمت دارایی‌ها")
 
-        # Group assets by type for update controls
-        asset_types = assets_df['asset_type'].unique()
-
-        for asset_type in asset_types:
-            with st.expander(f"بروزرسانی قیمت های {asset_type}", expanded=False):
-                type_assets = assets_df[assets_df['asset_type'] == asset_type].copy()
-
-                for idx, asset in type_assets.iterrows():
-                    col1, col2, col3 = st.columns([2, 1, 1])
-                    with col1:
-                        new_price = st.number_input(
-                            f"قیمت جدید برای {asset['asset_name']} (تومان)",
-                            min_value=0.0,
-                            value=float(asset['current_price']),
-                            key=f"price_{asset['id']}"
-                        )
-                    with col2:
-                        if st.button("بروزرسانی قیمت", key=f"update_{asset['id']}"):
-                            update_asset_current_price(asset['asset_name'], new_price)
-                            st.success(f"قیمت {asset['asset_name']} بروزرسانی شد.")
-                            st.rerun()
+        # All prices in one editable grid, saved in one transaction
+        with st.form("price_editor_form"):
+            prices_df = holdings_df[['asset_name', 'asset_type', 'current_price']].rename(columns={
+                'asset_name': 'نام دارایی', 'asset_type': 'نوع دارایی', 'current_price': 'قیمت فعلی (تومان)'
+            })
+            edited_prices_df = st.data_editor(
+                prices_df,
+                column_config={
+                    'قیمت فعلی (تومان)': st.column_config.NumberColumn(min_value=0.0, format="localized"),
+                },
+                disabled=['نام دارایی', 'نوع دارایی'],
+                hide_index=True,
+                use_container_width=True,
+                key="price_editor"
+            )
+            save_prices = st.form_submit_button("ذخیره قیمت‌ها")
+
+        if save_prices:
+            # Only the rows whose price was changed
+            new_prices = edited_prices_df['قیمت فعلی (تومان)']
+            changed = new_prices.notna() & (new_prices != prices_df['قیمت فعلی (تومان)'])
+            prices = dict(zip(edited_prices_df.loc[changed, 'نام دارایی'], new_prices[changed]))
+            _save_prices(prices)
+
+        # Prices from a CSV file
+        price_file = st.file_uploader(
+            "بارگذاری قیمت‌ها از فایل CSV (ستون‌های asset_name و price)", type="csv", key="price_file"
+        )
+        if price_file is not None:
+            prices, rejected = parse_price_csv(price_file, holdings_df['asset_name'])
+            if rejected:
+                st.warning(f"این ردیف‌ها نادیده گرفته شدند: {'، '.join(rejected)}")
+            if prices:
+                st.write(f"{len(prices)} قیمت در فایل یافت شد.")
+                if st.button("اعمال قیمت‌های فایل", key="apply_price_file"):
+                    _save_prices(prices)
     else:
         st.info("هیچ دارایی در پورتفولیو ثبت نشده است.")
\ No newline at end of file
@@ -0,0 +1,308 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2 import extensions as pg_extensions
+
+import slow_queries
+
+# Show the debug panel on every page; ?debug=1 shows it for one session
+DEBUG_PANEL = os.environ.get('DEBUG_PANEL') == '1'
+
+# Statements run at least this often in one rerun are flagged as N+1 suspects
+REPEATED_STATEMENT_THRESHOLD = int(os.environ.get('PROFILE_REPEAT_THRESHOLD', 10))
+
+# Section of the statements run outside any timed section
+OTHER_SECTION = 'سایر'
+
+# Profile of the script run in progress on each thread. Streamlit runs every
+# rerun in one thread, and the SQLite pool gives that thread one connection.
+_local = threading.local()
+
+
+class RerunProfile:
+    """
+    Statements executed and sections timed during one script run.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.statements = []
+        self.sections = {}
+        self._section = None
+
+    def record(self, sql, duration, rows):
+        """
+        Add an executed statement.
+
+        Args:
+            sql (str): Statement text with whitespace collapsed
+            duration (float): Seconds spent executing it
+            rows (int): Rows affected, or 0 until rows are fetched
+
+        Returns:
+            dict: The record, which fetches add their rows and time to
+        """
+        statement = {'sql': sql, 'duration': duration, 'rows': rows,
+                     'section': self._section or OTHER_SECTION}
+        self.statements.append(statement)
+        return statement
+
+    @contextmanager
+    def section(self, name):
+        """
+        Time a section of the page and tag the statements it runs with it.
+
+        Args:
+            name (str): Section name
+        """
+        previous, self._section = self._section, name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections[name] = self.sections.get(name, 0) + time.perf_counter() - started
+            self._section = previous
+
+    def finish(self):
+        """Stop the clock of the run."""
+        self.elapsed = time.perf_counter() - self.started
+
+    def statement_summary(self):
+        """
+        Group the statements by text.
+
+        Returns:
+            list: Dictionaries with sql, count, duration and rows, slowest first
+        """
+        groups = {}
+        for statement in self.statements:
+            group = groups.setdefault(statement['sql'], {'sql': statement['sql'], 'count': 0,
+                                                         'duration': 0.0, 'rows': 0})
+            group['count'] += 1
+            group['duration'] += statement['duration']
+            group['rows'] += statement['rows']
+        return sorted(groups.values(), key=lambda group: group['duration'], reverse=True)
+
+    def section_summary(self):
+        """
+        Sum the statements of each section.
+
+        Returns:
+            list: Dictionaries with section, seconds, statements, db_seconds and rows
+        """
+        summary = {name: {'section': name, 'seconds': seconds, 'statements': 0, 'db_seconds': 0.0, 'rows': 0}
+                   for name, seconds in self.sections.items()}
+        for statement in self.statements:
+            row = summary.setdefault(statement['section'], {'section': statement['section'], 'seconds': None,
+                                                            'statements': 0, 'db_seconds': 0.0, 'rows': 0})
+            row['statements'] += 1
+            row['db_seconds'] += statement['duration']
+            row['rows'] += statement['rows']
+        return list(summary.values())
+
+    def repeated_statements(self, threshold=REPEATED_STATEMENT_THRESHOLD):
+        """
+        Find statements run often enough to suggest a query per row (N+1).
+
+        Args:
+            threshold (int): Minimum number of executions
+
+        Returns:
+            list: Entries of statement_summary() run at least threshold times
+        """
+        return [group for group in self.statement_summary() if group['count'] >= threshold]
+
+    def to_dict(self):
+        """
+        Get the profile as plain data.
+
+        Returns:
+            dict: Run time, totals, number of statements sent to the
+                slow-query log, sections and grouped statements
+        """
+        return {
+            'elapsed': self.elapsed,
+            'statements': len(self.statements),
+            'db_seconds': sum(statement['duration'] for statement in self.statements),
+            'rows': sum(statement['rows'] for statement in self.statements),
+            'slow_statements': sum(statement.get('slow', False) for statement in self.statements),
+            'sections': self.section_summary(),
+            'statement_summary': self.statement_summary(),
+        }
+
+    def to_json(self):
+        """
+        Export the profile as JSON.
+
+        Returns:
+            str: JSON document of to_dict()
+        """
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """
+        Export the profile in the Prometheus text exposition format.
+
+        Returns:
+            str: Gauges of the run time and of each section's time,
+                statements, database time and rows
+        """
+        lines = [
+            '# HELP portfolio_rerun_seconds Wall time of the script run.',
+            '# TYPE portfolio_rerun_seconds gauge',
+            f'portfolio_rerun_seconds {self.elapsed or 0:.6f}',
+        ]
+        metrics = [
+            ('portfolio_section_seconds', 'seconds', 'Wall time of each section of the run.'),
+            ('portfolio_db_statements', 'statements', 'Statements executed by each section of the run.'),
+            ('portfolio_db_seconds', 'db_seconds', 'Database time of each section of the run.'),
+            ('portfolio_db_rows', 'rows', 'Rows read or written by each section of the run.'),
+        ]
+        sections = self.section_summary()
+        for name, field, help_text in metrics:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for row in sections:
+                if row[field] is not None:
+                    label = row['section'].replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                    lines.append(f'{name}{{section="{label}"}} {row[field]}')
+        return '\n'.join(lines) + '\n'
+
+
+def start_profile():
+    """
+    Start profiling the script run of the current thread.
+
+    Returns:
+        RerunProfile: The new profile
+    """
+    _local.profile = RerunProfile()
+    return _local.profile
+
+def finish_profile():
+    """
+    Stop profiling the current thread.
+
+    Returns:
+        RerunProfile: The finished profile, or None if none was started
+    """
+    profile = getattr(_local, 'profile', None)
+    _local.profile = None
+    if profile is not None:
+        profile.finish()
+    return profile
+
+def current_profile():
+    """
+    Get the profile of the current thread.
+
+    Returns:
+        RerunProfile: The profile in progress, or None
+    """
+    return getattr(_local, 'profile', None)
+
+
+class _ProfiledCursorMixin:
+    """
+    Records the statements of a DB-API cursor in the profile of its thread,
+    and hands those slower than slow_queries.SLOW_QUERY_SECONDS to the
+    slow-query log.
+    """
+    _statement = None
+    _sql = None
+    _params = None
+    _many = False
+    _duration = 0.0
+    _rows = 0
+    _count_fetched = False
+    _slow_logged = True
+
+    def _run(self, method, sql, params, many=False):
+        started = time.perf_counter()
+        method(sql, params)
+        duration = time.perf_counter() - started
+
+        # SQLite reports -1 for queries, so their rows are counted as fetched
+        self._count_fetched = self.rowcount < 0
+        self._sql, self._many = sql, many
+        # An iterator given to executemany() is used up and cannot be logged
+        self._params = params if not many or isinstance(params, (list, tuple)) else None
+        self._duration, self._rows = duration, max(self.rowcount, 0)
+        self._slow_logged = False
+
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            self._statement = None
+        else:
+            text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+            self._statement = profile.record(' '.join(text.split()), duration, self._rows)
+        self._check_slow()
+        return self
+
+    def _fetch(self, method, *args):
+        if self._sql is None:
+            return method(*args)
+
+        started = time.perf_counter()
+        rows = method(*args)
+        duration = time.perf_counter() - started
+        fetched = 0
+        if self._count_fetched:
+            fetched = len(rows) if isinstance(rows, list) else int(rows is not None)
+
+        self._duration += duration
+        self._rows += fetched
+        if self._statement is not None:
+            self._statement['duration'] += duration
+            self._statement['rows'] += fetched
+        self._check_slow()
+        return rows
+
+    def _check_slow(self):
+        # A query can cross the threshold while its rows are fetched; it is
+        # logged once, when it does
+        threshold = slow_queries.SLOW_QUERY_SECONDS
+        if self._slow_logged or threshold < 0 or self._duration < threshold:
+            return
+        self._slow_logged = True
+        profile = getattr(_local, 'profile', None)
+        section = profile._section if profile is not None else None
+        slow_queries.log_slow_query(self.connection, self._sql, self._params, self._duration,
+                                    self._rows, section, self._many)
+        if self._statement is not None:
+            self._statement['slow'] = True
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+
+class ProfiledSQLiteCursor(_ProfiledCursorMixin, sqlite3.Cursor):
+    """
+    SQLite cursor that records its statements in the thread's profile.
+    """
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters, many=True)
+
+
+class ProfiledPGCursor(_ProfiledCursorMixin, pg_extensions.cursor):
+    """
+    PostgreSQL cursor that records its statements in the thread's profile.
+    """
+    def execute(self, query, vars=None):
+        return self._run(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._run(super().executemany, query, vars_list, many=True)
@@ -0,0 +1,143 @@
+import copy
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Maximum number of cached read results kept in memory
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 128))
+
+
+class QueryCache:
+    """
+    Process-wide LRU cache for read query results.
+
+    Entries are keyed by the data version current when the read started.
+    Bumping the version after a write drops every entry, and a read that was
+    still running during the write is stored under the old version where no
+    later lookup can find it.
+    """
+    def __init__(self, max_entries=QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._data_version = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @property
+    def data_version(self):
+        return self._data_version
+
+    def bump(self):
+        """Mark all cached results as stale after a write."""
+        with self._lock:
+            self._data_version += 1
+            self._entries.clear()
+            self._stats['invalidations'] += 1
+
+    def get(self, key):
+        """
+        Look up a result.
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return True, self._entries[key]
+            self._stats['misses'] += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            dict: Hit, miss, eviction and invalidation counters, hit ratio,
+                current size and data version
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'max_entries': self.max_entries,
+            'hit_ratio': stats['hits'] / lookups if lookups else 0.0,
+            'data_version': self._data_version,
+        })
+        return stats
+
+
+_cache = QueryCache()
+
+def _copy_result(value):
+    # Callers add columns to the frames they get back, so never hand out
+    # the cached object itself
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    return copy.deepcopy(value)
+
+def cached_query(func):
+    """
+    Cache the result of a read function until the next data version bump.
+
+    The cache key is the function name, its arguments and the current data
+    version. Results are copied on the way in and out.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())), _cache.data_version)
+        hit, value = _cache.get(key)
+        if hit:
+            return _copy_result(value)
+
+        value = func(*args, **kwargs)
+        _cache.put(key, _copy_result(value))
+        return value
+
+    return wrapper
+
+def bump_data_version():
+    """
+    Invalidate cached reads. Must be called after every committed write.
+    """
+    _cache.bump()
+
+def get_data_version():
+    """
+    Get the current data version.
+
+    Returns:
+        int: Counter increased by every committed write in this process
+    """
+    return _cache.data_version
+
+def clear_query_cache():
+    """Drop every cached result."""
+    _cache.clear()
+
+def get_query_cache_stats():
+    """
+    Get query cache statistics for monitoring.
+
+    Returns:
+        dict: Hit, miss, eviction and invalidation counters, hit ratio,
+            current size and data version
+    """
+    return _cache.stats()
@@ -0,0 +1,168 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from psycopg2 import extensions as pg_extensions
+
+# Statements taking longer than this are logged with their plan; a negative
+# value turns the log off
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_MS', 200)) / 1000
+
+# Log file, rotated after SLOW_QUERY_LOG_BYTES with SLOW_QUERY_LOG_BACKUPS old files kept
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log')
+SLOW_QUERY_LOG_BYTES = int(os.environ.get('SLOW_QUERY_LOG_BYTES', 5 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5))
+
+# The plan of a statement is captured at most once in this many seconds.
+# EXPLAIN ANALYZE runs the statement again, so a statement that is slow on
+# every rerun must not be run twice every time.
+PLAN_INTERVAL_SECONDS = float(os.environ.get('SLOW_QUERY_PLAN_INTERVAL', 300))
+
+# Statements EXPLAIN accepts; the plans of anything else are not captured
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Longest parameter list written to the log
+MAX_PARAMS_LENGTH = 1000
+
+logger = logging.getLogger('portfolio.slow_queries')
+logger.propagate = False
+
+_lock = threading.Lock()
+_plan_times = {}
+
+
+def _get_logger():
+    # The file is only opened once there is something to write to it
+    if not logger.handlers:
+        with _lock:
+            if not logger.handlers:
+                handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES,
+                                              backupCount=SLOW_QUERY_LOG_BACKUPS, encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                logger.addHandler(handler)
+                logger.setLevel(logging.WARNING)
+    return logger
+
+
+def _plan_due(sql):
+    now = time.monotonic()
+    with _lock:
+        if now - _plan_times.get(sql, -PLAN_INTERVAL_SECONDS) < PLAN_INTERVAL_SECONDS:
+            return False
+        _plan_times[sql] = now
+        return True
+
+
+def is_explainable(sql):
+    """
+    Check whether the plan of a statement can be captured.
+
+    Args:
+        sql (str): Statement text
+
+    Returns:
+        bool: True for a single SELECT, INSERT, UPDATE or DELETE
+    """
+    # execute_batch() sends several statements at once; EXPLAIN would only
+    # cover the first and really run the others
+    return sql.lstrip().upper().startswith(EXPLAINABLE) and ';' not in sql.strip().rstrip(';')
+
+
+def explain(conn, sql, params):
+    """
+    Capture the plan of a statement on the connection that ran it.
+
+    SQLite gets EXPLAIN QUERY PLAN, which does not run the statement.
+    PostgreSQL gets EXPLAIN ANALYZE inside a savepoint that is rolled back,
+    so the changes of an explained INSERT, UPDATE or DELETE are undone.
+
+    Args:
+        conn: SQLite or PostgreSQL connection
+        sql (str|bytes): Statement as executed
+        params: Parameters of the statement, or None
+
+    Returns:
+        str: The plan, one step per line, or None if it cannot be explained
+    """
+    text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+    if not is_explainable(text):
+        return None
+
+    try:
+        if isinstance(conn, sqlite3.Connection):
+            cursor = conn.cursor(sqlite3.Cursor)
+            try:
+                cursor.execute(f"EXPLAIN QUERY PLAN {text}", params or ())
+                depth = {0: -1}
+                lines = []
+                for node_id, parent, _, detail in cursor.fetchall():
+                    depth[node_id] = depth.get(parent, -1) + 1
+                    lines.append('  ' * depth[node_id] + detail)
+            finally:
+                cursor.close()
+        else:
+            if conn.autocommit or conn.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_INTRANS:
+                # No transaction to hold a savepoint in; only a plain EXPLAIN is safe
+                command = "EXPLAIN"
+                savepoint = False
+            else:
+                command = "EXPLAIN ANALYZE"
+                savepoint = True
+            cursor = conn.cursor(cursor_factory=pg_extensions.cursor)
+            try:
+                if savepoint:
+                    cursor.execute("SAVEPOINT slow_query_plan")
+                try:
+                    cursor.execute(f"{command} {text}", params)
+                    lines = [row[0] for row in cursor.fetchall()]
+                finally:
+                    if savepoint:
+                        cursor.execute("ROLLBACK TO SAVEPOINT slow_query_plan")
+                        cursor.execute("RELEASE SAVEPOINT slow_query_plan")
+            finally:
+                cursor.close()
+        return '\n'.join(lines)
+    except Exception as e:
+        return f"Error explaining statement: {e}"
+
+
+def log_slow_query(conn, sql, params, duration, rows, section=None, many=False):
+    """
+    Write a slow statement, its parameters and its plan to the slow-query log.
+
+    Args:
+        conn: Connection that ran the statement, used to capture the plan
+        sql (str|bytes): Statement as executed
+        params: Parameters of the statement, or None if they were not kept
+        duration (float): Seconds spent executing and fetching
+        rows (int): Rows affected or fetched so far
+        section (str, optional): Page section that ran the statement
+        many (bool): params is the sequence given to executemany()
+    """
+    text = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+    text = ' '.join(text.split())
+    many = many and bool(params)
+
+    lines = [f"slow query: {duration * 1000:.1f} ms, {rows} rows" + (f", section {section}" if section else "")]
+    lines.append(f"  sql: {text}")
+    if many:
+        lines.append(f"  params: {len(params)} rows, first {params[0]!r}"[:MAX_PARAMS_LENGTH])
+    elif params:
+        lines.append(f"  params: {params!r}"[:MAX_PARAMS_LENGTH])
+
+    if is_explainable(text) and not _plan_due(text):
+        lines.append(f"  plan: logged in the last {PLAN_INTERVAL_SECONDS:.0f} seconds")
+    elif is_explainable(text):
+        # For executemany() the first parameter row stands in for the rest
+        plan = explain(conn, sql, params[0] if many else params)
+        if plan:
+            lines.append("  plan:")
+            lines.extend(f"    {line}" for line in plan.splitlines())
+
+    try:
+        _get_logger().warning('\n'.join(lines))
+    except OSError as e:
+        print(f"Error writing slow query log: {e}")
@@ -0,0 +1,36 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from migrations import ensure_schema, reset_schema_check
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the application at a fresh SQLite database with the current schema."""
+    if not database.USE_SQLITE:
+        pytest.skip("the tests run against SQLite")
+
+    monkeypatch.setattr(database, 'SQLITE_PATH', str(tmp_path / 'portfolio.db'))
+    database.close_all_connections()
+    reset_schema_check()
+    ensure_schema()
+    yield
+    database.close_all_connections()
+    reset_schema_check()
+
+
+@pytest.fixture
+def trade():
+    """Record a trade with the defaults of the trade form."""
+    def record(asset_name, trade_type, quantity, price, asset_type='ارز', **kwargs):
+        kwargs.setdefault('trade_date', datetime(2024, 5, 1))
+        kwargs.setdefault('notes', None)
+        return database.record_trade(asset_name=asset_name, asset_type=asset_type, trade_type=trade_type,
+                                     quantity=quantity, price=price, **kwargs)
+    return record
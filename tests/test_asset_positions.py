@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+from database import (
+    check_asset_consistency, connection, delete_trade, disable_asset_triggers, edit_trade,
+    enable_asset_triggers, get_assets, rebuild_all_positions
+)
+
+
+@pytest.fixture(params=['python', 'triggers'])
+def mode(request, db):
+    """Run the test with assets kept by Python and again by the asset triggers."""
+    if request.param == 'triggers':
+        assert enable_asset_triggers()
+        yield request.param
+        disable_asset_triggers()
+    else:
+        yield request.param
+
+
+def _asset(asset_name):
+    assets = get_assets().set_index('asset_name')
+    return assets.loc[asset_name]
+
+
+def test_average_is_buy_cost_over_bought_quantity(mode, trade):
+    trade('دلار', 'خرید', 10, 100)
+    trade('دلار', 'فروش', 5, 150)
+    trade('دلار', 'خرید', 10, 200)
+
+    asset = _asset('دلار')
+    assert asset['quantity'] == pytest.approx(15)
+    assert asset['bought_quantity'] == pytest.approx(20)
+    assert asset['buy_cost'] == pytest.approx(3000)
+    assert asset['avg_buy_price'] == pytest.approx(150)
+    assert check_asset_consistency() == []
+
+
+def test_edit_and_delete_keep_assets_consistent(mode, trade):
+    trade('دلار', 'خرید', 10, 100)
+    sale_id = trade('دلار', 'فروش', 5, 150)
+    buy_id = trade('یورو', 'خرید', 4, 300)
+
+    assert edit_trade(buy_id, trade_date=datetime(2024, 5, 2), asset_name='دلار', asset_type='ارز',
+                      trade_type='خرید', quantity=2, price=400, notes=None)
+    assert delete_trade(sale_id)
+
+    asset = _asset('دلار')
+    assert asset['quantity'] == pytest.approx(12)
+    assert asset['avg_buy_price'] == pytest.approx(1800 / 12)
+    assert _asset('یورو')['quantity'] == pytest.approx(0)
+    assert check_asset_consistency() == []
+
+
+def test_rebuild_restores_positions_and_refreshes_reads(db, trade):
+    trade('دلار', 'خرید', 10, 100)
+    trade('دلار', 'فروش', 5, 150)
+    assert _asset('دلار')['quantity'] == pytest.approx(5)
+
+    with connection() as conn:
+        conn.cursor().execute("UPDATE assets SET quantity = 99, avg_buy_price = 1")
+    # The cached read must not survive the rebuild
+    assert _asset('دلار')['quantity'] == pytest.approx(99)
+
+    result = rebuild_all_positions()
+    assert result['assets'] == 1 and result['sales'] == 1
+    assert result['timings']['commit'] >= 0
+    assert _asset('دلار')['quantity'] == pytest.approx(5)
+    assert _asset('دلار')['avg_buy_price'] == pytest.approx(100)
+    assert check_asset_consistency() == []
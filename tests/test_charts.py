@@ -0,0 +1,19 @@
+import json
+
+import pandas as pd
+
+from charts import _get_spec, clear_chart_cache, create_performance_chart
+
+
+def test_unchanged_charts_come_back_serialized():
+    clear_chart_cache()
+    frame = pd.DataFrame({'asset_name': ['دلار', 'طلا'], 'profit_loss_pct': [12.5, -3.0]})
+
+    spec, build_time = _get_spec(create_performance_chart, frame, {})
+    assert build_time > 0
+    assert json.loads(spec)['layout']['title']['text'] == 'بازدهی دارایی‌ها'
+
+    assert _get_spec(create_performance_chart, frame.copy(), {}) == (spec, 0.0)
+
+    frame.loc[1, 'profit_loss_pct'] = 4.0
+    assert _get_spec(create_performance_chart, frame, {})[1] > 0
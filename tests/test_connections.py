@@ -0,0 +1,88 @@
+import pytest
+
+import database
+from database import connection, delete_trade, get_pool_stats, update_asset_current_price
+
+
+def _trade_count():
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM trades')
+        return cursor.fetchone()[0]
+
+
+def test_connection_rolls_back_and_releases_on_error(db):
+    with pytest.raises(RuntimeError):
+        with connection() as conn:
+            conn.cursor().execute("UPDATE cash_balance SET amount_irr = 123 WHERE id = 1")
+            raise RuntimeError("boom")
+
+    assert get_pool_stats()['in_use'] == 0
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT amount_irr FROM cash_balance WHERE id = 1')
+        assert cursor.fetchone()[0] != 123
+
+
+def test_failed_delete_is_not_committed_by_the_next_write(db, trade, monkeypatch):
+    trade('دلار', 'خرید', 10, 100)
+    sale_id = trade('دلار', 'فروش', 5, 150)
+
+    def fail(cursor, asset_names):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(database, '_prune_rollups', fail)
+
+    assert delete_trade(sale_id) is False
+    assert get_pool_stats()['in_use'] == 0
+
+    update_asset_current_price('دلار', 160)
+    assert _trade_count() == 2
+
+
+def test_reads_release_their_connection(db, trade):
+    trade('دلار', 'خرید', 10, 100)
+    database.get_asset_names('ارز')
+    database.check_asset_consistency()
+    database.check_rollup_consistency()
+    assert get_pool_stats()['in_use'] == 0
+
+
+def _cash():
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT amount_irr FROM cash_balance WHERE id = 1')
+        return cursor.fetchone()[0]
+
+
+def test_nested_block_doesnt_commit_the_outer_one(db):
+    before = _cash()
+    with pytest.raises(RuntimeError):
+        with connection() as conn:
+            conn.cursor().execute("UPDATE cash_balance SET amount_irr = 123 WHERE id = 1")
+            with connection():
+                pass
+            raise RuntimeError("boom")
+
+    assert _cash() == before
+    assert get_pool_stats()['in_use'] == 0
+
+
+def test_nested_block_is_undone_alone_when_it_raises(db):
+    with connection() as conn:
+        conn.cursor().execute("UPDATE cash_balance SET amount_irr = 123 WHERE id = 1")
+        with pytest.raises(RuntimeError):
+            with connection() as inner:
+                inner.cursor().execute("UPDATE cash_balance SET amount_irr = 456 WHERE id = 1")
+                raise RuntimeError("boom")
+
+    assert _cash() == 123
+
+
+def test_nested_block_waits_for_the_outer_transaction(db):
+    with pytest.raises(RuntimeError):
+        with connection():
+            with connection() as inner:
+                inner.cursor().execute("UPDATE cash_balance SET amount_irr = 123 WHERE id = 1")
+            raise RuntimeError("boom")
+
+    assert _cash() != 123
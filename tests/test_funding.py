@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+
+from database import connection, edit_trade, get_available_sale_transactions
+
+
+def _funding():
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT buy_id, sale_id, amount FROM trade_funding ORDER BY buy_id, sale_id')
+        return [(buy_id, sale_id, pytest.approx(amount)) for buy_id, sale_id, amount in cursor.fetchall()]
+
+
+def test_purchase_takes_the_oldest_sales_first(db, trade):
+    trade('دلار', 'خرید', 100, 10, trade_date=datetime(2024, 1, 1))
+    newer = trade('دلار', 'فروش', 20, 20, trade_date=datetime(2024, 3, 1))
+    older = trade('دلار', 'فروش', 20, 20, trade_date=datetime(2024, 2, 1))
+
+    buy = trade('یورو', 'خرید', 10, 50, trade_date=datetime(2024, 4, 1), funding_sale_ids=[newer, older])
+
+    assert _funding() == [(buy, newer, 100), (buy, older, 400)]
+    available = {sale['id']: sale['available_amount'] for sale in get_available_sale_transactions()}
+    assert available == {newer: pytest.approx(300)}
+
+
+def test_shrinking_a_sale_caps_the_funding_it_gives(db, trade):
+    trade('دلار', 'خرید', 100, 10, trade_date=datetime(2024, 1, 1))
+    sale = trade('دلار', 'فروش', 50, 20, trade_date=datetime(2024, 2, 1))
+    first = trade('یورو', 'خرید', 30, 20, trade_date=datetime(2024, 3, 1), funding_sale_ids=[sale])
+    second = trade('یورو', 'خرید', 30, 20, trade_date=datetime(2024, 4, 1), funding_sale_ids=[sale])
+    assert _funding() == [(first, sale, 600), (second, sale, 400)]
+
+    assert edit_trade(sale, trade_date=datetime(2024, 2, 1), asset_name='دلار', asset_type='ارز',
+                      trade_type='فروش', quantity=35, price=20, notes=None)
+    assert _funding() == [(first, sale, 600), (second, sale, 100)]
+
+    assert edit_trade(sale, trade_date=datetime(2024, 2, 1), asset_name='دلار', asset_type='ارز',
+                      trade_type='فروش', quantity=25, price=20, notes=None)
+    assert _funding() == [(first, sale, 500)]
+
+
+def test_editing_a_purchase_splits_it_again(db, trade):
+    trade('دلار', 'خرید', 100, 10, trade_date=datetime(2024, 1, 1))
+    sale = trade('دلار', 'فروش', 50, 20, trade_date=datetime(2024, 2, 1))
+    buy = trade('یورو', 'خرید', 10, 50, trade_date=datetime(2024, 3, 1), funding_sale_ids=[sale])
+
+    assert edit_trade(buy, trade_date=datetime(2024, 3, 1), asset_name='یورو', asset_type='ارز',
+                      trade_type='خرید', quantity=30, price=50, notes=None)
+    assert _funding() == [(buy, sale, 1000)]
+
+
+def test_available_sales_are_newest_first_with_ties_by_id(db, trade):
+    trade('دلار', 'خرید', 100, 10, trade_date=datetime(2024, 1, 1))
+    first = trade('دلار', 'فروش', 10, 20, trade_date=datetime(2024, 2, 1))
+    second = trade('دلار', 'فروش', 10, 20, trade_date=datetime(2024, 2, 1))
+    used = trade('دلار', 'فروش', 10, 20, trade_date=datetime(2024, 3, 1))
+    trade('یورو', 'خرید', 4, 50, trade_date=datetime(2024, 4, 1), funding_sale_ids=[used])
+
+    assert [sale['id'] for sale in get_available_sale_transactions()] == [second, first]
+    assert [sale['id'] for sale in get_available_sale_transactions(limit=1)] == [second]
+    assert [sale['id'] for sale in get_available_sale_transactions(search=str(first))] == [first]
+    assert get_available_sale_transactions(search='یورو') == []
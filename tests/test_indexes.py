@@ -0,0 +1,25 @@
+from database import get_connection
+from indexes import HOT_QUERIES, explain_query
+
+
+def _full_scan(sql, params=()):
+    conn = get_connection()
+    try:
+        return explain_query(conn.cursor(), {'sql': sql, 'params': params})[1]
+    finally:
+        conn.close()
+
+
+def test_hot_queries_use_indexes(db):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        assert [query['name'] for query in HOT_QUERIES if explain_query(cursor, query)[1]] == []
+    finally:
+        conn.close()
+
+
+def test_walking_a_whole_index_is_a_full_scan(db):
+    assert _full_scan('SELECT id FROM trades ORDER BY trade_date DESC, id DESC')
+    assert _full_scan('SELECT id FROM trades WHERE asset_name LIKE ?', ('%طلا%',))
+    assert not _full_scan('SELECT id FROM trades WHERE trade_type = ? ORDER BY trade_date DESC', ('فروش',))
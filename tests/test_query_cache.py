@@ -0,0 +1,26 @@
+import pytest
+
+import database
+from database import get_available_sale_transactions
+
+
+def test_failed_read_is_not_cached(db, trade, monkeypatch):
+    trade('دلار', 'خرید', 10, 100)
+    sale_id = trade('دلار', 'فروش', 5, 150)
+
+    def fail():
+        raise RuntimeError("database unavailable")
+    with monkeypatch.context() as patch:
+        patch.setattr(database, 'get_connection', fail)
+        with pytest.raises(RuntimeError):
+            get_available_sale_transactions()
+
+    assert [sale['id'] for sale in get_available_sale_transactions()] == [sale_id]
+
+
+def test_writes_invalidate_cached_reads(db, trade):
+    trade('دلار', 'خرید', 10, 100)
+    assert get_available_sale_transactions() == []
+
+    sale_id = trade('دلار', 'فروش', 5, 150)
+    assert [sale['id'] for sale in get_available_sale_transactions()] == [sale_id]
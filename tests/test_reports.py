@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+
+from database import (
+    check_rollup_consistency, delete_trade, edit_trade, get_asset_stats, get_monthly_pnl,
+    get_trade_category_counts, recalculate_asset_data
+)
+
+
+def _monthly_pnl():
+    monthly_pnl = get_monthly_pnl()
+    return {period: pytest.approx(pl) for period, pl in zip(monthly_pnl['year_month'], monthly_pnl['profit_loss'])}
+
+
+def test_rollups_follow_record_edit_and_delete(db, trade):
+    assert get_asset_stats().empty
+
+    trade('دلار', 'خرید', 10, 100, trade_date=datetime(2024, 5, 1))
+    first_sale = trade('دلار', 'فروش', 4, 150, trade_date=datetime(2024, 5, 10))
+    second_sale = trade('دلار', 'فروش', 2, 80, trade_date=datetime(2024, 6, 10))
+    # Sales are recorded without profit/loss until the asset is recalculated
+    assert recalculate_asset_data('دلار', 'ارز')
+    assert _monthly_pnl() == {'1403-02': 200, '1403-03': -40}
+    assert check_rollup_consistency() == []
+
+    # Moving the second sale into the month of the first one
+    assert edit_trade(second_sale, trade_date=datetime(2024, 5, 20), asset_name='دلار', asset_type='ارز',
+                      trade_type='فروش', quantity=2, price=130, notes=None)
+    assert _monthly_pnl() == {'1403-02': 260}
+    assert check_rollup_consistency() == []
+
+    assert delete_trade(first_sale)
+    stats = get_asset_stats().set_index('asset_name').loc['دلار']
+    assert (stats['buys'], stats['sells']) == (1, 1)
+    assert stats['qty_sold'] == pytest.approx(2)
+    assert _monthly_pnl() == {'1403-02': 60}
+    assert check_rollup_consistency() == []
+
+
+def test_trade_category_counts(db, trade):
+    trade('دلار', 'خرید', 10, 100, trade_category='بلندمدت')
+    trade('یورو', 'خرید', 10, 100, trade_category='بلندمدت')
+    trade('طلا', 'خرید', 1, 100, trade_category='نوسانی')
+    trade('دلار', 'خرید', 1, 100)
+    trade('دلار', 'فروش', 5, 120, trade_category='نوسانی')
+
+    buys = get_trade_category_counts('خرید')
+    assert list(zip(buys['trade_category'], buys['count'])) == [('بلندمدت', 2), ('نوسانی', 1)]
+    sells = get_trade_category_counts('فروش')
+    assert list(zip(sells['trade_category'], sells['count'])) == [('نوسانی', 1)]
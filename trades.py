@@ -1,14 +1,42 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timedelta
 import jdatetime
 import sqlite3
 
 from database import (
-    update_asset_after_trade, update_cash_balance, get_connection, 
-    USE_SQLITE, get_available_sale_transactions, recalculate_asset_data, delete_trade
+    get_available_sale_transactions, delete_trade, edit_trade, record_trade, InsufficientQuantityError,
+    get_asset_names, get_trades_page, get_trade_asset_types, get_trade, get_trade_labels, search_trades,
+    TRADES_PAGE_SIZE, TRADE_SEARCH_LIMIT
 )
-from utils import convert_to_jalali, convert_to_gregorian, format_number
+from utils import convert_to_gregorian, format_number
+from formatting import format_amounts, format_flags, number_column, DEFAULT_CURRENCY
+
+# Maximum number of sales offered as funding sources in the trade form
+SALE_OPTIONS_LIMIT = 50
+
+# Page sizes offered for the trade history
+PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
+
+def _parse_jalali_date(date_str):
+    """
+    Parse an optional Jalali date entered as year-month-day.
+    
+    Args:
+        date_str (str): Date text, may be empty
+        
+    Returns:
+        datetime.datetime: Gregorian date, or None if the text is empty or invalid
+    """
+    if not date_str or not date_str.strip():
+        return None
+    try:
+        year, month, day = (int(part) for part in date_str.strip().split('-'))
+        return jdatetime.datetime(year, month, day).togregorian()
+    except ValueError:
+        st.error(f"تاریخ {date_str} معتبر نیست. لطفاً با فرمت سال-ماه-روز وارد کنید.")
+        return None
 
 def show_trades_page():
     """
@@ -32,17 +60,7 @@ def show_trades_page():
             )
 
             # Get existing assets for the selected type
-            conn = get_connection()
-            cursor = conn.cursor()
-
-            # Check if using PostgreSQL or SQLite
-            if USE_SQLITE:
-                cursor.execute('SELECT DISTINCT asset_name FROM assets WHERE asset_type = ?', (asset_type,))
-            else:
-                cursor.execute('SELECT DISTINCT asset_name FROM assets WHERE asset_type = %s', (asset_type,))
-
-            existing_assets = [row[0] for row in cursor.fetchall()]
-            conn.close()
+            existing_assets = get_asset_names(asset_type)
 
             # Always allow entering custom asset name
             if existing_assets:
@@ -64,8 +82,12 @@ def show_trades_page():
             # Convert to string for display in date_input
             today_str = f"{today_jalali.year}-{today_jalali.month:02d}-{today_jalali.day:02d}"
 
-            # Single line date picker
-            jalali_date_str = st.text_input("تاریخ معامله (سال-ماه-روز)", value=today_str, 
+            # Single line date picker. Today is put in session_state instead
+            # of value= so a date restored by keep_widget_state() isn't also
+            # given a default
+            if "jalali_date" not in st.session_state:
+                st.session_state.jalali_date = today_str
+            jalali_date_str = st.text_input("تاریخ معامله (سال-ماه-روز)",
                                           placeholder="مثال: 1402-01-15", key="jalali_date")
 
             try:
@@ -97,12 +119,21 @@ def show_trades_page():
             st.write(f"مبلغ کل: {format_number(total_amount)} {currency}")
 
             # Trade category and related sale for buys
-            related_trade_id = None
+            funding_sale_ids = None
             trade_category = None
 
             if trade_type == "خرید":
-                # Get available sales with remaining funds
-                available_sales = get_available_sale_transactions()
+                # Search box keeps the list of selectable sales short
+                sale_search = st.text_input("جستجوی فروش‌ها (شناسه یا نام دارایی)", key="sale_search")
+
+                # Get the most recent available sales with remaining funds
+                try:
+                    available_sales = get_available_sale_transactions(
+                        limit=SALE_OPTIONS_LIMIT, search=sale_search or None
+                    )
+                except Exception as e:
+                    st.warning(f"خطا در دریافت فروش‌های قبلی: {e}")
+                    available_sales = []
 
                 if available_sales:
                     st.write("### استفاده از منابع حاصل از فروش‌های قبلی")
@@ -111,8 +142,7 @@ def show_trades_page():
                         # Create a list of choices for the multiselect
                     sale_options = []
                     for sale in available_sales:
-                        sale_date = convert_to_jalali(pd.to_datetime(sale['trade_date'])).strftime('%Y/%m/%d')
-                        sale_description = f"شناسه {sale['id']}: {sale['asset_name']} - {format_number(sale['available_amount'])} تومان ({sale_date})"
+                        sale_description = f"شناسه {sale['id']}: {sale['asset_name']} - {format_number(sale['available_amount'])} تومان ({sale['jalali_date']})"
                         sale_options.append((sale['id'], sale_description))
 
                         # Show multiselect for sale IDs with clear labeling
@@ -122,24 +152,23 @@ def show_trades_page():
                         format_func=lambda x: next((s[1] for s in sale_options if s[0] == x), str(x))
                     )
 
-                    # Use the first selected ID as primary related_trade_id
-                    related_trade_id = selected_sales[0] if selected_sales else None
-
                     # Show all selected IDs clearly
                     if len(selected_sales) > 1:
                         st.info(f"شناسه‌های انتخاب شده برای تأمین وجه: {', '.join(map(str, selected_sales))}")
 
-                    if related_trade_id:
-                        # Get the selected sale details
-                        selected_sale_details = next((s for s in available_sales if s['id'] == related_trade_id), None)
+                    if selected_sales:
+                        # The purchase is split across the selected sales, oldest first
+                        funding_sale_ids = selected_sales
+                        selected_available = sum(
+                            s['available_amount'] for s in available_sales if s['id'] in selected_sales
+                        )
 
-                        if selected_sale_details:
-                            # Check if the current purchase amount exceeds the available amount
-                            if total_amount > selected_sale_details['available_amount']:
-                                st.warning(f"مبلغ خرید ({format_number(total_amount)} تومان) بیشتر از مبلغ قابل استفاده از فروش انتخاب شده ({format_number(selected_sale_details['available_amount'])} تومان) است. مابقی از موجودی نقدی کسر خواهد شد.")
+                        # Check if the current purchase amount exceeds the available amount
+                        if total_amount > selected_available:
+                            st.warning(f"مبلغ خرید ({format_number(total_amount)} تومان) بیشتر از مبلغ قابل استفاده از فروش‌های انتخاب شده ({format_number(selected_available)} تومان) است. مابقی از موجودی نقدی کسر خواهد شد.")
 
-                            # Set the trade category
-                            trade_category = "سرمایه‌گذاری مجدد"
+                        # Set the trade category
+                        trade_category = "سرمایه‌گذاری مجدد"
 
                 # Allow manual category entry for buys
                 categories = [
@@ -186,9 +215,6 @@ def show_trades_page():
             # Notes
             notes = st.text_area("توضیحات", key="notes")
 
-            # Initialize profit_loss (will be calculated in backend)
-            profit_loss = 0
-
             # Submit button
             submitted = st.form_submit_button("ثبت معامله")
 
@@ -200,85 +226,17 @@ def show_trades_page():
                 elif price <= 0:
                     st.error("قیمت باید بزرگتر از صفر باشد.")
                 else:
-                    # Insert the trade into database
-                    conn = get_connection()
-                    cursor = conn.cursor()
-
-                    # Check if we have enough assets to sell
-                    if trade_type == "فروش":
-                        if USE_SQLITE:
-                            cursor.execute('SELECT quantity FROM assets WHERE asset_name = ?', (asset_name,))
-                        else:
-                            cursor.execute('SELECT quantity FROM assets WHERE asset_name = %s', (asset_name,))
-
-                        result = cursor.fetchone()
-
-                        if not result or result[0] < quantity:
-                            st.error(f"تعداد کافی از دارایی {asset_name} برای فروش وجود ندارد.")
-                            conn.close()
-                        else:
-                            # Set profit_loss to 0 for sell trades as per requirement
-                            profit_loss = 0
-
-                            # Insert trade record
-                            if USE_SQLITE:
-                                cursor.execute('''
-                                    INSERT INTO trades (trade_date, asset_name, asset_type, trade_type, 
-                                                      quantity, price, total_amount, profit_loss, 
-                                                      related_trade_id, trade_category, is_profit_sale, currency, notes)
-                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                ''', (trade_date, asset_name, asset_type, trade_type, quantity, 
-                                     price, total_amount, profit_loss, related_trade_id, trade_category, 
-                                     is_profit_sale, currency, notes))
-                            else:
-                                cursor.execute('''
-                                    INSERT INTO trades (trade_date, asset_name, asset_type, trade_type, 
-                                                      quantity, price, total_amount, profit_loss, 
-                                                      related_trade_id, trade_category, is_profit_sale, currency, notes)
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                ''', (trade_date, asset_name, asset_type, trade_type, quantity, 
-                                     price, total_amount, profit_loss, related_trade_id, trade_category, 
-                                     is_profit_sale, currency, notes))
-
-                            # Close database connection before other operations
-                            conn.commit()
-                            conn.close()
-
-                            # Update asset data
-                            if update_asset_after_trade(asset_name, asset_type, quantity, price, trade_type):
-                                # Update cash balance
-                                update_cash_balance(total_amount, trade_type == "فروش")
-                                st.success(f"معامله با موفقیت ثبت شد. مبلغ کل: {format_number(total_amount)} تومان")
-                                st.rerun()
-                            else:
-                                st.error("خطا در ثبت معامله. لطفا دوباره تلاش کنید.")
-                    else:  # Buy trade
-                        # Insert trade record
-                        if USE_SQLITE:
-                            cursor.execute('''
-                                INSERT INTO trades (trade_date, asset_name, asset_type, trade_type, 
-                                                  quantity, price, total_amount, profit_loss,
-                                                  related_trade_id, trade_category, is_profit_sale, currency, notes)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (trade_date, asset_name, asset_type, trade_type, quantity, 
-                                 price, total_amount, 0, related_trade_id, trade_category, False, currency, notes))
-                        else:
-                            cursor.execute('''
-                                INSERT INTO trades (trade_date, asset_name, asset_type, trade_type, 
-                                                  quantity, price, total_amount, profit_loss,
-                                                  related_trade_id, trade_category, is_profit_sale, currency, notes)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ''', (trade_date, asset_name, asset_type, trade_type, quantity, 
-                                 price, total_amount, 0, related_trade_id, trade_category, False, currency, notes))
-
-                        # Close database connection before other operations
-                        conn.commit()
-                        conn.close()
-
-                        # Update asset data
-                        if update_asset_after_trade(asset_name, asset_type, quantity, price, trade_type):
-                            # Update cash balance (subtract for buy)
-                            update_cash_balance(total_amount, False)
+                    # Record the trade, its asset update and cash movement in one transaction
+                    try:
+                        trade_id = record_trade(
+                            trade_date, asset_name, asset_type, trade_type, quantity, price, notes,
+                            currency=currency, is_profit_sale=is_profit_sale,
+                            trade_category=trade_category, funding_sale_ids=funding_sale_ids
+                        )
+                    except InsufficientQuantityError:
+                        st.error(f"تعداد کافی از دارایی {asset_name} برای فروش وجود ندارد.")
+                    else:
+                        if trade_id is not None:
                             st.success(f"معامله با موفقیت ثبت شد. مبلغ کل: {format_number(total_amount)} تومان")
                             st.rerun()
                         else:
@@ -290,76 +248,98 @@ def show_trades_page():
         # گزینه‌های فیلتر
         filter_col1, filter_col2 = st.columns(2)
 
-        # Get trades data
-        conn = get_connection()
-        trades_df = pd.read_sql('''
-            SELECT * FROM trades 
-            ORDER BY trade_date DESC, id DESC
-        ''', conn)
-
         # فیلتر بر اساس نوع دارایی
         with filter_col1:
-            asset_types = ["همه"] + list(trades_df["asset_type"].unique()) if not trades_df.empty else ["همه"]
-            selected_asset_type = st.selectbox("فیلتر بر اساس نوع دارایی", asset_types)
+            asset_types = ["همه"] + get_trade_asset_types()
+            selected_asset_type = st.selectbox("فیلتر بر اساس نوع دارایی", asset_types, key="history_asset_type")
 
         # فیلتر بر اساس نوع معامله
         with filter_col2:
             trade_types = ["همه", "خرید", "فروش"]
-            selected_trade_type = st.selectbox("فیلتر بر اساس نوع معامله", trade_types)
+            selected_trade_type = st.selectbox("فیلتر بر اساس نوع معامله", trade_types, key="history_trade_type")
+
+        # فیلتر بازه تاریخ و تعداد ردیف در هر صفحه
+        date_col1, date_col2, size_col = st.columns(3)
+        with date_col1:
+            start_date_str = st.text_input("از تاریخ (سال-ماه-روز)", placeholder="مثال: 1402-01-01", key="history_start_date")
+        with date_col2:
+            end_date_str = st.text_input("تا تاریخ (سال-ماه-روز)", placeholder="مثال: 1402-12-29", key="history_end_date")
+        with size_col:
+            if "history_page_size" not in st.session_state:
+                st.session_state.history_page_size = (TRADES_PAGE_SIZE if TRADES_PAGE_SIZE in PAGE_SIZE_OPTIONS
+                                                      else PAGE_SIZE_OPTIONS[0])
+            page_size = st.selectbox("تعداد در هر صفحه", PAGE_SIZE_OPTIONS, key="history_page_size")
+
+        start_date = _parse_jalali_date(start_date_str)
+        end_date = _parse_jalali_date(end_date_str)
+        if end_date:
+            # The end date is inclusive
+            end_date = end_date + timedelta(days=1)
+
+        filters = {
+            'asset_type': selected_asset_type if selected_asset_type != "همه" else None,
+            'trade_type': selected_trade_type if selected_trade_type != "همه" else None,
+            'start_date': start_date,
+            'end_date': end_date,
+            'page_size': page_size,
+        }
+
+        # Keys of the pages visited so far; start over when the filters change
+        if st.session_state.get('history_filters') != filters:
+            st.session_state.history_filters = filters
+            st.session_state.history_page_keys = [None]
+        page_keys = st.session_state.history_page_keys
+
+        # Get the current page of trades
+        trades_df, next_page_key = get_trades_page(after=page_keys[-1], **filters)
+
+        # صفحه‌بندی
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if st.button("صفحه قبل", disabled=len(page_keys) == 1, key="history_prev_page"):
+                page_keys.pop()
+                st.rerun()
+        with page_col:
+            st.caption(f"صفحه {len(page_keys)}")
+        with next_col:
+            if st.button("صفحه بعد", disabled=next_page_key is None, key="history_next_page"):
+                page_keys.append(next_page_key)
+                st.rerun()
 
-        # اعمال فیلترها
-        filtered_data = trades_df.copy()
         if not trades_df.empty:
-            if selected_asset_type != "همه":
-                filtered_data = filtered_data[filtered_data["asset_type"] == selected_asset_type]
-            if selected_trade_type != "همه":
-                filtered_data = filtered_data[filtered_data["trade_type"] == selected_trade_type]
-
-        trades_df = filtered_data
-        conn.close()
-
-        if not trades_df.empty:
-            # Convert dates for display
-            trades_df['trade_date'] = pd.to_datetime(trades_df['trade_date'])
-            trades_df['jalali_date'] = trades_df['trade_date'].apply(lambda x: convert_to_jalali(x).strftime('%Y/%m/%d'))
-
             # Add related trades information
             trades_df['related_trade_info'] = None
-            for idx, row in trades_df.iterrows():
-                if pd.notna(row['related_trade_id']) and row['trade_type'] == 'خرید':
-                    # Find the related sale
-                    related_sale = trades_df[trades_df['id'] == row['related_trade_id']]
-                    if not related_sale.empty:
-                        related_sale_row = related_sale.iloc[0]
-                        trades_df.at[idx, 'related_trade_info'] = f"خرید از فروش {related_sale_row['asset_name']} در تاریخ {related_sale_row['jalali_date']}"
-
-            # Format currency for display
-            trades_df['formatted_price'] = trades_df.apply(
-                lambda row: f"{format_number(row['price'])} {row['currency'] if pd.notna(row['currency']) else 'تومان'}", 
-                axis=1
-            )
+            has_related = trades_df['related_asset_name'].notna()
+            if has_related.any():
+                trades_df.loc[has_related, 'related_trade_info'] = (
+                    "خرید از فروش " + trades_df.loc[has_related, 'related_asset_name'] +
+                    " در تاریخ " + trades_df.loc[has_related, 'related_jalali_date']
+                )
 
-            trades_df['formatted_total'] = trades_df.apply(
-                lambda row: f"{format_number(row['total_amount'])} {row['currency'] if pd.notna(row['currency']) else 'تومان'}", 
-                axis=1
-            )
+            # Amounts stay numeric and are formatted by the browser, or are
+            # formatted here as text with their currency
+            numeric_display = st.toggle("نمایش مبالغ به صورت عددی", key="history_numeric_display",
+                                        help="مبالغ قابل مرتب‌سازی هستند و صفحه سریع‌تر بارگذاری می‌شود")
+            is_sell = trades_df['trade_type'] == 'فروش'
 
-            # Format profit/loss for display (نمایش علامت - برای معاملات فروش)
-            trades_df['formatted_profit_loss'] = trades_df.apply(
-                lambda row: "-" if row['trade_type'] == 'فروش' else f"{format_number(row['profit_loss'])} تومان", 
-                axis=1
-            )
+            if numeric_display:
+                trades_df['formatted_price'] = trades_df['price']
+                trades_df['formatted_total'] = trades_df['total_amount']
+                trades_df['formatted_profit_loss'] = trades_df['profit_loss'].where(~is_sell)
+            else:
+                trades_df['formatted_price'] = format_amounts(trades_df['price'], trades_df['currency'])
+                trades_df['formatted_total'] = format_amounts(trades_df['total_amount'], trades_df['currency'])
+                # Format profit/loss for display (نمایش علامت - برای معاملات فروش)
+                trades_df['formatted_profit_loss'] = np.where(is_sell, "-", format_amounts(trades_df['profit_loss']))
 
             # Convert boolean to text for is_profit_sale
-            trades_df['profit_sale_text'] = trades_df.apply(
-                lambda row: "بله" if pd.notna(row['is_profit_sale']) and row['is_profit_sale'] else "خیر" if row['trade_type'] == 'فروش' else "", 
-                axis=1
-            )
+            trades_df['profit_sale_text'] = format_flags(trades_df['is_profit_sale'], applies=is_sell)
+            trades_df['currency'] = trades_df['currency'].fillna(DEFAULT_CURRENCY)
 
             # Create a display dataframe with selected columns for showing in the UI
             display_columns = [
                 'id', 'jalali_date', 'asset_name', 'trade_type', 
-                'quantity', 'formatted_price', 'formatted_total', 
+                'quantity', 'formatted_price', 'formatted_total', 'currency',
                 'formatted_profit_loss', 'trade_category', 'profit_sale_text', 
                 'related_trade_info', 'notes'
             ]
@@ -369,7 +349,7 @@ def show_trades_page():
             # Rename columns for display
             display_df.columns = [
                 'شناسه', 'تاریخ', 'نام دارایی', 'نوع معامله',
-                'تعداد', 'قیمت واحد', 'مبلغ کل',
+                'تعداد', 'قیمت واحد', 'مبلغ کل', 'واحد ارزی',
                 'سود/زیان', 'دسته‌بندی', 'فروش از محل سود',
                 'مرتبط با معامله', 'توضیحات'
             ]
@@ -377,7 +357,7 @@ def show_trades_page():
             # افزودن قابلیت انتخاب ستون‌های مورد نظر برای نمایش
             available_columns = [
                 'شناسه', 'تاریخ', 'نام دارایی', 'نوع معامله',
-                'تعداد', 'قیمت واحد', 'مبلغ کل',
+                'تعداد', 'قیمت واحد', 'مبلغ کل', 'واحد ارزی',
                 'سود/زیان', 'دسته‌بندی', 'فروش از محل سود',
                 'مرتبط با معامله', 'توضیحات'
             ]
@@ -433,195 +413,150 @@ def show_trades_page():
                 # نمایش اطلاعات تعداد ستون‌های انتخاب شده
                 if len(st.session_state.selected_columns) < len(available_columns):
                     st.caption(f"🔍 نمایش {len(st.session_state.selected_columns)} ستون از {len(available_columns)} ستون")
-                st.dataframe(filtered_df, use_container_width=True)
+                column_config = {
+                    'قیمت واحد': number_column('قیمت واحد'),
+                    'مبلغ کل': number_column('مبلغ کل'),
+                    'سود/زیان': number_column('سود/زیان (تومان)'),
+                } if numeric_display else None
+                st.dataframe(filtered_df, use_container_width=True, column_config=column_config)
             else:
                 st.info("لطفاً حداقل یک ستون را برای نمایش انتخاب کنید.")
 
-            # Allow editing or deleting trades
-            st.subheader("ویرایش یا حذف معاملات")
-
-            # ایجاد لیست شناسه‌های معاملات برای انتخاب
-            trade_options = []
-            for idx, row in trades_df.iterrows():
-                description = f"شناسه {row['id']}: {row['jalali_date']} - {row['trade_type']} {row['asset_name']}"
-                trade_options.append((row['id'], description))
-
-            if trade_options:
-                # ایجاد یک selectbox برای انتخاب شناسه معامله
-                selected_trade_id = st.selectbox(
-                    "انتخاب شناسه معامله برای ویرایش یا حذف",
-                    options=[x[0] for x in trade_options],
-                    format_func=lambda x: next((f"شناسه {x}: {row['jalali_date']} - {row['asset_name']}" for id, row in trades_df.iterrows() if row['id'] == x), f"شناسه {x}")
-                )
+        elif any(filters[name] for name in ('asset_type', 'trade_type', 'start_date', 'end_date')):
+            st.info("معامله‌ای با این فیلترها یافت نشد.")
+        else:
+            st.info("هنوز معامله‌ای ثبت نشده است.")
+
+        # Allow editing or deleting trades
+        st.subheader("ویرایش یا حذف معاملات")
+
+        # جستجوی معامله؛ فقط نزدیک‌ترین نتایج در فهرست انتخاب نمایش داده می‌شوند
+        trade_search = st.text_input("جستجوی معامله (شناسه، نام دارایی یا تاریخ)",
+                                     placeholder="مثال: 125 یا طلا یا 1402-05", key="trade_search")
+        trade_ids = search_trades(trade_search or None, limit=TRADE_SEARCH_LIMIT)
+        trade_labels = get_trade_labels()
+
+        if not trade_ids:
+            st.info("معامله‌ای با این مشخصات یافت نشد.")
+
+        if trade_ids:
+            # ایجاد یک selectbox برای انتخاب شناسه معامله
+            selected_trade_id = st.selectbox(
+                "انتخاب شناسه معامله برای ویرایش یا حذف",
+                options=trade_ids,
+                format_func=lambda x: trade_labels.get(x, f"شناسه {x}")
+            )
 
-                # Get the selected trade details
-                selected_trade = trades_df[trades_df['id'] == selected_trade_id].iloc[0].to_dict()
+            # Get the selected trade details
+            selected_trade = get_trade(selected_trade_id)
 
-                # Create tabs for edit and delete operations
-                edit_tab, delete_tab = st.tabs(["ویرایش معامله", "حذف معامله"])
+            # Create tabs for edit and delete operations
+            edit_tab, delete_tab = st.tabs(["ویرایش معامله", "حذف معامله"])
 
-                with edit_tab:
-                    st.write(f"ویرایش معامله {selected_trade['asset_name']} در تاریخ {selected_trade['jalali_date']}")
+            with edit_tab:
+                st.write(f"ویرایش معامله {selected_trade['asset_name']} در تاریخ {selected_trade['jalali_date']}")
 
-                    # Create a form for editing
-                    with st.form("edit_trade_form"):
-                        # Date picker for editing
-                        edit_jalali_date_str = st.text_input(
-                            "تاریخ معامله (سال-ماه-روز)", 
-                            value=convert_to_jalali(selected_trade['trade_date']).strftime('%Y-%m-%d'),
-                            key="edit_jalali_date"
-                        )
+                # Create a form for editing
+                with st.form("edit_trade_form"):
+                    # Date picker for editing
+                    edit_jalali_date_str = st.text_input(
+                        "تاریخ معامله (سال-ماه-روز)", 
+                        value=selected_trade['jalali_date'].replace('/', '-'),
+                        key="edit_jalali_date"
+                    )
 
-                        try:
-                            # Parse date from text input
-                            date_parts = edit_jalali_date_str.split('-')
-                            if len(date_parts) == 3:
-                                edit_year = int(date_parts[0])
-                                edit_month = int(date_parts[1])
-                                edit_day = int(date_parts[2])
-
-                                edit_jalali_date = jdatetime.datetime(edit_year, edit_month, edit_day)
-                                edit_trade_date = edit_jalali_date.togregorian()
-                            else:
-                                raise ValueError("فرمت تاریخ صحیح نیست")
-                        except ValueError:
-                            st.error("تاریخ وارد شده معتبر نیست. لطفاً با فرمت سال-ماه-روز وارد کنید.")
-                            edit_trade_date = selected_trade['trade_date']
-
-                        # Asset information (non-editable)
-                        st.text(f"نام دارایی: {selected_trade['asset_name']}")
-                        st.text(f"نوع دارایی: {selected_trade['asset_type']}")
-                        st.text(f"نوع معامله: {selected_trade['trade_type']}")
-
-                        # Editable fields
-                        edit_quantity = st.number_input(
-                            "تعداد/مقدار", 
-                            min_value=0.0, 
-                            value=float(selected_trade['quantity']),
-                            key="edit_quantity"
-                        )
+                    try:
+                        # Parse date from text input
+                        date_parts = edit_jalali_date_str.split('-')
+                        if len(date_parts) == 3:
+                            edit_year = int(date_parts[0])
+                            edit_month = int(date_parts[1])
+                            edit_day = int(date_parts[2])
 
-                        # واحد ارزی بالای قیمت واحد
-                        current_currency = selected_trade['currency'] if pd.notna(selected_trade['currency']) else "تومان"
-                        edit_currency = st.selectbox(
-                            "واحد ارزی",
-                            options=["تومان", "دلار"],
-                            index=0 if current_currency == "تومان" else 1,
-                            key="edit_currency"
-                        )
+                            edit_jalali_date = jdatetime.datetime(edit_year, edit_month, edit_day)
+                            edit_trade_date = edit_jalali_date.togregorian()
+                        else:
+                            raise ValueError("فرمت تاریخ صحیح نیست")
+                    except ValueError:
+                        st.error("تاریخ وارد شده معتبر نیست. لطفاً با فرمت سال-ماه-روز وارد کنید.")
+                        edit_trade_date = selected_trade['trade_date']
+
+                    # Asset information (non-editable)
+                    st.text(f"نام دارایی: {selected_trade['asset_name']}")
+                    st.text(f"نوع دارایی: {selected_trade['asset_type']}")
+                    st.text(f"نوع معامله: {selected_trade['trade_type']}")
+
+                    # Editable fields
+                    edit_quantity = st.number_input(
+                        "تعداد/مقدار", 
+                        min_value=0.0, 
+                        value=float(selected_trade['quantity']),
+                        key="edit_quantity"
+                    )
 
-                        edit_price = st.number_input(
-                            "قیمت واحد", 
-                            min_value=0.0, 
-                            value=float(selected_trade['price']),
-                            key="edit_price"
-                        )
+                    # واحد ارزی بالای قیمت واحد
+                    current_currency = selected_trade['currency'] if pd.notna(selected_trade['currency']) else "تومان"
+                    edit_currency = st.selectbox(
+                        "واحد ارزی",
+                        options=["تومان", "دلار"],
+                        index=0 if current_currency == "تومان" else 1,
+                        key="edit_currency"
+                    )
 
-                        # Calculate total
-                        edit_total_amount = edit_quantity * edit_price
-                        st.write(f"مبلغ کل: {format_number(edit_total_amount)} {edit_currency}")
-
-                        # Add is_profit_sale if it's a sell trade
-                        edit_is_profit_sale = False
-                        if selected_trade['trade_type'] == 'فروش':
-                            current_is_profit = selected_trade['is_profit_sale'] if 'is_profit_sale' in selected_trade and pd.notna(selected_trade['is_profit_sale']) else False
-                            edit_is_profit_sale = st.checkbox(
-                                "این فروش از محل سود معاملات قبلی انجام شده است",
-                                value=current_is_profit,
-                                key="edit_is_profit_sale_checkbox"
-                            )
-
-                        # Notes
-                        edit_notes = st.text_area(
-                            "توضیحات", 
-                            value=selected_trade['notes'] if pd.notna(selected_trade['notes']) else "",
-                            key="edit_notes"
-                        )
+                    edit_price = st.number_input(
+                        "قیمت واحد", 
+                        min_value=0.0, 
+                        value=float(selected_trade['price']),
+                        key="edit_price"
+                    )
 
-                        # Submit button
-                        edit_submitted = st.form_submit_button("ذخیره تغییرات")
-
-                        if edit_submitted:
-                            # Update the trade in the database
-                            conn = get_connection()
-                            cursor = conn.cursor()
-
-                            # Prepare parameters
-                            params = {
-                                'trade_date': edit_trade_date,
-                                'quantity': edit_quantity,
-                                'price': edit_price,
-                                'total_amount': edit_total_amount,
-                                'notes': edit_notes,
-                                'currency': edit_currency,
-                                'id': selected_trade_id
-                            }
-
-                            # Add is_profit_sale if it's a sell trade
-                            if selected_trade['trade_type'] == 'فروش':
-                                params['is_profit_sale'] = edit_is_profit_sale
-
-                            # Execute update query
-                            if USE_SQLITE:
-                                if selected_trade['trade_type'] == 'فروش':
-                                    cursor.execute('''
-                                        UPDATE trades 
-                                        SET trade_date = ?, quantity = ?, price = ?, 
-                                            total_amount = ?, notes = ?, currency = ?, is_profit_sale = ?
-                                        WHERE id = ?
-                                    ''', (params['trade_date'], params['quantity'], params['price'], 
-                                         params['total_amount'], params['notes'], params['currency'], 
-                                         params['is_profit_sale'], params['id']))
-                                else:
-                                    cursor.execute('''
-                                        UPDATE trades 
-                                        SET trade_date = ?, quantity = ?, price = ?, 
-                                            total_amount = ?, notes = ?, currency = ?
-                                        WHERE id = ?
-                                    ''', (params['trade_date'], params['quantity'], params['price'], 
-                                         params['total_amount'], params['notes'], params['currency'], 
-                                         params['id']))
-                            else:
-                                if selected_trade['trade_type'] == 'فروش':
-                                    cursor.execute('''
-                                        UPDATE trades 
-                                        SET trade_date = %s, quantity = %s, price = %s, 
-                                            total_amount = %s, notes = %s, currency = %s, is_profit_sale = %s
-                                        WHERE id = %s
-                                    ''', (params['trade_date'], params['quantity'], params['price'], 
-                                         params['total_amount'], params['notes'], params['currency'], 
-                                         params['is_profit_sale'], params['id']))
-                                else:
-                                    cursor.execute('''
-                                        UPDATE trades 
-                                        SET trade_date = %s, quantity = %s, price = %s, 
-                                            total_amount = %s, notes = %s, currency = %s
-                                        WHERE id = %s
-                                    ''', (params['trade_date'], params['quantity'], params['price'], 
-                                         params['total_amount'], params['notes'], params['currency'], 
-                                         params['id']))
-
-                            conn.commit()
-
-                            # Recalculate asset data
-                            recalculate_asset_data(selected_trade['asset_name'], selected_trade['asset_type'])
-
-                            conn.close()
-                            st.success("معامله با موفقیت ویرایش شد.")
-                            st.rerun()
+                    # Calculate total
+                    edit_total_amount = edit_quantity * edit_price
+                    st.write(f"مبلغ کل: {format_number(edit_total_amount)} {edit_currency}")
+
+                    # Add is_profit_sale if it's a sell trade
+                    edit_is_profit_sale = False
+                    if selected_trade['trade_type'] == 'فروش':
+                        current_is_profit = selected_trade['is_profit_sale'] if 'is_profit_sale' in selected_trade and pd.notna(selected_trade['is_profit_sale']) else False
+                        edit_is_profit_sale = st.checkbox(
+                            "این فروش از محل سود معاملات قبلی انجام شده است",
+                            value=current_is_profit,
+                            key="edit_is_profit_sale_checkbox"
+                        )
 
-                with delete_tab:
-                    st.write(f"حذف معامله {selected_trade['asset_name']} در تاریخ {selected_trade['jalali_date']}")
-                    st.warning("توجه: حذف این معامله ممکن است بر روی داده‌های دیگر تأثیر بگذارد.")
+                    # Notes
+                    edit_notes = st.text_area(
+                        "توضیحات", 
+                        value=selected_trade['notes'] if pd.notna(selected_trade['notes']) else "",
+                        key="edit_notes"
+                    )
 
-                    # Confirm deletion
-                    if st.button("تأیید حذف معامله", key="confirm_delete"):
-                        # Delete the trade
-                        if delete_trade(selected_trade_id):
-                            st.success("معامله با موفقیت حذف شد.")
+                    # Submit button
+                    edit_submitted = st.form_submit_button("ذخیره تغییرات")
+
+                    if edit_submitted:
+                        # Update the trade, its Jalali date and the asset in one transaction
+                        if edit_trade(
+                            selected_trade_id, edit_trade_date,
+                            selected_trade['asset_name'], selected_trade['asset_type'],
+                            selected_trade['trade_type'], edit_quantity, edit_price, edit_notes,
+                            currency=edit_currency,
+                            is_profit_sale=edit_is_profit_sale if selected_trade['trade_type'] == 'فروش' else None
+                        ):
+                            st.success("معامله با موفقیت ویرایش شد.")
                             st.rerun()
                         else:
-                            st.error("خطا در حذف معامله.")
+                            st.error("خطا در ویرایش معامله. لطفا دوباره تلاش کنید.")
 
-        else:
-            st.info("هنوز معامله‌ای ثبت نشده است.")
\ No newline at end of file
+            with delete_tab:
+                st.write(f"حذف معامله {selected_trade['asset_name']} در تاریخ {selected_trade['jalali_date']}")
+                st.warning("توجه: حذف این معامله ممکن است بر روی داده‌های دیگر تأثیر بگذارد.")
+
+                # Confirm deletion
+                if st.button("تأیید حذف معامله", key="confirm_delete"):
+                    # Delete the trade
+                    if delete_trade(selected_trade_id):
+                        st.success("معامله با موفقیت حذف شد.")
+                        st.rerun()
+                    else:
+                        st.error("خطا در حذف معامله.")
\ No newline at end of file
@@ -1,6 +1,13 @@
 import jdatetime
 from datetime import datetime
 import locale
+import numpy as np
+import pandas as pd
+
+# Day offsets of the first day of each Jalali month within its year
+_JALALI_MONTH_STARTS = np.array([0, 31, 62, 93, 124, 155, 186, 216, 246, 276, 306, 336])
+# Day 0 of the arithmetic below; 1 Farvardin 979 is 79 days later
+_JALALI_EPOCH = np.datetime64('1600-01-01', 'D')
 
 def convert_to_jalali(gregorian_date):
     """
@@ -23,6 +30,75 @@ def convert_to_jalali(gregorian_date):
     
     return jdatetime.datetime.fromgregorian(datetime=gregorian_date)
 
+def _to_days(dates):
+    # SQLite hands dates back as strings, with or without microseconds
+    if not isinstance(dates, pd.Series):
+        dates = pd.Series(np.asarray(dates))
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, format='ISO8601')
+    return dates.to_numpy().astype('datetime64[D]')
+
+def jalali_components(dates):
+    """
+    Convert many Gregorian dates to Jalali (Shamsi) year, month and day at once.
+    
+    Uses the same 33-year cycle arithmetic as jdatetime, on whole NumPy arrays
+    of day numbers instead of one object per date. The time of day is ignored.
+    
+    Args:
+        dates (Series or ndarray): datetime64 values, or anything pd.to_datetime accepts
+        
+    Returns:
+        tuple: (years, months, days) as int64 arrays, 0 where the date is missing
+    """
+    values = _to_days(dates)
+    missing = np.isnat(values)
+    
+    day_number = (values - _JALALI_EPOCH).astype(np.int64) - 79
+    day_number[missing] = 0
+    
+    cycles, day_number = np.divmod(day_number, 12053)
+    years = 979 + 33 * cycles + 4 * (day_number // 1461)
+    day_number = day_number % 1461
+    
+    # Days past the first (366-day) year of each 4-year group
+    late = day_number >= 366
+    years = years + np.where(late, (day_number - 1) // 365, 0)
+    day_number = np.where(late, (day_number - 1) % 365, day_number)
+    
+    months = np.searchsorted(_JALALI_MONTH_STARTS, day_number, side='right')
+    days = day_number - _JALALI_MONTH_STARTS[months - 1] + 1
+    
+    years[missing] = months[missing] = days[missing] = 0
+    return years, months, days
+
+def format_jalali_dates(dates, separator='/'):
+    """
+    Format a column of Gregorian dates as Jalali (Shamsi) date strings.
+    
+    Each distinct day is converted and formatted once, which is what a trade
+    journal with many trades per day needs.
+    
+    Args:
+        dates (Series or ndarray): datetime64 values, or anything pd.to_datetime accepts
+        separator (str): Separator between year, month and day
+        
+    Returns:
+        Series: 'YYYY/MM/DD' strings (missing where the date is missing),
+            with the index of dates if it is a Series
+    """
+    index = dates.index if isinstance(dates, pd.Series) else None
+    
+    unique_days, positions = np.unique(_to_days(dates), return_inverse=True)
+    years, months, days = jalali_components(unique_days)
+    
+    labels = (pd.Series(years).astype(str) + separator +
+              pd.Series(months).astype(str).str.zfill(2) + separator +
+              pd.Series(days).astype(str).str.zfill(2)).to_numpy(dtype=object)
+    labels[np.isnat(unique_days)] = None
+    
+    return pd.Series(labels[positions.reshape(-1)], index=index)
+
 def convert_to_gregorian(jalali_date):
     """
     Convert a Jalali (Shamsi) date to Gregorian date.